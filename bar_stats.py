@@ -0,0 +1,162 @@
+"""
+This script computes the statistics used to compare the types of bars (as in analysis.ipynb)
+for many symbols at once. The returns of a bar series are computed once and all the
+statistics are derived from them: mean, standard deviation, skewness, kurtosis, Jarque-Bera,
+autocorrelations and the dispersion of the daily bar count. The series are processed in
+parallel by a pool of processes. The thresholds of the tick, volume and dollar bars of a
+symbol can be calibrated from one pass over its trades.
+"""
+import os
+import glob
+from typing import Union
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from bars import bar_ends
+from datasets import load_bars
+
+
+def return_statistics(close: np.ndarray, timestamp: pd.DatetimeIndex = None, lags: tuple = (1,)):
+    """
+    Compute the statistics of the returns of a bar series.
+    The skewness and the (excess) kurtosis are the biased estimators, as scipy.stats.skew and
+    scipy.stats.kurtosis, and the standard deviation has one degree of freedom, as pandas.
+    :param close :(np.ndarray) the close prices of the bars.
+    :param timestamp :(pd.DatetimeIndex) the timestamps of the bars, for the daily bar count.
+    :param lags :(tuple) the lags of the autocorrelations.
+    :return :(dict) the statistics.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    ret = close[1:] / close[:-1] - 1
+    ret = ret[np.isfinite(ret)]
+    n = len(ret)
+    stats = {'bars': len(close), 'returns': n}
+    if n > 1:
+        mean = ret.mean()
+        dev = ret - mean
+        dev2 = dev * dev
+        m2 = dev2.mean()
+        m3 = (dev2 * dev).mean()
+        m4 = (dev2 * dev2).mean()
+        skew = m3 / m2 ** 1.5 if m2 > 0 else np.nan
+        kurt = m4 / (m2 * m2) - 3 if m2 > 0 else np.nan
+        stats.update({
+            'mean': mean,
+            'std': np.sqrt(m2 * n / (n - 1)),
+            'skew': skew,
+            'kurtosis': kurt,
+            'jarque-bera': n / 6 * (skew * skew + kurt * kurt / 4)})
+    else:
+        stats.update({'mean': np.nan, 'std': np.nan, 'skew': np.nan,
+                      'kurtosis': np.nan, 'jarque-bera': np.nan})
+    for lag in lags:
+        # the Pearson correlation of the returns with the lagged returns, as pd.Series.autocorr
+        if 0 < lag < n - 1:
+            stats[f'autocorr_{lag}'] = np.corrcoef(ret[lag:], ret[:-lag])[0, 1]
+        else:
+            stats[f'autocorr_{lag}'] = np.nan
+    if timestamp is not None and len(timestamp):
+        if timestamp.tz is not None:
+            # count the bars by day of the local time
+            timestamp = timestamp.tz_localize(None)
+        _, counts = np.unique(timestamp.values.astype('datetime64[D]'), return_counts=True)
+        stats.update({
+            'days': len(counts),
+            'daily_count_mean': counts.mean(),
+            'daily_count_std': counts.std(ddof=1) if len(counts) > 1 else np.nan})
+    return stats
+
+
+def _series_statistics(task: tuple):
+    """
+    Compute the statistics of a bar series in a worker process.
+    :param task :(tuple) the key, the path of the CSV (or the DataFrame) of the bars, the lags
+                 and the trim option.
+    """
+    key, bars, lags, trim = task
+    if isinstance(bars, str):
+        bars = load_bars(bars, trim=trim, columns=['close'])
+    stats = return_statistics(bars['close'].to_numpy(), bars.index, lags)
+    return key, stats
+
+
+def bar_statistics(datasets: dict, lags: tuple = (1,), trim: bool = True, processes: int = None):
+    """
+    Compute the statistics of many bar series in parallel.
+    :param datasets :(dict) the bars with (symbol, bar_type) keys and the paths of their CSV or
+                     DataFrames with a "close" column indexed by timestamp as values.
+    :param lags :(tuple) the lags of the autocorrelations.
+    :param trim :(bool) keep only the bars of the regular session when reading the CSV files.
+    :param processes :(int) the number of worker processes. If None the number of CPUs is used,
+                      with 1 the series are processed in this process.
+    :return :(pd.DataFrame) the statistics indexed by symbol and bar type.
+    """
+    tasks = [(key, bars, tuple(lags), trim) for key, bars in datasets.items()]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(tasks) < 2:
+        results = [_series_statistics(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(tasks))) as pool:
+            chunksize = max(len(tasks) // (4 * processes), 1)
+            results = list(pool.map(_series_statistics, tasks, chunksize=chunksize))
+    stats = pd.DataFrame([s for _, s in results], index=pd.MultiIndex.from_tuples(
+        [key for key, _ in results], names=['symbol', 'bar_type']))
+    return stats
+
+
+def threshold_statistics(trades: pd.DataFrame, thresholds: dict, lags: tuple = (1,),
+                         tz: str = 'US/Eastern'):
+    """
+    Compute the statistics of the bars of several candidate thresholds from one tick history, to
+    pick the threshold of every bar type. The cumulative tick, volume and dollar series are
+    computed once and the bars of every threshold are located in them, so only the close of
+    every bar is formed and the cost is about one pass over the trades.
+    :param trades :(pd.DataFrame) the trades of a symbol with "price" and "size" columns and the
+                   timestamps either in a "timestamp" column or as the index.
+    :param thresholds :(dict) the candidate thresholds with the bar types as keys, e.g.
+                       {"volume_bar": [50000, 100000], "dollar_bar": [1e7, 2e7]}.
+    :param lags :(tuple) the lags of the autocorrelations.
+    :param tz :(str) the timezone of the exchange, used to count the bars per day. Naive
+               timestamps are taken as UTC.
+    :return :(pd.DataFrame) the statistics (daily_count_mean is the number of bars per day)
+             indexed by bar type and threshold.
+    """
+    if 'timestamp' in trades.columns:
+        timestamp = pd.DatetimeIndex(trades['timestamp'])
+    else:
+        timestamp = pd.DatetimeIndex(trades.index)
+    if timestamp.tz is None:
+        timestamp = timestamp.tz_localize('UTC')
+    timestamp = timestamp.tz_convert(tz)
+    price = trades['price'].to_numpy(dtype=np.float64)
+    size = trades['size'].to_numpy(dtype=np.float64)
+    keys, results = [], []
+    for bar_type, values in thresholds.items():
+        for threshold, ends in bar_ends(bar_type, values, price, size).items():
+            # the close of a bar is the price of its last trade
+            keys.append((bar_type, threshold))
+            results.append(return_statistics(price[ends - 1], timestamp[ends - 1], lags))
+    return pd.DataFrame(results, index=pd.MultiIndex.from_tuples(
+        keys, names=['bar_type', 'threshold']))
+
+
+def find_datasets(path: str, symbols: Union[str, list] = None, bar_types: list = None):
+    """
+    Find the bar CSV files named <symbol>_<bar_type>s.csv (e.g. AAPL_tick_bars.csv) in a directory.
+    :param path :(str) the directory of the files.
+    :param symbols :(str or list) the symbols to keep. If None all the symbols are kept.
+    :param bar_types :(list) the bar types to keep, e.g. ["tick_bar", "5minute_bar"]. If None all
+                      the bar types are kept.
+    :return :(dict) the paths of the files with (symbol, bar_type) keys.
+    """
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    datasets = {}
+    for file in sorted(glob.glob(os.path.join(path, '*_*.csv'))):
+        symbol, bar_type = os.path.basename(file)[:-len('.csv')].split('_', 1)
+        bar_type = bar_type[:-1] if bar_type.endswith('s') else bar_type
+        if (symbols is None or symbol in symbols) and (bar_types is None or bar_type in bar_types):
+            datasets[(symbol, bar_type)] = file
+    return datasets
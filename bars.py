@@ -3,84 +3,572 @@ This script will server backends for all Alternative Bars
 """
 import os
 from typing import Union
+from collections import namedtuple
 
 import csv
-import asyncio
+import logging
 import numpy as np
 import pandas as pd
 
 
+from checkpoint import Checkpointer
 from connection import Client
+from ingest import Ingest
+from metrics import Metrics
+from storage import HEADER, get_store
+from writer import BarWriter
 
-conn = Client().connect()
+# a trade of a batch passed to aggregate_bar
+_BatchTrade = namedtuple('_BatchTrade', ['symbol', 'price', 'size', 'timestamp'])
+
+# the cumulative metric tracked by each type of bar
+BAR_STATS = {
+    'tick_bar': 'cum_tick',
+    'volume_bar': 'cum_volume',
+    'dollar_bar': 'cum_dollar_value'}
+
+
+def _get_stat(bar_type: str):
+    """
+    Get the cumulative metric to track for a given type of bar.
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar"
+    :return :(str) the key of the tracked metric in the cumulative metrics.
+    """
+    if bar_type not in BAR_STATS:
+        raise ValueError(
+            f'{bar_type} is not a valid bar. Please enter either "dollar_bar","volume_bar", "tick_bar" '
+            f'or one of {list(INFORMATION_BARS)}')
+    return BAR_STATS[bar_type]
+
+
+class BarState:
+    """
+    The running state of a bar that is being formed. Only the aggregated values are kept,
+    so every trade is an O(1) update and the memory used per bar is constant.
+    """
+    __slots__ = (
+        'open',
+        'high',
+        'low',
+        'close',
+        'cum_tick',
+        'cum_volume',
+        'cum_dollar_value',
+        'cum_buy_tick',
+        'cum_buy_volume',
+        'cum_buy_dollar_value')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        A function to reset the aggregated values for a new bar.
+        """
+        self.open = self.high = self.low = self.close = None
+        self.cum_tick = 0
+        self.cum_volume = 0
+        self.cum_dollar_value = 0
+        self.cum_buy_tick = 0
+        self.cum_buy_volume = 0
+        self.cum_buy_dollar_value = 0
+
+    def update(self, price: float, size: int, buy: bool):
+        """
+        Add a trade to the bar.
+        :param price :(float) trade price.
+        :param size :(int) trade size.
+        :param buy :(bool) True if the trade was classified as a buy.
+        """
+        if self.open is None:
+            self.open = self.high = self.low = price
+        elif price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        dollar_value = price * size
+        self.cum_tick += 1
+        self.cum_volume += size
+        self.cum_dollar_value += dollar_value
+        if buy:
+            self.cum_buy_tick += 1
+            self.cum_buy_volume += size
+            self.cum_buy_dollar_value += dollar_value
+
+    def cum_count(self):
+        """
+        The cumulative metrics of the bar.
+        :return :(dict) the cumulative metrics keyed as in the saved bars.
+        """
+        return {
+            'cum_tick': self.cum_tick,
+            'cum_volume': self.cum_volume,
+            'cum_dollar_value': self.cum_dollar_value,
+            'cum_buy_tick': self.cum_buy_tick,
+            'cum_buy_volume': self.cum_buy_volume,
+            'cum_buy_dollar_value': self.cum_buy_dollar_value}
+
+    def get_state(self):
+        """
+        :return :(dict) the state of the bar.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with `get_state`.
+        :param state :(dict) the state of the bar.
+        """
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+
+class AdaptiveThreshold:
+    """
+    Adapts the threshold of a bar to the flow of the tracked metric (ticks, volume or dollar
+    value) so that the bars are formed at a target rate. At every bar close the metric and the
+    duration of the bar are added to exponentially weighted averages, their ratio estimates the
+    flow per second and the new threshold is the flow expected over the target bar duration.
+    The duration of a bar is capped at 4 times the target duration, so a bar over the night does
+    not collapse the threshold. It also slows the adjustment to a flow more than 4 times slower
+    than the threshold expects: the flow is overestimated and the threshold drops by at most a
+    factor of about 4 per span of bars, each of them long.
+    Every update is O(1) and the state can be saved with `get_state` and restored with `set_state`.
+    """
+    __slots__ = (
+        'threshold',
+        'bar_seconds',
+        'alpha',
+        'min_threshold',
+        'max_threshold',
+        'max_duration',
+        'ewm_metric',
+        'ewm_duration',
+        'last_close')
+
+    def __init__(
+            self,
+            threshold: float,
+            bars_per_day: int,
+            span: int = 50,
+            session_seconds: float = 23400,
+            bounds: tuple = (0.1, 10)):
+        """
+        :param threshold :(float) the initial threshold.
+        :param bars_per_day :(int) the target number of bars per session.
+        :param span :(int) the span (in bars) of the exponentially weighted averages.
+        :param session_seconds :(float) the length of a session in seconds (6.5 hours by default).
+        :param bounds :(tuple) the minimum and maximum threshold as multiples of the initial one.
+        """
+        self.threshold = threshold
+        self.bar_seconds = session_seconds / bars_per_day
+        self.alpha = 2 / (span + 1)
+        self.min_threshold = threshold * bounds[0]
+        self.max_threshold = threshold * bounds[1]
+        # longer durations (e.g. a bar over the night) are capped
+        self.max_duration = 4 * self.bar_seconds
+        # the averages start at the target so the first bars move the threshold gradually
+        self.ewm_metric = float(threshold)
+        self.ewm_duration = self.bar_seconds
+        # the time of the last bar close in seconds since the epoch
+        self.last_close = None
+
+    def update(self, metric: float, timestamp):
+        """
+        Update the threshold with a closed bar.
+        :param metric :(float) the tracked metric of the bar.
+        :param timestamp : the time of the last trade of the bar.
+        :return :(float) the new threshold.
+        """
+        now = pd.Timestamp(timestamp).timestamp()
+        if self.last_close is None:
+            # the duration of the first bar is unknown
+            self.last_close = now
+            return self.threshold
+        duration = min(max(now - self.last_close, 0.0), self.max_duration)
+        self.last_close = now
+        alpha = self.alpha
+        self.ewm_metric += alpha * (metric - self.ewm_metric)
+        self.ewm_duration += alpha * (duration - self.ewm_duration)
+        if self.ewm_duration > 0:
+            threshold = self.ewm_metric / self.ewm_duration * self.bar_seconds
+            self.threshold = min(max(threshold, self.min_threshold), self.max_threshold)
+        return self.threshold
+
+    def get_state(self):
+        """
+        :return :(dict) the state of the threshold.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with `get_state`.
+        :param state :(dict) the state of the threshold.
+        """
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+
+def _tick_value(metric: str, price: float, size: float):
+    """
+    The contribution of a trade to a metric: one per tick, its size or its dollar value.
+    """
+    if metric == 'tick':
+        return 1
+    if metric == 'volume':
+        return size
+    return price * size
+
+
+class ImbalanceRule:
+    """
+    The sampling rule of the tick, volume and dollar imbalance bars. A bar closes when the
+    absolute sum of the signed metric (the tick rule sign times 1, the size or the dollar value)
+    reaches the expected number of ticks per bar times the absolute expected imbalance per tick.
+    Both expectations are exponentially weighted averages updated at every bar close, so every
+    tick is an O(1) update. The first bar closes after the initial expected number of ticks.
+    The threshold is at least the imbalance of the minimum number of ticks all on one side, so
+    the bars do not collapse when the expected imbalance is close to zero.
+    """
+    __slots__ = (
+        'metric',
+        'alpha',
+        'expected_ticks',
+        'expected_imbalance',
+        'expected_value',
+        'min_ticks',
+        'max_ticks',
+        'sign',
+        'ticks',
+        'imbalance',
+        'value')
+
+    def __init__(self, metric: str, expected_ticks: float, span: int = 20, bounds: tuple = (0.1, 10)):
+        """
+        :param metric :(str) the signed metric. Either "tick", "volume" or "dollar".
+        :param expected_ticks :(float) the initial expected number of ticks per bar.
+        :param span :(int) the span (in bars) of the exponentially weighted averages.
+        :param bounds :(tuple) the minimum and maximum expected number of ticks as multiples
+                       of the initial one, to stop the bars from collapsing or never closing.
+        """
+        self.metric = metric
+        self.alpha = 2 / (span + 1)
+        self.expected_ticks = float(expected_ticks)
+        # set at the close of the first bar
+        self.expected_imbalance = None
+        # the expected absolute metric per tick, for the minimum threshold
+        self.expected_value = None
+        self.min_ticks = max(expected_ticks * bounds[0], 1)
+        self.max_ticks = expected_ticks * bounds[1]
+        # the last non-zero tick rule sign, used for the trades without a price change
+        self.sign = 0
+        self.ticks = 0
+        self.imbalance = 0
+        self.value = 0
+
+    def threshold(self):
+        """
+        :return :(float) the absolute imbalance closing the current bar or None for the first bar.
+        """
+        if self.expected_imbalance is None:
+            return None
+        return max(self.expected_ticks * abs(self.expected_imbalance),
+                   self.min_ticks * self.expected_value)
+
+    def update(self, sign: int, price: float, size: float):
+        """
+        Add a trade to the bar.
+        :param sign :(int) the tick rule sign of the trade.
+        :param price :(float) trade price.
+        :param size :(float) trade size.
+        :return :(bool) True if the trade closes the bar.
+        """
+        if sign:
+            self.sign = sign
+        self.ticks += 1
+        value = _tick_value(self.metric, price, size)
+        self.imbalance += self.sign * value
+        self.value += value
+        if self.expected_imbalance is None:
+            return self.ticks >= self.expected_ticks
+        return abs(self.imbalance) >= max(self.expected_ticks * abs(self.expected_imbalance),
+                                          self.min_ticks * self.expected_value)
+
+    def close(self):
+        """
+        Update the expectations with the current bar and start a new one.
+        """
+        self.close_bar(self.ticks, self.imbalance, self.value)
+        self.ticks = 0
+        self.imbalance = 0
+        self.value = 0
+
+    def close_bar(self, ticks: int, imbalance: float, value: float):
+        """
+        Update the expectations with a closed bar.
+        :param ticks :(int) the number of ticks of the bar.
+        :param imbalance :(float) the sum of the signed metric of the bar.
+        :param value :(float) the sum of the metric of the bar.
+        """
+        if self.expected_imbalance is None:
+            self.expected_imbalance = imbalance / ticks
+            self.expected_value = value / ticks
+            return
+        alpha = self.alpha
+        self.expected_imbalance += alpha * (imbalance / ticks - self.expected_imbalance)
+        self.expected_value += alpha * (value / ticks - self.expected_value)
+        expected_ticks = self.expected_ticks + alpha * (ticks - self.expected_ticks)
+        self.expected_ticks = min(max(expected_ticks, self.min_ticks), self.max_ticks)
+
+    def get_state(self):
+        """
+        :return :(dict) the state of the rule and of its current bar.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with `get_state`.
+        :param state :(dict) the state of the rule and of its current bar.
+        """
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+
+class RunRule:
+    """
+    The sampling rule of the tick, volume and dollar run bars. A bar closes when the larger of
+    the metric bought and the metric sold (by tick rule) reaches the expected number of ticks
+    per bar times the larger of P[buy] * E[metric of a buy] and P[sell] * E[metric of a sell].
+    The expectations are exponentially weighted averages updated at every bar close, so every
+    tick is an O(1) update. The first bar closes after the initial expected number of ticks.
+    The expected number of ticks is kept at its initial value: the larger of the two runs
+    reaches the threshold before the expected number of ticks (it includes the noise of the
+    split between buys and sells), so an average of the bar lengths shrinks at every bar until
+    the bars collapse to a few ticks. The threshold still adapts to the flow through the
+    share of buys and the expected metric of a buy and of a sell.
+    """
+    __slots__ = (
+        'metric',
+        'alpha',
+        'expected_ticks',
+        'buy_share',
+        'buy_value',
+        'sell_value',
+        'sign',
+        'ticks',
+        'buys',
+        'sells',
+        'buy_run',
+        'sell_run')
+
+    def __init__(self, metric: str, expected_ticks: float, span: int = 20):
+        """
+        :param metric :(str) the metric of the runs. Either "tick", "volume" or "dollar".
+        :param expected_ticks :(float) the expected number of ticks per bar.
+        :param span :(int) the span (in bars) of the exponentially weighted averages.
+        """
+        self.metric = metric
+        self.alpha = 2 / (span + 1)
+        self.expected_ticks = float(expected_ticks)
+        # set at the close of the first bar
+        self.buy_share = None
+        self.buy_value = None
+        self.sell_value = None
+        # the last non-zero tick rule sign, used for the trades without a price change
+        self.sign = 0
+        self.ticks = self.buys = self.sells = 0
+        self.buy_run = self.sell_run = 0
+
+    def threshold(self):
+        """
+        :return :(float) the run closing the current bar or None for the first bar.
+        """
+        if self.buy_share is None:
+            return None
+        return self.expected_ticks * max(self.buy_share * self.buy_value,
+                                         (1 - self.buy_share) * self.sell_value)
+
+    def update(self, sign: int, price: float, size: float):
+        """
+        Add a trade to the bar.
+        :param sign :(int) the tick rule sign of the trade.
+        :param price :(float) trade price.
+        :param size :(float) trade size.
+        :return :(bool) True if the trade closes the bar.
+        """
+        if sign:
+            self.sign = sign
+        self.ticks += 1
+        if self.sign > 0:
+            self.buys += 1
+            self.buy_run += _tick_value(self.metric, price, size)
+        elif self.sign < 0:
+            self.sells += 1
+            self.sell_run += _tick_value(self.metric, price, size)
+        if self.buy_share is None:
+            return self.ticks >= self.expected_ticks
+        return max(self.buy_run, self.sell_run) >= self.expected_ticks * max(
+            self.buy_share * self.buy_value, (1 - self.buy_share) * self.sell_value)
+
+    def close(self):
+        """
+        Update the expectations with the current bar and start a new one.
+        """
+        self.close_bar(self.ticks, self.buys, self.sells, self.buy_run, self.sell_run)
+        self.ticks = self.buys = self.sells = 0
+        self.buy_run = self.sell_run = 0
+
+    def close_bar(self, ticks: int, buys: int, sells: int, buy_run: float, sell_run: float):
+        """
+        Update the expectations with a closed bar.
+        :param ticks :(int) the number of ticks of the bar.
+        :param buys :(int) the number of buys of the bar.
+        :param sells :(int) the number of sells of the bar.
+        :param buy_run :(float) the metric bought in the bar.
+        :param sell_run :(float) the metric sold in the bar.
+        """
+        share = buys / ticks
+        if self.buy_share is None:
+            self.buy_share = share
+            self.buy_value = buy_run / buys if buys else 0.0
+            self.sell_value = sell_run / sells if sells else 0.0
+            return
+        alpha = self.alpha
+        self.buy_share += alpha * (share - self.buy_share)
+        # the average metric of a side is only updated by the bars with trades on that side
+        if buys:
+            self.buy_value += alpha * (buy_run / buys - self.buy_value)
+        if sells:
+            self.sell_value += alpha * (sell_run / sells - self.sell_value)
+
+    def get_state(self):
+        """
+        :return :(dict) the state of the rule and of its current bar.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with `get_state`.
+        :param state :(dict) the state of the rule and of its current bar.
+        """
+        for name in self.__slots__:
+            setattr(self, name, state[name])
+
+
+# the sampling rule and the metric of the information-driven bars
+INFORMATION_BARS = {
+    'tick_imbalance_bar': (ImbalanceRule, 'tick'),
+    'volume_imbalance_bar': (ImbalanceRule, 'volume'),
+    'dollar_imbalance_bar': (ImbalanceRule, 'dollar'),
+    'tick_run_bar': (RunRule, 'tick'),
+    'volume_run_bar': (RunRule, 'volume'),
+    'dollar_run_bar': (RunRule, 'dollar')}
 
 
 class EventDrivenBars:
 
-    def __init__(self, bar_type: str, threshold: int, savefile: str):
+    def __init__(self, bar_type: str, threshold: int, savefile: str, writer: BarWriter = None,
+                 adaptive: AdaptiveThreshold = None):
         """
         This is a base class for generating EventDrivenBars.
-        :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar"
-        :param threshold :(int) threshold value for sampling.
+        :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar", "dollar_bar"
+                         or one of the imbalance or run bars in INFORMATION_BARS.
+        :param threshold :(int) threshold value for sampling. For the imbalance and run bars it is
+                          the initial expected number of ticks per bar.
         :param savefile :(str) the path to store the bars as CSV.
+        :param writer :(BarWriter) a shared writer to queue the bars to. If None every bar is
+                       written to the savefile as soon as it is formed.
+        :param adaptive :(AdaptiveThreshold) adapts the threshold at every bar close. If None the
+                         threshold is fixed. Not used by the imbalance and run bars, whose
+                         thresholds always adapt.
         """
-        # initialize the threshold and savefile
+        # initialize the threshold, savefile and writer
+        self.bar_type = bar_type
         self.threshold = threshold
         self.save_file = savefile
+        self.writer = writer
+        self.adaptive = adaptive
         # a variable to store the previous trade price
         self.prev_price = None
-        # store price volume and trade_side
-        self.price, self.volume, self.trade_side = [], [], []
-        # aggregated values count (cumulative metrics)
-        self.cum_count = {
-            'cum_tick': 0,
-            'cum_volume': 0,
-            'cum_dollar_value': 0,
-            'cum_buy_tick': 0,
-            'cum_buy_volume': 0,
-            'cum_buy_dollar_value': 0}
-        # setting tracking metric
-        if bar_type == 'dollar_bar':
-            self.stat = 'cum_dollar_value'
-        elif bar_type == 'volume_bar':
-            self.stat = 'cum_volume'
-        elif bar_type == 'tick_bar':
-            self.stat = 'cum_tick'
+        # the aggregated values (cumulative metrics) of the current bar
+        self.state = BarState()
+        # setting tracking metric or the sampling rule of the information-driven bars
+        self.stat = None
+        self.rule = None
+        if bar_type in INFORMATION_BARS:
+            rule, metric = INFORMATION_BARS[bar_type]
+            self.rule = rule(metric, threshold)
         else:
-            raise ValueError(
-                f'{bar_type} is not a valid bar. Please enter either "dollar_bar","volume_bar" or "tick_bar"')
+            self.stat = _get_stat(bar_type)
+
+    @property
+    def cum_count(self):
+        """
+        The cumulative metrics of the current bar.
+        """
+        return self.state.cum_count()
 
     def _reset_cache(self):
         """
         A function to reset the aggregated values and variables.
         """
-        self.cum_count = {
-            'cum_tick': 0,
-            'cum_volume': 0,
-            'cum_dollar_value': 0,
-            'cum_buy_tick': 0,
-            'cum_buy_volume': 0,
-            'cum_buy_dollar_value': 0}
-        self.price, self.volume, self.trade_side = [], [], []
+        self.state.reset()
+
+    def get_state(self):
+        """
+        The state of the bar being formed, the tick rule and the threshold, to resume the bar
+        after a restart with `set_state`.
+        :return :(dict) the state of the instance.
+        """
+        return {
+            'bar_type': self.bar_type,
+            'threshold': self.threshold,
+            'prev_price': self.prev_price,
+            'bar': self.state.get_state(),
+            'adaptive': self.adaptive.get_state() if self.adaptive is not None else None,
+            'rule': self.rule.get_state() if self.rule is not None else None}
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with `get_state`. A fixed threshold is kept as configured, an
+        adapted one is restored.
+        :param state :(dict) the state of the instance.
+        """
+        if state['bar_type'] != self.bar_type:
+            raise ValueError(f'The state of a {state["bar_type"]} cannot be restored in a {self.bar_type}')
+        self.prev_price = state['prev_price']
+        self.state.set_state(state['bar'])
+        if self.adaptive is not None and state['adaptive'] is not None:
+            self.adaptive.set_state(state['adaptive'])
+            self.threshold = state['threshold']
+        if self.rule is not None and state['rule'] is not None:
+            self.rule.set_state(state['rule'])
 
     def _check_tick_sign(self, price: float):
         """
         A function to calculate the side of the trade based on tick rule.
         :param price :(float) current price.
         """
-        if self.prev_price is None:
-            self.prev_price = price
+        prev_price = self.prev_price
+        self.prev_price = price
+        if prev_price is None or price == prev_price:
             return 0
         # sign of the change or difference from LTP
-        sign = np.sign(price - self.prev_price)
-        self.prev_price = price
-        return sign
+        return 1 if price > prev_price else -1
 
     def save_bar(self, bar: list):
         """
         Append the bars to the CSV using pandas.
         :param bar :(list)  the dictionary of a bar containing the aggregated values.
         """
+        if self.writer is not None:
+            # the writer appends the bar from its background thread
+            self.writer.write(self.bar_type, bar)
+            return
         # Open file in append mode
         with open(self.save_file, 'a+', newline='') as write_obj:
             # Create a writer object from csv module
@@ -93,109 +581,805 @@ class EventDrivenBars:
         Aggregate with the arrival of new trades data
         :param data : A data object containing the ticks of a single timestamp or tick.
         """
-        self.cum_count['cum_tick'] += 1
-        self.cum_count['cum_volume'] += data.size
-        self.cum_count['cum_dollar_value'] += data.price * data.size
-        self.price.append(data.price)
-        self.volume.append(data.size)
-        # check the side of the trade
-        tick_sign = self._check_tick_sign(data.price)
-        if tick_sign > 0:
-            self.cum_count['cum_buy_tick'] += 1
-            self.cum_count['cum_buy_volume'] += data.size
-            self.cum_count['cum_buy_dollar_value'] += data.price * data.size
-
-        if self.cum_count[self.stat] >= self.threshold:
-            vwap = np.multiply(self.price, self.volume).sum() / \
-                sum(self.volume)  # getting the vwap
+        state = self.state
+        # check the side of the trade and add it to the bar
+        sign = self._check_tick_sign(data.price)
+        state.update(data.price, data.size, sign > 0)
+        if self.rule is None:
+            closed = getattr(state, self.stat) >= self.threshold
+        else:
+            closed = self.rule.update(sign, data.price, data.size)
+
+        if closed:
             bar = {
-                'timestamp': str(
-                    data.timestamp), "symbol": data.symbol, 'open': self.price[0], 'high': max(
-                    self.price), 'low': min(
-                    self.price), 'close': data.price, 'vwap': vwap}
+                'timestamp': str(data.timestamp),
+                'symbol': data.symbol,
+                'open': state.open,
+                'high': state.high,
+                'low': state.low,
+                'close': state.close,
+                'vwap': state.cum_dollar_value / state.cum_volume}  # getting the vwap
             # join the cumulative metrics to the bar
-            bar.update(self.cum_count)
+            bar.update(state.cum_count())
             # save the bar
             self.save_bar(list(bar.values()))
+            if self.rule is not None:
+                # update the expected bar length and imbalance (or runs)
+                self.rule.close()
+            elif self.adaptive is not None:
+                # the next bar uses the threshold adapted to the recent flow
+                self.threshold = self.adaptive.update(getattr(state, self.stat), data.timestamp)
             self._reset_cache()
             return bar
         return False
 
+    def aggregate_trades(self, trades: list, split: bool = False):
+        """
+        Aggregate a group of trades at once, e.g. the trades of one message of the Streaming API.
+        :param trades :(list) the data objects of the trades in the order they arrived.
+        :param split :(bool) split the prints crossing the threshold, see aggregate_batch.
+        :return :(list) the bars closed by the trades.
+        """
+        if not trades:
+            return []
+        return self.aggregate_batch([t.price for t in trades], [t.size for t in trades],
+                                    [t.timestamp for t in trades], trades[0].symbol, split)
+
+    def aggregate_batch(self, price, size, timestamp, symbol: str = None, split: bool = False):
+        """
+        Aggregate a group of trades at once. The threshold crossings are found with a binary
+        search over the cumulative metric of the batch and the bars are aggregated with
+        reductions, so a burst of trades costs a few array operations instead of a call per trade.
+        The trades after the last crossing stay in the current bar.
+        Without split the bars are the same as the ones of aggregate_bar (up to floating point
+        rounding of the cumulative dollar value at an exact tie with the threshold). The
+        imbalance and run bars are aggregated one trade at a time as their rule depends on
+        every tick.
+        :param price :(np.ndarray) the trade prices.
+        :param size :(np.ndarray) the trade sizes, all positive.
+        :param timestamp :(np.ndarray) the trade timestamps.
+        :param symbol :(str) the ticker symbol.
+        :param split :(bool) for the volume and dollar bars, cut a print crossing the threshold at
+                      the threshold and carry the rest to the next bars, so a block trade several
+                      times the threshold closes several full bars. Every piece keeps the price,
+                      side and timestamp of its print and counts as one tick.
+        :return :(list) the bars closed by the trades.
+        """
+        price = np.asarray(price, dtype=np.float64)
+        size = np.asarray(size, dtype=np.float64)
+        n = len(price)
+        if n == 0:
+            return []
+        if isinstance(timestamp, pd.Series):
+            # index the timestamps by position
+            timestamp = timestamp.array
+        if self.rule is not None:
+            bars = []
+            for p, q, t in zip(price.tolist(), size.tolist(), timestamp):
+                bar = self.aggregate_bar(_BatchTrade(symbol, p, q, t))
+                if bar:
+                    bars.append(bar)
+            return bars
+        state = self.state
+        # the side of the trades based on tick rule
+        sign = np.empty(n)
+        sign[1:] = np.sign(np.diff(price))
+        sign[0] = 0 if self.prev_price is None else np.sign(price[0] - self.prev_price)
+        self.prev_price = float(price[-1])
+        buy = sign > 0
+        dollar = price * size
+        metric = {'cum_tick': np.ones(n), 'cum_volume': size, 'cum_dollar_value': dollar}[self.stat]
+        cum = np.zeros(n + 1)
+        np.cumsum(metric, out=cum[1:])
+        split = split and self.stat != 'cum_tick'
+        # find the bar closes as positions in the cumulative metric of the batch
+        partial = getattr(state, self.stat)
+        closes = []
+        last = []  # the index of the trade closing every bar
+        pos, start = 0.0, 0
+        while start < n:
+            target = pos + self.threshold - partial
+            end = int(np.searchsorted(cum, target, side='left'))
+            if end > n:
+                # the remaining trades do not complete a bar
+                break
+            if split and target > pos:
+                close = target
+            else:
+                end = max(end, start + 1)
+                close = cum[end]
+            closes.append(close)
+            last.append(end - 1)
+            if self.adaptive is not None:
+                # the next bar uses the threshold adapted to the recent flow
+                self.threshold = self.adaptive.update(close - pos + partial, timestamp[end - 1])
+            # the next bar starts within the closing print if it was cut
+            start = end if close == cum[end] else end - 1
+            pos, partial = close, 0
+        if split and closes:
+            # cut the prints at the bar closes inside them
+            cuts = np.union1d(cum, closes)
+            trade = np.searchsorted(cum, cuts[:-1], side='right') - 1
+            piece = np.diff(cuts)
+            price, buy = price[trade], buy[trade]
+            if self.stat == 'cum_volume':
+                size, dollar = piece, price * piece
+            else:
+                size, dollar = piece / price, piece
+            ends = np.searchsorted(cuts, closes)
+        else:
+            ends = np.asarray(last, dtype=np.int64) + 1
+        bars = []
+        m = int(ends[-1]) if closes else 0
+        if closes:
+            starts = np.concatenate(([0], ends[:-1]))
+            p, q, d, b = price[:m], size[:m], dollar[:m], buy[:m]
+            opens = p[starts]
+            high = np.maximum.reduceat(p, starts)
+            low = np.minimum.reduceat(p, starts)
+            cum_tick = ends - starts
+            cum_volume = np.add.reduceat(q, starts)
+            cum_dollar_value = np.add.reduceat(d, starts)
+            cum_buy_tick = np.add.reduceat(b.astype(np.int64), starts)
+            cum_buy_volume = np.add.reduceat(np.where(b, q, 0), starts)
+            cum_buy_dollar_value = np.add.reduceat(np.where(b, d, 0), starts)
+            if state.open is not None:
+                # the first bar continues the current bar
+                opens[0] = state.open
+                high[0] = max(high[0], state.high)
+                low[0] = min(low[0], state.low)
+                cum_tick[0] += state.cum_tick
+                cum_volume[0] += state.cum_volume
+                cum_dollar_value[0] += state.cum_dollar_value
+                cum_buy_tick[0] += state.cum_buy_tick
+                cum_buy_volume[0] += state.cum_buy_volume
+                cum_buy_dollar_value[0] += state.cum_buy_dollar_value
+            columns = zip(last, opens.tolist(), high.tolist(), low.tolist(), p[ends - 1].tolist(),
+                          cum_tick.tolist(), cum_volume.tolist(), cum_dollar_value.tolist(),
+                          cum_buy_tick.tolist(), cum_buy_volume.tolist(), cum_buy_dollar_value.tolist())
+            for i, o, h, l, c, tick, volume, dollar_value, buy_tick, buy_volume, buy_dollar in columns:
+                bar = {
+                    'timestamp': str(timestamp[i]),
+                    'symbol': symbol,
+                    'open': o,
+                    'high': h,
+                    'low': l,
+                    'close': c,
+                    'vwap': dollar_value / volume,
+                    'cum_tick': tick,
+                    'cum_volume': volume,
+                    'cum_dollar_value': dollar_value,
+                    'cum_buy_tick': buy_tick,
+                    'cum_buy_volume': buy_volume,
+                    'cum_buy_dollar_value': buy_dollar}
+                self.save_bar(list(bar.values()))
+                bars.append(bar)
+            self._reset_cache()
+        if m < len(price):
+            # add the trades after the last close to the current bar
+            p, b = price[m:], buy[m:]
+            high, low = float(p.max()), float(p.min())
+            if state.open is None:
+                state.open, state.high, state.low = float(p[0]), high, low
+            else:
+                state.high, state.low = max(state.high, high), min(state.low, low)
+            state.close = float(p[-1])
+            state.cum_tick += len(p)
+            state.cum_volume += float(size[m:].sum())
+            state.cum_dollar_value += float(dollar[m:].sum())
+            state.cum_buy_tick += int(b.sum())
+            state.cum_buy_volume += float(size[m:][b].sum())
+            state.cum_buy_dollar_value += float(dollar[m:][b].sum())
+        return bars
+
+
+# the position of every cumulative metric in the counters of MultiBars
+_CUM_INDEX = {
+    'cum_tick': 0,
+    'cum_volume': 1,
+    'cum_dollar_value': 2}
+
+
+class BarOutput:
+    """
+    One of the bar types of MultiBars: its threshold, its sink and the running values of its
+    current bar that cannot be shared with the other outputs.
+    """
+    __slots__ = (
+        'name',
+        'bar_type',
+        'threshold',
+        'index',
+        'rule',
+        'sink',
+        'start',
+        'open',
+        'high',
+        'low')
+
+    def __init__(self, name: str, bar_type: str, threshold: float, sink):
+        """
+        :param name :(str) the name of the output, passed to the sink with every bar.
+        :param bar_type :(str) Type of bar to form, as in EventDrivenBars.
+        :param threshold :(float) threshold value for sampling.
+        :param sink : an object with a write(name, row) method, e.g. a BarWriter.
+        """
+        self.name = name
+        self.bar_type = bar_type
+        self.threshold = threshold
+        self.index = None
+        self.rule = None
+        if bar_type in INFORMATION_BARS:
+            rule, metric = INFORMATION_BARS[bar_type]
+            self.rule = rule(metric, threshold)
+        else:
+            self.index = _CUM_INDEX[_get_stat(bar_type)]
+        self.sink = sink
+        # the shared counters at the start of the current bar
+        self.start = [0] * 6
+        self.open = self.high = self.low = None
+
+
+class MultiBars:
+    """
+    Forms several types of bars (and thresholds) of a symbol from one stream of trades.
+    The tick rule and the cumulative metrics are computed once per trade for all the outputs:
+    the counters only grow and every output keeps their values at the start of its current
+    bar, so an output only compares a difference with its threshold and updates its high and low.
+    """
+
+    def __init__(self, symbol: str, outputs: list):
+        """
+        :param symbol :(str) the ticker symbol.
+        :param outputs :(list) the BarOutput of every bar type.
+        """
+        self.symbol = symbol
+        self.outputs = outputs
+        self.prev_price = None
+        # tick, volume, dollar value, buy tick, buy volume, buy dollar value since the start
+        self.cum = [0] * 6
+
+    def aggregate_bar(self, data):
+        """
+        Aggregate with the arrival of new trades data
+        :param data : A data object containing the ticks of a single timestamp or tick.
+        :return :(list) the (name, bar) of the bars closed by the trade.
+        """
+        price, size = data.price, data.size
+        # the side of the trade based on tick rule, shared by all the outputs
+        prev_price = self.prev_price
+        self.prev_price = price
+        if prev_price is None or price == prev_price:
+            sign = 0
+        else:
+            sign = 1 if price > prev_price else -1
+        dollar_value = price * size
+        cum = self.cum
+        cum[0] += 1
+        cum[1] += size
+        cum[2] += dollar_value
+        if sign > 0:
+            cum[3] += 1
+            cum[4] += size
+            cum[5] += dollar_value
+        closed = []
+        for out in self.outputs:
+            if out.open is None:
+                out.open = out.high = out.low = price
+            elif price > out.high:
+                out.high = price
+            elif price < out.low:
+                out.low = price
+            if out.rule is None:
+                if cum[out.index] - out.start[out.index] < out.threshold:
+                    continue
+            elif not out.rule.update(sign, price, size):
+                continue
+            closed.append((out.name, self._close(out, price, data.timestamp)))
+        return closed
+
+    def _close(self, out: BarOutput, close: float, timestamp):
+        """
+        Close the current bar of an output and send it to its sink.
+        """
+        cum, start = self.cum, out.start
+        volume = cum[1] - start[1]
+        dollar_value = cum[2] - start[2]
+        bar = {
+            'timestamp': str(timestamp),
+            'symbol': self.symbol,
+            'open': out.open,
+            'high': out.high,
+            'low': out.low,
+            'close': close,
+            'vwap': dollar_value / volume,
+            'cum_tick': cum[0] - start[0],
+            'cum_volume': volume,
+            'cum_dollar_value': dollar_value,
+            'cum_buy_tick': cum[3] - start[3],
+            'cum_buy_volume': cum[4] - start[4],
+            'cum_buy_dollar_value': cum[5] - start[5]}
+        out.sink.write(out.name, list(bar.values()))
+        if out.rule is not None:
+            out.rule.close()
+        out.start = cum[:]
+        out.open = out.high = out.low = None
+        return bar
+
+
+def _bar_ends(metric: np.ndarray, threshold: float):
+    """
+    Locate the end of every completed bar using the cumulative sum of the tracked metric.
+    The bar starting at trade `s` ends at the first trade where the running sum since `s`
+    reaches the threshold, which is found with a binary search over the cumulative sum.
+    :param metric :(np.ndarray) the non-negative contribution of every trade to the tracked metric.
+    :param threshold :(float) threshold value for sampling.
+    :return :(np.ndarray) the (exclusive) end index of every completed bar.
+    """
+    n = len(metric)
+    cum = np.zeros(n + 1)
+    np.cumsum(metric, out=cum[1:])
+    return _cum_bar_ends(cum, threshold)
+
+
+def _cum_bar_ends(cum: np.ndarray, threshold: float):
+    """
+    Locate the end of every completed bar with a binary search over the cumulative sum of the
+    tracked metric, which can be shared by several thresholds.
+    :param cum :(np.ndarray) the cumulative sum of the metric with a leading zero.
+    :param threshold :(float) threshold value for sampling.
+    :return :(np.ndarray) the (exclusive) end index of every completed bar.
+    """
+    n = len(cum) - 1
+    ends = []
+    start = 0
+    while start < n:
+        # first position where the sum since the start reaches the threshold
+        end = max(int(np.searchsorted(cum, cum[start] + threshold, side='left')), start + 1)
+        if end > n:
+            # the remaining trades do not complete a bar
+            break
+        ends.append(end)
+        start = end
+    return np.asarray(ends, dtype=np.int64)
+
+
+def bar_ends(bar_type: str, thresholds: list, price: np.ndarray, size: np.ndarray):
+    """
+    Locate the ends of the tick, volume or dollar bars of several thresholds in one pass: the
+    cumulative sum of the tracked metric is computed once and every threshold only searches it.
+    The ends are the ones of build_bars with each threshold.
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar".
+    :param thresholds :(list) the threshold values for sampling.
+    :param price :(np.ndarray) the trade prices.
+    :param size :(np.ndarray) the trade sizes.
+    :return :(dict) the (exclusive) end index of every completed bar with the thresholds as keys.
+    """
+    stat = _get_stat(bar_type)
+    n = len(price)
+    if stat == 'cum_tick':
+        # every tick counts one so the bars are evenly spaced
+        steps = {thres: max(int(np.ceil(thres)), 1) for thres in thresholds}
+        return {thres: np.arange(step, n + 1, step) for thres, step in steps.items()}
+    size = np.asarray(size, dtype=np.float64)
+    metric = size if stat == 'cum_volume' else np.asarray(price, dtype=np.float64) * size
+    cum = np.zeros(n + 1)
+    np.cumsum(metric, out=cum[1:])
+    return {thres: _cum_bar_ends(cum, thres) for thres in thresholds}
+
+
+def _carry_sign(sign: np.ndarray):
+    """
+    Replace the zero tick rule signs (no price change) by the last non-zero sign.
+    :param sign :(np.ndarray) the tick rule signs.
+    :return :(np.ndarray) the signs carried forward, zero before the first price change.
+    """
+    last = np.where(sign != 0, np.arange(len(sign)), 0)
+    np.maximum.accumulate(last, out=last)
+    return sign[last]
+
+
+def _information_bar_ends(bar_type: str, threshold: float, price: np.ndarray,
+                          size: np.ndarray, sign: np.ndarray):
+    """
+    Locate the end of every completed imbalance or run bar. The expectations of the sampling
+    rule only change at the bar closes, so the end of each bar is searched with a fixed
+    threshold: a vectorized scan of the cumulative imbalance, or a binary search over the
+    cumulative buy and sell runs, which are non-decreasing.
+    :param bar_type :(str) one of the bar types in INFORMATION_BARS.
+    :param threshold :(float) the initial expected number of ticks per bar.
+    :param price :(np.ndarray) the trade prices.
+    :param size :(np.ndarray) the trade sizes.
+    :param sign :(np.ndarray) the tick rule signs of the trades.
+    :return :(np.ndarray) the (exclusive) end index of every completed bar.
+    """
+    rule, metric = INFORMATION_BARS[bar_type]
+    rule = rule(metric, threshold)
+    n = len(price)
+    value = np.ones(n) if metric == 'tick' else size if metric == 'volume' else price * size
+    sign = _carry_sign(sign)
+
+    def cumsum(x):
+        cum = np.zeros(n + 1)
+        np.cumsum(x, out=cum[1:])
+        return cum
+
+    if isinstance(rule, ImbalanceRule):
+        cum, cum_value = cumsum(sign * value), cumsum(value)
+    else:
+        buys, sells = cumsum(sign > 0), cumsum(sign < 0)
+        buy_run, sell_run = cumsum(np.where(sign > 0, value, 0)), cumsum(np.where(sign < 0, value, 0))
+    ends = []
+    start = 0
+    while start < n:
+        limit = rule.threshold()
+        if limit is None:
+            # the first bar closes after the initial expected number of ticks
+            end = start + max(int(np.ceil(rule.expected_ticks)), 1)
+        elif isinstance(rule, ImbalanceRule):
+            # scan the imbalance since the start by blocks of a few expected bar lengths
+            end = n + 1
+            step = max(int(2 * rule.expected_ticks), 16)
+            lo = start + 1
+            while lo <= n:
+                hi = min(lo + step, n + 1)
+                hit = np.flatnonzero(np.abs(cum[lo:hi] - cum[start]) >= limit)
+                if len(hit):
+                    end = lo + int(hit[0])
+                    break
+                lo = hi
+        else:
+            end = max(min(
+                int(np.searchsorted(buy_run, buy_run[start] + limit, side='left')),
+                int(np.searchsorted(sell_run, sell_run[start] + limit, side='left'))), start + 1)
+        if end > n:
+            # the remaining trades do not complete a bar
+            break
+        if isinstance(rule, ImbalanceRule):
+            rule.close_bar(end - start, cum[end] - cum[start], cum_value[end] - cum_value[start])
+        else:
+            rule.close_bar(end - start, int(buys[end] - buys[start]), int(sells[end] - sells[start]),
+                           buy_run[end] - buy_run[start], sell_run[end] - sell_run[start])
+        ends.append(end)
+        start = end
+    return np.asarray(ends, dtype=np.int64)
+
+
+def build_bars(bar_type: str,
+               threshold: Union[int, float],
+               price: np.ndarray,
+               size: np.ndarray,
+               timestamp: np.ndarray = None,
+               symbol: str = None,
+               prev_price: float = None):
+    """
+    Build bars from a historical array of trades in one vectorized pass. The bars are the same
+    as the ones produced by pushing the trades one at a time through EventDrivenBars.aggregate_bar
+    (up to floating point rounding of the cumulative dollar value at an exact tie with the threshold).
+    Trades after the last completed bar are left out, as they are in the realtime bars.
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar", "dollar_bar" or
+                     one of the imbalance or run bars in INFORMATION_BARS.
+    :param threshold :(int) threshold value for sampling. For the imbalance and run bars it is the
+                      initial expected number of ticks per bar.
+    :param price :(np.ndarray) the trade prices.
+    :param size :(np.ndarray) the trade sizes.
+    :param timestamp :(np.ndarray) the trade timestamps. If None the bars are indexed by trade number.
+    :param symbol :(str) the ticker symbol to put in the symbol column.
+    :param prev_price :(float) the price of the trade before the first one, used for its tick sign.
+    :return :(pd.DataFrame) the bars with the same columns as the realtime bars.
+    """
+    price = np.asarray(price, dtype=np.float64)
+    size = np.asarray(size, dtype=np.float64)
+    if timestamp is None:
+        timestamp = np.arange(len(price))
+    # an index keeps the timezone of the timestamps
+    timestamp = pd.Index(timestamp)
+    dollar = price * size
+    # the side of the trades based on tick rule
+    sign = np.empty(len(price))
+    sign[1:] = np.sign(np.diff(price))
+    if len(price):
+        sign[0] = 0 if prev_price is None else np.sign(price[0] - prev_price)
+    # find the trades closing a bar
+    if bar_type in INFORMATION_BARS:
+        ends = _information_bar_ends(bar_type, threshold, price, size, sign)
+    elif _get_stat(bar_type) == 'cum_tick':
+        # every tick counts one so the bars are evenly spaced
+        step = max(int(np.ceil(threshold)), 1)
+        ends = np.arange(step, len(price) + 1, step)
+    elif _get_stat(bar_type) == 'cum_volume':
+        ends = _bar_ends(size, threshold)
+    else:
+        ends = _bar_ends(dollar, threshold)
+    if len(ends) == 0:
+        return pd.DataFrame(columns=HEADER)
+    starts = np.concatenate(([0], ends[:-1]))
+    # drop the trades of the incomplete last bar so the reductions stop at its end
+    price, size, dollar = price[:ends[-1]], size[:ends[-1]], dollar[:ends[-1]]
+    buy = sign[:ends[-1]] > 0
+    # aggregate every bar with a reduction over its trades
+    cum_volume = np.add.reduceat(size, starts)
+    cum_dollar_value = np.add.reduceat(dollar, starts)
+    bars = pd.DataFrame({
+        'timestamp': timestamp[ends - 1],
+        'symbol': symbol,
+        'open': price[starts],
+        'high': np.maximum.reduceat(price, starts),
+        'low': np.minimum.reduceat(price, starts),
+        'close': price[ends - 1],
+        'vwap': cum_dollar_value / cum_volume,
+        'cum_tick': ends - starts,
+        'cum_volume': cum_volume,
+        'cum_dollar_value': cum_dollar_value,
+        'cum_buy_tick': np.add.reduceat(buy.astype(np.int64), starts),
+        'cum_buy_volume': np.add.reduceat(np.where(buy, size, 0), starts),
+        'cum_buy_dollar_value': np.add.reduceat(np.where(buy, dollar, 0), starts)},
+        columns=HEADER)
+    return bars
+
+
+def build_bars_from_frame(trades: pd.DataFrame,
+                          bar_type: str,
+                          threshold: Union[int, dict]):
+    """
+    Build bars from a DataFrame of historical trades. The DataFrame must have "price" and "size"
+    columns and the timestamps either in a "timestamp" column or as the index. If a "symbol"
+    column is present the bars are built separately for each symbol and merged in time order.
+    :param trades :(pd.DataFrame) the historical trades in the order they arrived.
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar", "dollar_bar" or
+                     one of the imbalance or run bars in INFORMATION_BARS.
+    :param threshold :(int or dict) threshold for bar formation or sampling. A dictionary must be
+                      given if bars to generated for multiple symbols. The dictionary keys are
+                      ticker symbols and values are the thresholds respectively.
+    :return :(pd.DataFrame) the bars with the same columns as the realtime bars.
+    """
+    if 'timestamp' not in trades.columns:
+        trades = trades.rename_axis('timestamp').reset_index()
+    if 'symbol' not in trades.columns:
+        if isinstance(threshold, dict):
+            raise TypeError('A dict threshold needs a "symbol" column in the trades')
+        return build_bars(bar_type, threshold, trades['price'].values, trades['size'].values,
+                          trades['timestamp'])
+    bars = []
+    for symbol, group in trades.groupby('symbol', sort=False):
+        thres = threshold[symbol] if isinstance(threshold, dict) else threshold
+        bars.append(build_bars(bar_type, thres, group['price'].values, group['size'].values,
+                               group['timestamp'], symbol))
+    bars = pd.concat(bars, ignore_index=True)
+    # merge the symbols in the order the bars were formed
+    return bars.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def get_thresholds(symbols: Union[str, list], threshold: Union[int, dict]):
+    """
+    Get the threshold of every symbol.
+    :param symbols :(str or list) a ticker symbol or a list of ticker symbols to generate the bars.
+    :param threshold :(int or dict) threshold for bar formation or sampling. A dictionary must be
+                      given if bars to generated for multiple symbols. The dictionary keys are
+                      ticker symbols and values are the thresholds respectively.
+    :return :(dict) the thresholds with the symbols as keys.
+    """
+    if isinstance(symbols, list):
+        # multi-symbol
+        return {symbol: threshold[symbol] for symbol in symbols}
+    # single symbols
+    if isinstance(threshold, int):
+        # threshold is given as a int type
+        return {symbols: threshold}
+    elif isinstance(threshold, dict):
+        # threshold is given as a dict type
+        return {symbols: threshold[symbols]}
+    raise TypeError(
+        f'The given threshold is a {type(threshold)} expecting a int or a dict')
+
+
+def restore_states(instances: dict, states: dict):
+    """
+    Restore the states of a checkpoint in the instances of the same symbols.
+    :param instances :(dict) the instances with a set_state method by symbol.
+    :param states :(dict) the states by symbol, e.g. from Checkpointer.load. If None nothing
+                   is restored.
+    :return :(list) the symbols restored.
+    """
+    restored = []
+    for symbol, state in (states or {}).items():
+        if symbol in instances:
+            try:
+                instances[symbol].set_state(state)
+                restored.append(symbol)
+            except (ValueError, KeyError) as e:
+                # e.g. the bar type of the symbol changed, its bar starts over
+                logging.warning(f'The state of {symbol} was not restored: {e!r}')
+    return restored
+
 
 def get_bars(bar_type: str,
              symbols: Union[str,
                             list],
              threshold: Union[int,
                               dict],
-             save_to: str):
+             save_to: str,
+             writer: BarWriter = None,
+             store: str = 'csv',
+             conn=None,
+             bars_per_day: int = None,
+             metrics: Metrics = None,
+             queue_size: int = None,
+             overflow: str = 'block',
+             checkpoint: str = None,
+             checkpoint_interval: float = 5.0):
     """
     Get the realtime bar using the Streaming API.
-    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar".
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar", "dollar_bar",
+                     "tick_imbalance_bar", "volume_imbalance_bar", "dollar_imbalance_bar",
+                     "tick_run_bar", "volume_run_bar" or "dollar_run_bar".
     :param symbols :(str or list) a ticker symbol or a list of ticker symbols to generate the bars.
-    :param threshold :(int or dict) threshold for bar formation or sampling. A dictionary must be
-                      given if bars to generated for multiple symbols. The dictionary keys are
-                      ticker symbols and values are the thresholds respectively.
+    :param threshold :(int or dict) threshold for bar formation or sampling. For the imbalance and
+                      run bars it is the initial expected number of ticks per bar. A dictionary
+                      must be given if bars to generated for multiple symbols. The dictionary keys
+                      are ticker symbols and values are the thresholds respectively.
     :param save_to :(str) the path to store the bars.
+    :param writer :(BarWriter) the writer shared by all the symbols to save the bars in batches.
+                   If None a writer with the default flush interval and batch size is used.
+    :param store :(str) the storage backend used when no writer is given. Either "csv" to append
+                  to <save_to>/<bar_type>/realtime.csv or "columnar" for column files partitioned
+                  by bar type, symbol and trading day.
+    :param conn : the stream connection to receive the trades from. If None a connection to the
+                  Streaming API is created. A replay.ReplayConn replays recorded trades instead.
+    :param bars_per_day :(int) if given the thresholds are adapted during the session to form
+                         about this number of bars per day, starting from the given thresholds.
+                         Not used by the imbalance and run bars, whose thresholds always adapt.
+    :param metrics :(Metrics) if given the ticks, the bars, their latency, the event loop lag and
+                    the writer queue depth are recorded in it, e.g. served with metrics.serve().
+    :param queue_size :(int) if given the trade handler only queues the trades in a bounded
+                       queue per symbol of this size, and the bars are formed from the queues
+                       between the socket reads. If None the bars are formed in the handler.
+    :param overflow :(str) the policy when a queue is full. Either "block", "drop_oldest" or
+                     "coalesce" (merge the trades with the same timestamp), see ingest.IngestQueue.
+    :param checkpoint :(str) if given the path of a checkpoint file of the bars being formed. It is
+                       written every checkpoint_interval seconds and when the stream stops, and the
+                       bars are resumed from it at the start.
+    :param checkpoint_interval :(float) the seconds between the checkpoints.
     """
-    # create a save file and a directory structure
-    save_to = save_to + '/' + bar_type
-    if not os.path.exists(save_to):
-        os.makedirs(save_to)
-    # the file path and name
-    save_to = save_to + '/' + 'realtime.csv'
-    # check if the file exist
-    if not os.path.exists(save_to):
-        # write the header of the CSV file
-        with open(save_to, 'w', newline='') as f:
-            # the header
-            header_ = [
-                'timestamp',
-                'symbol',
-                'open',
-                'high',
-                'low',
-                'close',
-                'vwap',
-                'cum_tick',
-                'cum_volume',
-                'cum_dollar_value',
-                'cum_buy_tick',
-                'cum_buy_volume',
-                'cum_buy_dollar_value']
-            # Create a writer object from csv module
-            csv_writer = csv.writer(f)
-            # Add contents of list as last row in the csv file
-            csv_writer.writerow(header_)
-    # if it the file exists then we will append the bars to the same file.
+    if conn is None:
+        conn = Client().connect()
+    # a writer created here is closed when the stream stops
+    own_writer = writer is None
+    if own_writer:
+        writer = BarWriter(get_store(store, save_to))
+    # the CSV file used if the bars are saved without a writer
+    save_to = os.path.join(save_to, bar_type, 'realtime.csv')
     # initiate instances of symbols
+    thresholds = get_thresholds(symbols, threshold)
+    channels = ['trade_updates'] + ['T.' + sym.upper() for sym in thresholds]
     instances = {}
-    if isinstance(symbols, list):
-        # multi-symbol
-        channels = ['trade_updates'] + ['T.' + sym.upper() for sym in symbols]
-        for symbol in symbols:
-            # create a seperate instance for each symbols
-            instances[symbol] = EventDrivenBars(
-                bar_type, threshold[symbol], save_to)
-    else:
-        # single symbols
-        channels = ['trade_updates', f'T.{symbols.upper()}']
-        if isinstance(threshold, int):
-            # threshold is given as a int type
-            instances[symbols] = EventDrivenBars(bar_type, threshold, save_to)
-        elif isinstance(threshold, dict):
-            # threshold is given as a dict type
-            instances[symbols] = EventDrivenBars(
-                bar_type, threshold[symbol], save_to)
-        else:
-            raise TypeError(
-                f'The given threshold is a {type(threshold)} expecting a int or a dict')
+    for symbol in thresholds:
+        # create a seperate instance for each symbols
+        adaptive = None
+        if bars_per_day:
+            adaptive = AdaptiveThreshold(thresholds[symbol], bars_per_day)
+        instances[symbol] = EventDrivenBars(
+            bar_type, thresholds[symbol], save_to, writer, adaptive)
+    if metrics is not None:
+        metrics.gauge('writer_queue_depth', writer.qsize)
+        metrics.gauge('writer_failed_rows_total', lambda: writer.failed)
+    checkpointer = None
+    if checkpoint is not None:
+        checkpointer = Checkpointer(checkpoint, checkpoint_interval)
+        restore_states(instances, checkpointer.load())
+
+    def collect():
+        return {symbol: instance.get_state() for symbol, instance in instances.items()}
+
+    def process(data):
+        bar = instances[data.symbol].aggregate_bar(data)
+        if metrics is not None:
+            metrics.record(data.symbol, data.timestamp, bar)
+        if bar:
+            print(bar)
+
+    ingest = None
+    if queue_size is not None:
+        ingest = Ingest(process, queue_size, overflow)
+        if metrics is not None:
+            for name, func in ingest.gauges().items():
+                metrics.gauge(name, func)
 
     @conn.on(r'T$')
     async def on_trade(conn, channel, data):
+        if checkpointer is not None and not checkpointer.started:
+            # the states are collected on the event loop of the trades
+            checkpointer.start(collect)
+        if metrics is not None and not metrics.watching:
+            # the lag of the event loop of the trades
+            metrics.watch_loop()
         if data.symbol in instances and data.price > 0 and data.size > 0:
-            bar = instances[data.symbol].aggregate_bar(data)
-            print(bar)
-    conn.run(channels)
+            if ingest is not None:
+                await ingest.submit(data)
+            else:
+                process(data)
+    try:
+        conn.run(channels)
+    finally:
+        if ingest is not None:
+            # form the bars of the trades still queued
+            ingest.close()
+        if checkpointer is not None:
+            checkpointer.close(collect())
+        if own_writer:
+            # write the queued bars before returning
+            writer.close()
+
+
+def get_multi_bars(symbols: Union[str, list],
+                   outputs: Union[list, dict],
+                   save_to: str,
+                   writer: BarWriter = None,
+                   store: str = 'csv',
+                   sinks: dict = None,
+                   conn=None,
+                   metrics: Metrics = None):
+    """
+    Get several types of realtime bars from a single subscription to the Streaming API. Every
+    trade is classified once and the cumulative metrics are shared by all the bar types.
+    :param symbols :(str or list) a ticker symbol or a list of ticker symbols to generate the bars.
+    :param outputs :(list or dict) the bars to form as a list of (bar_type, threshold) or a dict of
+                    {name: (bar_type, threshold)} to form the same bar type with several thresholds.
+                    A threshold is an int or a dict with the symbols as keys.
+    :param save_to :(str) the path to store the bars.
+    :param writer :(BarWriter) the writer used by the outputs without a sink. Every output is saved
+                   under its name instead of the bar type, e.g. <save_to>/<name>/realtime.csv.
+                   If None a writer with the given store is used.
+    :param store :(str) the storage backend used when no writer is given. Either "csv" or "columnar".
+    :param sinks :(dict) the sinks of some outputs by name, objects with a write(name, row) method.
+    :param conn : the stream connection to receive the trades from. If None a connection to the
+                  Streaming API is created. A replay.ReplayConn replays recorded trades instead.
+    :param metrics :(Metrics) if given the ticks, the bars (of all the outputs), their latency,
+                    the event loop lag and the writer queue depth are recorded in it.
+    :return :(dict) the MultiBars of every symbol.
+    """
+    if isinstance(outputs, list):
+        names = [bar_type for bar_type, _ in outputs]
+        if len(set(names)) < len(names):
+            raise ValueError('A bar type is given twice, please name the outputs with a dict')
+        outputs = dict(zip(names, outputs))
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    if conn is None:
+        conn = Client().connect()
+    # a writer created here is closed when the stream stops
+    own_writer = writer is None
+    if own_writer:
+        writer = BarWriter(get_store(store, save_to))
+    sinks = sinks or {}
+    instances = {}
+    for symbol in symbols:
+        bar_outputs = []
+        for name, (bar_type, threshold) in outputs.items():
+            thres = threshold[symbol] if isinstance(threshold, dict) else threshold
+            bar_outputs.append(BarOutput(name, bar_type, thres, sinks.get(name, writer)))
+        instances[symbol] = MultiBars(symbol, bar_outputs)
+    channels = ['trade_updates'] + ['T.' + sym.upper() for sym in instances]
+    if metrics is not None:
+        metrics.gauge('writer_queue_depth', writer.qsize)
+        metrics.gauge('writer_failed_rows_total', lambda: writer.failed)
+
+    @conn.on(r'T$')
+    async def on_trade(conn, channel, data):
+        if metrics is not None and not metrics.watching:
+            # the lag of the event loop of the trades
+            metrics.watch_loop()
+        if data.symbol in instances and data.price > 0 and data.size > 0:
+            bars = instances[data.symbol].aggregate_bar(data)
+            if metrics is not None:
+                metrics.record(data.symbol, data.timestamp, bars)
+    try:
+        conn.run(channels)
+    finally:
+        if own_writer:
+            # write the queued bars before returning
+            writer.close()
+    return instances
 
 
 def get_tick_bars(symbols: Union[str, list],
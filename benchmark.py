@@ -0,0 +1,286 @@
+"""
+This script benchmarks the bar formation hot path, i.e. EventDrivenBars.aggregate_bar and
+the trade dispatch of get_bars, and the offline build_bars on synthetic or recorded trades.
+
+The results are printed (or saved) as JSON lines with one record per benchmark case:
+    python benchmark.py --symbols 3 50 500 --ticks 200000 --output bench.jsonl
+    python benchmark.py --trades trades.csv
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import contextlib
+
+import numpy as np
+
+from bars import EventDrivenBars, build_bars, get_bars
+from replay import Trade, ReplayConn, read_trades
+from storage import BarStore
+from writer import BarWriter
+
+# the default thresholds benchmarked for every bar type
+THRESHOLDS = {
+    'tick_bar': [100, 1000],
+    'volume_bar': [10000, 100000],
+    'dollar_bar': [1000000, 10000000],
+    # the initial expected number of ticks per bar of the information-driven bars
+    'tick_imbalance_bar': [100, 1000],
+    'volume_imbalance_bar': [100, 1000],
+    'dollar_imbalance_bar': [100, 1000],
+    'tick_run_bar': [100, 1000],
+    'volume_run_bar': [100, 1000],
+    'dollar_run_bar': [100, 1000]}
+
+
+class NullStore(BarStore):
+    """
+    A store that counts the bars and discards them, so the benchmarks do not measure disk I/O.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def append(self, bar_type: str, rows: list):
+        self.count += len(rows)
+
+
+def synthetic_trades(n_symbols: int, n_ticks: int, seed: int = 42):
+    """
+    Generate a random walk of trades spread over a number of symbols.
+    :param n_symbols :(int) the number of symbols.
+    :param n_ticks :(int) the total number of trades.
+    :param seed :(int) the seed of the random generator.
+    :return :(list) the trades in time order.
+    """
+    rng = np.random.default_rng(seed)
+    symbols = np.array([f'SYM{i}' for i in range(n_symbols)])
+    sym_idx = rng.integers(0, n_symbols, n_ticks)
+    # a random walk of the price of every symbol, rounded to cents
+    base = rng.uniform(20, 500, n_symbols)
+    steps = rng.normal(0, 0.0002, n_ticks)
+    price = np.empty(n_ticks)
+    for i in range(n_symbols):
+        mask = sym_idx == i
+        price[mask] = np.round(base[i] * np.exp(np.cumsum(steps[mask])), 2)
+    size = np.maximum(rng.lognormal(4, 1, n_ticks).astype(np.int64), 1)
+    # about a thousand trades per second
+    timestamp = np.datetime64('2020-08-11T13:30:00') + \
+        np.cumsum(rng.exponential(1000000, n_ticks)).astype('timedelta64[ns]')
+    return [Trade(symbols[s], float(p), int(q), t)
+            for s, p, q, t in zip(sym_idx, price, size, timestamp)]
+
+
+def percentiles(latencies: list):
+    """
+    :param latencies :(list) the per-tick latencies in nanoseconds.
+    :return :(dict) the p50, p99 and p999 latencies in nanoseconds.
+    """
+    if not latencies:
+        return {'p50': None, 'p99': None, 'p999': None}
+    p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+    return {'p50': float(p50), 'p99': float(p99), 'p999': float(p999)}
+
+
+def peak_memory(func):
+    """
+    Run a function under tracemalloc.
+    :param func : a function without arguments.
+    :return :(int) the peak memory allocated in bytes.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_aggregate_bar(trades: list, bar_type: str, threshold: int):
+    """
+    Benchmark EventDrivenBars.aggregate_bar with one instance per symbol.
+    :param trades :(list) the trades to aggregate.
+    :param bar_type :(str) Type of bar to form.
+    :param threshold :(int) threshold value for sampling, the same for every symbol.
+    :return :(dict) the benchmark results.
+    """
+    symbols = sorted({t.symbol for t in trades})
+
+    def make_instances():
+        writer = BarWriter(NullStore(), flush_interval=0.1)
+        return writer, {s: EventDrivenBars(bar_type, threshold, os.devnull, writer) for s in symbols}
+
+    # throughput
+    writer, instances = make_instances()
+    bars = 0
+    start = time.perf_counter()
+    for trade in trades:
+        if instances[trade.symbol].aggregate_bar(trade):
+            bars += 1
+    seconds = time.perf_counter() - start
+    writer.close()
+    # per-tick latency
+    writer, instances = make_instances()
+    latencies = [0] * len(trades)
+    clock = time.perf_counter_ns
+    for i, trade in enumerate(trades):
+        t0 = clock()
+        instances[trade.symbol].aggregate_bar(trade)
+        latencies[i] = clock() - t0
+    writer.close()
+
+    # peak memory
+    def run():
+        writer_, instances_ = make_instances()
+        for trade in trades:
+            instances_[trade.symbol].aggregate_bar(trade)
+        writer_.close()
+
+    return {
+        'benchmark': 'aggregate_bar',
+        'ticks': len(trades),
+        'bars': bars,
+        'seconds': seconds,
+        'ticks_per_sec': len(trades) / seconds,
+        'bars_per_sec': bars / seconds,
+        'latency_ns': percentiles(latencies),
+        'peak_memory_bytes': peak_memory(run)}
+
+
+def bench_get_bars(trades: list, bar_type: str, threshold: int):
+    """
+    Benchmark the trade dispatch of get_bars, i.e. the trade handler with the symbol lookup,
+    the aggregation and the writer.
+    :param trades :(list) the trades to dispatch.
+    :param bar_type :(str) Type of bar to form.
+    :param threshold :(int) threshold value for sampling, the same for every symbol.
+    :return :(dict) the benchmark results.
+    """
+    symbols = sorted({t.symbol for t in trades})
+
+    def run(record_latency: bool):
+        store = NullStore()
+        conn = ReplayConn(trades=trades, record_latency=record_latency)
+        writer = BarWriter(store, flush_interval=0.1)
+        # the handler prints every formed bar, which is not part of the benchmark output
+        with contextlib.redirect_stdout(io.StringIO()):
+            get_bars(bar_type, symbols, {s: threshold for s in symbols},
+                     os.devnull, writer=writer, conn=conn)
+        writer.close()
+        return conn, store
+
+    conn, store = run(False)
+    stats = conn.stats
+    latency_conn, _ = run(True)
+    return {
+        'benchmark': 'get_bars',
+        'ticks': stats['ticks'],
+        'bars': store.count,
+        'seconds': stats['seconds'],
+        'ticks_per_sec': stats['ticks_per_sec'],
+        'bars_per_sec': store.count / stats['seconds'] if stats['seconds'] > 0 else 0.0,
+        'latency_ns': percentiles(latency_conn.latencies),
+        'peak_memory_bytes': peak_memory(lambda: run(False))}
+
+
+def bench_build_bars(trades: list, bar_type: str, threshold: int):
+    """
+    Benchmark the offline build_bars with the trades of every symbol as arrays.
+    :param trades :(list) the trades to aggregate.
+    :param bar_type :(str) Type of bar to form.
+    :param threshold :(int) threshold value for sampling, the same for every symbol.
+    :return :(dict) the benchmark results.
+    """
+    arrays = {}
+    for trade in trades:
+        arrays.setdefault(trade.symbol, ([], [], []))
+        prices, sizes, timestamps = arrays[trade.symbol]
+        prices.append(trade.price)
+        sizes.append(trade.size)
+        timestamps.append(trade.timestamp)
+    arrays = {s: (np.array(p), np.array(q), np.array(t)) for s, (p, q, t) in arrays.items()}
+
+    def run():
+        return sum(len(build_bars(bar_type, threshold, p, q, t, s))
+                   for s, (p, q, t) in arrays.items())
+
+    start = time.perf_counter()
+    bars = run()
+    seconds = time.perf_counter() - start
+    return {
+        'benchmark': 'build_bars',
+        'ticks': len(trades),
+        'bars': bars,
+        'seconds': seconds,
+        'ticks_per_sec': len(trades) / seconds,
+        'bars_per_sec': bars / seconds,
+        'latency_ns': percentiles([]),
+        'peak_memory_bytes': peak_memory(run)}
+
+
+def run_benchmarks(bar_types: list = None, thresholds: dict = None,
+                   n_symbols: list = (3, 50, 500), n_ticks: int = 200000,
+                   trades_path: str = None, seed: int = 42):
+    """
+    Run the benchmarks for every combination of bar type, threshold and number of symbols.
+    :param bar_types :(list) the bar types. If None all the bar types are benchmarked.
+    :param thresholds :(dict) the thresholds by bar type. If None THRESHOLDS is used.
+    :param n_symbols :(list) the numbers of symbols of the synthetic trades.
+    :param n_ticks :(int) the number of synthetic trades.
+    :param trades_path :(str) a CSV file of recorded trades to benchmark instead of synthetic trades.
+    :param seed :(int) the seed of the synthetic trades.
+    :return : a generator of the benchmark results.
+    """
+    thresholds = thresholds or THRESHOLDS
+    bar_types = bar_types or list(thresholds.keys())
+    if trades_path is not None:
+        cases = [(trades_path, lambda: list(read_trades(trades_path)))]
+    else:
+        cases = [('synthetic', lambda n=n: synthetic_trades(n, n_ticks, seed)) for n in n_symbols]
+    for source, load in cases:
+        trades = load()
+        symbols = len({t.symbol for t in trades})
+        for bar_type in bar_types:
+            for threshold in thresholds[bar_type]:
+                for bench in (bench_aggregate_bar, bench_get_bars, bench_build_bars):
+                    result = {
+                        'source': source,
+                        'bar_type': bar_type,
+                        'threshold': threshold,
+                        'symbols': symbols}
+                    result.update(bench(trades, bar_type, threshold))
+                    yield result
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bar-types', nargs='+', choices=list(THRESHOLDS.keys()))
+    parser.add_argument('--symbols', nargs='+', type=int, default=[3, 50, 500],
+                        help='the numbers of symbols of the synthetic trades')
+    parser.add_argument('--ticks', type=int, default=200000,
+                        help='the number of synthetic trades')
+    parser.add_argument('--trades', help='a CSV file of recorded trades')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='the JSON lines file to append the results to')
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'a') if args.output else sys.stdout
+    meta = {'python': platform.python_version(), 'numpy': np.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    try:
+        for result in run_benchmarks(args.bar_types, None, args.symbols,
+                                     args.ticks, args.trades, args.seed):
+            result.update(meta)
+            out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+This script checkpoints the in-progress state of the bars (and of the strategy) so a restarted
+process resumes the current bars instead of starting them over. The states are collected on the
+event loop, where they cannot change while being read, and pickled and written by a background
+thread. A checkpoint is written to a temporary file and renamed over the previous one, so a
+crash while writing leaves the previous checkpoint intact.
+"""
+import os
+import time
+import pickle
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# the version of the checkpoint layout, a checkpoint with another version is ignored
+CHECKPOINT_VERSION = 1
+
+
+class Checkpointer:
+    """
+    Writes the states of the instances to a checkpoint file periodically and loads them back
+    at startup.
+    """
+
+    def __init__(self, path: str, interval: float = 5.0, max_age: float = None):
+        """
+        :param path :(str) the path of the checkpoint file.
+        :param interval :(float) the seconds between the checkpoints.
+        :param max_age :(float) the maximum age in seconds of a checkpoint to restore it. If None
+                        a checkpoint is always restored.
+        """
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.started = False
+        self.saved = 0  # the number of checkpoints written
+        self._collect = None
+        self._loop = None
+        self._pending = None  # the checkpoint being written
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Checkpointer')
+
+    def load(self):
+        """
+        Load the last checkpoint.
+        :return :(dict) the states with the keys given to save, or None if there is no checkpoint
+                 or it is too old or unreadable.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                checkpoint = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # a corrupt checkpoint is ignored, the bars start over
+            logging.exception(e)
+            return None
+        if checkpoint.get('version') != CHECKPOINT_VERSION:
+            return None
+        if self.max_age is not None and time.time() - checkpoint['saved_at'] > self.max_age:
+            return None
+        return checkpoint['states']
+
+    def save(self, states: dict):
+        """
+        Write a checkpoint atomically.
+        :param states :(dict) the states to save, e.g. the states of the instances by symbol.
+        """
+        checkpoint = {'version': CHECKPOINT_VERSION, 'saved_at': time.time(), 'states': states}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.saved += 1
+
+    def start(self, collect, loop: asyncio.AbstractEventLoop = None):
+        """
+        Start the periodic checkpoints. The states are collected on the event loop every interval
+        seconds and written by a background thread. A checkpoint is skipped if the previous one
+        is still being written.
+        :param collect : a function without arguments returning the states to save.
+        :param loop :(asyncio.AbstractEventLoop) the event loop of the trade handlers. If None the
+                     current event loop is used.
+        """
+        self._collect = collect
+        self._loop = loop or asyncio.get_event_loop()
+        self._loop.call_later(self.interval, self._checkpoint)
+        self.started = True
+
+    def _checkpoint(self):
+        if not self.started:
+            return
+        if self._pending is None or self._pending.done():
+            try:
+                states = self._collect()
+            except Exception as e:
+                logging.exception(e)
+            else:
+                self._pending = self._executor.submit(self._save, states)
+        if not self._loop.is_closed():
+            self._loop.call_later(self.interval, self._checkpoint)
+
+    def _save(self, states: dict):
+        try:
+            self.save(states)
+        except Exception as e:
+            logging.exception(e)
+
+    def close(self, states: dict = None):
+        """
+        Stop the periodic checkpoints, writing a last one if states are given.
+        :param states :(dict) the final states to save.
+        """
+        self.started = False
+        if self._pending is not None:
+            self._pending.result()
+        if states is not None:
+            self.save(states)
+        self._executor.shutdown()
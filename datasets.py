@@ -0,0 +1,145 @@
+"""
+This script loads the bar datasets used in the analysis (e.g. sample_datasets/analysis/*.csv).
+A CSV is parsed once, trimmed to the regular session and cached as one NumPy file per column,
+so the next loads are memory-mapped reads. The cache is rebuilt when the size or the
+modification time of the CSV changes.
+"""
+import os
+import json
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+# the version of the cache layout, a cache with another version is rebuilt
+CACHE_VERSION = 1
+
+
+def trim_session(df: pd.DataFrame, tz: str = 'US/Eastern',
+                 start: dt.time = dt.time(9, 30), end: dt.time = dt.time(16, 0)):
+    """
+    Convert the timestamps to the timezone of the exchange and drop the bars outside of the
+    regular session. Naive timestamps are taken as UTC.
+    :param df :(pd.DataFrame) the bars indexed by timestamp.
+    :param tz :(str) the timezone of the exchange.
+    :param start :(dt.time) the start of the session.
+    :param end :(dt.time) the end of the session (inclusive).
+    :return :(pd.DataFrame) the bars of the session.
+    """
+    if df.index.tz is None:
+        df = df.tz_localize('UTC')
+    df = df.tz_convert(tz)
+    time = df.index.time
+    return df[~((time < start) | (time > end))]
+
+
+def _cache_dir(path: str):
+    """
+    The cache of a CSV: a directory named after it in a .cache directory next to it.
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    return os.path.join(folder, '.cache', name)
+
+
+def _source_meta(path: str, trim: bool, tz: str):
+    """
+    The description of a CSV and of the options the cache was built with.
+    """
+    stat = os.stat(path)
+    return {'version': CACHE_VERSION, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+            'trim': trim, 'tz': tz}
+
+
+def _read_meta(cache: str):
+    try:
+        with open(os.path.join(cache, 'meta.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_cache(cache: str, df: pd.DataFrame, meta: dict):
+    """
+    Save the bars as one .npy file per column. The metadata is written last, so a cache
+    interrupted while being written is never used.
+    """
+    os.makedirs(cache, exist_ok=True)
+    meta_path = os.path.join(cache, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    # the timestamps are saved as nanoseconds since the epoch in UTC
+    np.save(os.path.join(cache, 'index.npy'),
+            df.index.values.astype('datetime64[ns]').view(np.int64))
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        np.save(os.path.join(cache, f'{i}.npy'), values)
+        columns.append(str(column))
+    meta = dict(meta, columns=columns, index_name=df.index.name,
+                index_tz=str(df.index.tz) if df.index.tz is not None else None)
+    tmp = meta_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def _read_cache(cache: str, meta: dict, columns: list = None):
+    """
+    Read the bars from the cache with memory-mapped column files.
+    """
+    names = meta['columns']
+    columns = names if columns is None else columns
+    data = {}
+    for column in columns:
+        data[column] = np.load(os.path.join(cache, f'{names.index(column)}.npy'), mmap_mode='r')
+    index = pd.DatetimeIndex(np.load(os.path.join(cache, 'index.npy'), mmap_mode='r').view('M8[ns]'),
+                             name=meta['index_name'])
+    if meta['index_tz'] is not None:
+        index = index.tz_localize('UTC').tz_convert(meta['index_tz'])
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+def load_bars(path: str, trim: bool = True, tz: str = 'US/Eastern',
+              columns: list = None, cache: bool = True):
+    """
+    Load a CSV of bars indexed by timestamp (the first column).
+    :param path :(str) the path of the CSV.
+    :param trim :(bool) keep only the bars of the regular session (09:30-16:00) in the timezone tz.
+    :param tz :(str) the timezone of the exchange.
+    :param columns :(list) the columns to read. If None all the columns are read.
+    :param cache :(bool) use (and build if needed) the binary cache of the CSV.
+    :return :(pd.DataFrame) the bars.
+    """
+    if not cache:
+        df = pd.read_csv(path, index_col=[0], parse_dates=True)
+        df = trim_session(df, tz) if trim else df
+        return df if columns is None else df[columns]
+    folder = _cache_dir(path)
+    meta = _source_meta(path, trim, tz)
+    cached = _read_meta(folder)
+    if cached is None or any(cached.get(k) != v for k, v in meta.items()):
+        df = pd.read_csv(path, index_col=[0], parse_dates=True)
+        df = trim_session(df, tz) if trim else df
+        _write_cache(folder, df, meta)
+        cached = _read_meta(folder)
+    return _read_cache(folder, cached, columns)
+
+
+def load_analysis(symbol: str, path: str = 'sample_datasets/analysis', trim: bool = True):
+    """
+    Load the time, tick, volume and dollar bars of a symbol from the analysis datasets,
+    i.e. <path>/<symbol>_5minute_bars.csv and <path>/<symbol>_<bar>_bars.csv.
+    :param symbol :(str) the ticker symbol.
+    :param path :(str) the directory of the datasets.
+    :param trim :(bool) keep only the bars of the regular session.
+    :return :(dict) the bars with the bar types as keys.
+    """
+    files = {
+        'time_bar': f'{symbol}_5minute_bars.csv',
+        'tick_bar': f'{symbol}_tick_bars.csv',
+        'volume_bar': f'{symbol}_volume_bars.csv',
+        'dollar_bar': f'{symbol}_dollar_bars.csv'}
+    return {bar: load_bars(os.path.join(path, name), trim)
+            for bar, name in files.items() if os.path.exists(os.path.join(path, name))}
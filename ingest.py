@@ -0,0 +1,252 @@
+"""
+This script decouples the reading of the trades from the stream from their processing. The
+trade handler only puts the trades in a bounded queue (one per symbol or per shard of symbols)
+and the queues are drained by callbacks on the event loop in batches, yielding to the socket
+reads between the batches. When a queue is full the overflow policy decides whether the handler
+waits, the oldest trade is dropped or the trade is coalesced with the previous one.
+"""
+import zlib
+import asyncio
+import logging
+from collections import deque
+
+# the overflow policies of the queues
+POLICIES = ('block', 'drop_oldest', 'coalesce')
+
+
+class CoalescedTrade:
+    """
+    Trades of a symbol with the same timestamp merged into one: the sizes are summed and the
+    price is their volume-weighted average.
+    """
+    __slots__ = ('symbol', 'price', 'size', 'timestamp', 'trades')
+
+    def __init__(self, symbol: str, price: float, size: float, timestamp, trades: int = 1):
+        self.symbol = symbol
+        self.price = price
+        self.size = size
+        self.timestamp = timestamp
+        self.trades = trades  # the number of trades merged
+
+    def __repr__(self):
+        return (f'CoalescedTrade(symbol={self.symbol}, price={self.price}, size={self.size}, '
+                f'timestamp={self.timestamp}, trades={self.trades})')
+
+
+class IngestQueue:
+    """
+    A bounded queue of trades drained on the event loop by the handler of the trades.
+    """
+
+    def __init__(self, handler, maxsize: int = 10000, policy: str = 'block',
+                 batch_size: int = 100):
+        """
+        :param handler : the function processing a trade, e.g. aggregating it into the bars.
+        :param maxsize :(int) the maximum number of trades waiting in the queue.
+        :param policy :(str) what to do with a trade when the queue is full. Either "block" (the
+                       trade handler waits for the queue, so the socket is not read meanwhile),
+                       "drop_oldest" (the oldest queued trade is dropped) or "coalesce" (the trade is
+                       merged into the last queued one if it has the same symbol and timestamp,
+                       otherwise the handler waits as with "block").
+        :param batch_size :(int) the number of trades processed before yielding to the event loop.
+        """
+        if policy not in POLICIES:
+            raise ValueError(
+                f'{policy} is not a valid policy. Please enter either "block", "drop_oldest" or "coalesce"')
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self._items = deque()
+        self._putters = deque()  # the futures of the handlers waiting for room
+        self._loop = None
+        self._scheduled = False
+        # the counters
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    async def put(self, data):
+        """
+        Queue a trade. It only waits if the queue is full and the policy is "block" (or
+        "coalesce" and the trade cannot be merged).
+        :param data : A data object containing the ticks of a single timestamp or tick.
+        """
+        self.received += 1
+        items = self._items
+        if len(items) >= self.maxsize:
+            if self.policy == 'drop_oldest':
+                items.popleft()
+                self.dropped += 1
+            elif self.policy == 'coalesce' and self._coalesce(data):
+                return
+            else:
+                self.blocked += 1
+                loop = self._loop or asyncio.get_event_loop()
+                while len(items) >= self.maxsize:
+                    waiter = loop.create_future()
+                    self._putters.append(waiter)
+                    self._schedule()
+                    await waiter
+        items.append(data)
+        if len(items) > self.max_depth:
+            self.max_depth = len(items)
+        self._schedule()
+
+    def _coalesce(self, data):
+        """
+        Merge a trade into the last queued trade if they have the same symbol and timestamp.
+        :return :(bool) True if the trade was merged.
+        """
+        last = self._items[-1]
+        if last.symbol != data.symbol or last.timestamp != data.timestamp:
+            return False
+        size = last.size + data.size
+        price = (last.price * last.size + data.price * data.size) / size
+        self._items[-1] = CoalescedTrade(
+            data.symbol, price, size, data.timestamp, getattr(last, 'trades', 1) + 1)
+        self.coalesced += 1
+        return True
+
+    def _schedule(self):
+        """
+        Schedule the draining of the queue on the event loop, if it is not already scheduled.
+        """
+        if not self._scheduled:
+            if self._loop is None:
+                self._loop = asyncio.get_event_loop()
+            self._loop.call_soon(self._drain)
+            self._scheduled = True
+
+    def _drain(self):
+        """
+        Process a batch of trades, then reschedule if some are left so the socket is read
+        between the batches.
+        """
+        self._scheduled = False
+        self._process(self.batch_size)
+        # wake up the handlers waiting for room
+        while self._putters and len(self._items) < self.maxsize:
+            waiter = self._putters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+        if self._items:
+            self._schedule()
+
+    def _process(self, n: int):
+        items = self._items
+        n = min(n, len(items))
+        for _ in range(n):
+            data = items.popleft()
+            try:
+                self.handler(data)
+            except Exception as e:
+                logging.exception(e)
+        self.processed += n
+
+    def close(self):
+        """
+        Process the trades left in the queue, e.g. once the stream has stopped.
+        """
+        self._process(len(self._items))
+
+    def stats(self):
+        """
+        :return :(dict) the counters of the queue and its current depth.
+        """
+        return {'received': self.received,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'blocked': self.blocked,
+                'depth': len(self._items),
+                'max_depth': self.max_depth}
+
+
+class Ingest:
+    """
+    Routes the trades to a bounded queue per symbol, or per shard of symbols, that is drained
+    by the handler of the trades on the event loop.
+    """
+
+    def __init__(self, handler, maxsize: int = 10000, policy: str = 'block',
+                 shards: int = None, batch_size: int = 100):
+        """
+        :param handler : the function processing a trade.
+        :param maxsize :(int) the maximum number of trades waiting in each queue.
+        :param policy :(str) the overflow policy of the queues, see IngestQueue.
+        :param shards :(int) the number of queues the symbols are hashed to. If None every symbol
+                       has a queue of its own.
+        :param batch_size :(int) the number of trades processed before yielding to the event loop.
+        """
+        if policy not in POLICIES:
+            raise ValueError(
+                f'{policy} is not a valid policy. Please enter either "block", "drop_oldest" or "coalesce"')
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.shards = shards
+        self.batch_size = batch_size
+        self.queues = {}  # the queues by symbol or shard
+
+    def queue_of(self, symbol: str):
+        """
+        :param symbol :(str) the ticker symbol.
+        :return :(IngestQueue) the queue of the symbol.
+        """
+        key = symbol if self.shards is None else zlib.crc32(symbol.encode()) % self.shards
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = IngestQueue(
+                self.handler, self.maxsize, self.policy, self.batch_size)
+        return queue
+
+    async def submit(self, data):
+        """
+        Queue a trade for processing.
+        :param data : A data object containing the ticks of a single timestamp or tick.
+        """
+        await self.queue_of(data.symbol).put(data)
+
+    def depth(self):
+        """
+        :return :(int) the number of trades waiting in all the queues.
+        """
+        return sum(len(q) for q in list(self.queues.values()))
+
+    def close(self):
+        """
+        Process the trades left in the queues, e.g. once the stream has stopped.
+        """
+        for queue in list(self.queues.values()):
+            queue.close()
+
+    def gauges(self):
+        """
+        :return :(dict) the functions returning the depth of the queues and the dropped and
+                 coalesced trades by name, to register as gauges of a metrics.Metrics.
+        """
+        return {'ingest_queue_depth': self.depth,
+                'ingest_dropped_total': lambda: self.stats()['dropped'],
+                'ingest_coalesced_total': lambda: self.stats()['coalesced'],
+                'ingest_blocked_total': lambda: self.stats()['blocked']}
+
+    def stats(self):
+        """
+        :return :(dict) the counters summed over the queues, with the maximum depth of a queue.
+        """
+        stats = {'queues': len(self.queues), 'received': 0, 'processed': 0, 'dropped': 0,
+                 'coalesced': 0, 'blocked': 0, 'depth': 0, 'max_depth': 0}
+        for queue in list(self.queues.values()):
+            for key, value in queue.stats().items():
+                if key == 'max_depth':
+                    stats[key] = max(stats[key], value)
+                else:
+                    stats[key] += value
+        return stats
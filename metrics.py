@@ -0,0 +1,388 @@
+"""
+This script contains the runtime metrics of the bar pipeline: the ticks and bars per second of
+every symbol, the latency from the exchange timestamp of a trade to the bar it closes, the lag
+of the event loop, the depth of the writer queue and the latency of the REST calls. The
+metrics are exposed in the Prometheus text format on a local HTTP endpoint or in a snapshot
+file rewritten periodically.
+"""
+import os
+import time
+import bisect
+import asyncio
+import logging
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+# the upper bounds in seconds of the latency buckets, from 10 microseconds to about 2 minutes
+LATENCY_BUCKETS = tuple(1e-5 * 2 ** i for i in range(24))
+
+
+def _copy(mapping: dict):
+    """
+    Copy a dict updated by the event loop from another thread, retrying if a key was added
+    during the copy.
+    """
+    while True:
+        try:
+            return dict(mapping)
+        except RuntimeError:
+            pass
+
+
+def _epoch(timestamp):
+    """
+    Convert the timestamp of a trade to seconds since the epoch.
+    :param timestamp : a datetime or a string (naive ones are taken as UTC) or a number of
+                       nanoseconds or seconds since the epoch.
+    :return :(float) the seconds since the epoch.
+    """
+    if isinstance(timestamp, (int, float)):
+        return timestamp / 1e9 if timestamp > 1e14 else float(timestamp)
+    return pd.Timestamp(timestamp).timestamp()
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets, recorded in O(log(buckets)) without keeping the values.
+    """
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds: tuple = LATENCY_BUCKETS):
+        """
+        :param bounds :(tuple) the increasing upper bounds of the buckets.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket has no upper bound
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        """
+        :param q :(float) the quantile between 0 and 1.
+        :return :(float) the upper bound of the bucket of the quantile (at most the maximum) or
+                 None if nothing was recorded.
+        """
+        if self.count == 0:
+            return None
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        """
+        :return :(dict) the count, the mean, the 50th, 90th and 99th percentiles and the maximum.
+        """
+        return {'count': self.count,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                'max': self.max if self.count else None}
+
+    def lines(self, name: str, labels: str = ''):
+        """
+        :return :(list) the lines of the histogram in the Prometheus text format.
+        """
+        sep = ',' if labels else ''
+        lines, cumulative = [], 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:.6g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {self.sum:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+class InstrumentedAPI:
+    """
+    A wrapper of the REST API client that records the latency of every call by method.
+    """
+
+    def __init__(self, api, metrics):
+        """
+        :param api : the REST API client.
+        :param metrics :(Metrics) the metrics to record the latencies in.
+        """
+        self._api = api
+        self._metrics = metrics
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+        metrics = self._metrics
+
+        def call(*args, **kwargs):
+            start, failed = time.perf_counter(), False
+            try:
+                return attr(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                metrics.record_rest(name, time.perf_counter() - start, failed)
+        return call
+
+
+class Metrics:
+    """
+    The metrics of a bar (or strategy) process. The counters are updated on the event loop by
+    the trade handler without a lock, and copied by the endpoint or the snapshot thread when a
+    snapshot is taken. The rates are computed over windows of interval seconds, and the highest
+    rate of every symbol is kept to see the bursts at the open. The lag of the event loop is
+    measured once watch_loop is called.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        """
+        :param interval :(float) the seconds between the checks of the event loop lag, which
+                         is also the window of the rates.
+        """
+        self.interval = interval
+        self.started = time.time()
+        self.ticks = Counter()  # the trades by symbol
+        self.bars = Counter()  # the bars by symbol
+        self.tick_rate = {}  # the ticks per second of the last window by symbol
+        self.bar_rate = {}  # the bars per second of the last window by symbol
+        self.peak_tick_rate = {}
+        self.latency = {}  # the exchange timestamp to bar latency histogram by symbol
+        self.loop_lag = Histogram()
+        self.last_loop_lag = 0.0
+        self.rest_latency = {}  # the REST call latency histogram by method
+        self.rest_errors = Counter()
+        self.gauges = {}  # the functions returning the current value of the gauges by name
+        self._window = (time.monotonic(), Counter(), Counter())
+        self._watching = None  # the event loop being watched
+        self._lock = threading.Lock()
+        self._server = None
+        self._snapshots = None
+
+    def record(self, symbol: str, timestamp, bar=None):
+        """
+        Count a trade of a symbol and the bar it closed. This is called by the trade handler
+        with every trade.
+        :param symbol :(str) the symbol of the trade.
+        :param timestamp : the exchange timestamp of the trade.
+        :param bar : the bar closed by the trade, if any, or the list of the bars it closed.
+        """
+        # only the event loop writes the counters, the readers copy them
+        self.ticks[symbol] += 1
+        if bar:
+            self.bars[symbol] += len(bar) if isinstance(bar, list) else 1
+            hist = self.latency.get(symbol)
+            if hist is None:
+                hist = self.latency[symbol] = Histogram()
+            hist.record(max(time.time() - _epoch(timestamp), 0.0))
+
+    def record_rest(self, method: str, seconds: float, failed: bool = False):
+        """
+        Record the latency of a REST call.
+        :param method :(str) the name of the method of the REST API.
+        :param seconds :(float) the duration of the call.
+        :param failed :(bool) True if the call raised an error.
+        """
+        with self._lock:
+            # the calls are made from several threads
+            hist = self.rest_latency.get(method)
+            if hist is None:
+                hist = self.rest_latency[method] = Histogram()
+            hist.record(seconds)
+            if failed:
+                self.rest_errors[method] += 1
+
+    def instrument(self, api):
+        """
+        :param api : the REST API client.
+        :return :(InstrumentedAPI) the client recording the latency of its calls.
+        """
+        return InstrumentedAPI(api, self)
+
+    def gauge(self, name: str, func):
+        """
+        Register a gauge read when the metrics are exported, e.g. the depth of a queue.
+        :param name :(str) the name of the gauge.
+        :param func : a function without arguments returning the value of the gauge.
+        """
+        self.gauges[name] = func
+
+    @property
+    def watching(self):
+        """
+        True if the lag of an event loop that is still open is measured.
+        """
+        return self._watching is not None and not self._watching.is_closed()
+
+    def watch_loop(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Measure the lag of an event loop: a timer is scheduled every interval seconds and the
+        extra time it takes to run is the time the loop was busy.
+        :param loop :(asyncio.AbstractEventLoop) the event loop of the trade handlers. If None the
+                     running event loop is used.
+        """
+        loop = loop or asyncio.get_running_loop()
+        self._watching = loop
+        loop.call_later(self.interval, self._watch, loop, time.monotonic() + self.interval)
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, due: float):
+        now = time.monotonic()
+        self.last_loop_lag = max(now - due, 0.0)
+        self.loop_lag.record(self.last_loop_lag)
+        self._roll(now)
+        if self._watching is loop:
+            loop.call_later(self.interval, self._watch, loop, now + self.interval)
+
+    def _roll(self, now: float):
+        """
+        Compute the rates of the window ending now and start the next one. It runs on the
+        event loop and on the threads taking the snapshots.
+        """
+        with self._lock:
+            start, ticks, bars = self._window
+            elapsed = now - start
+            if elapsed < self.interval:
+                return
+            current_ticks, current_bars = Counter(_copy(self.ticks)), Counter(_copy(self.bars))
+            for symbol, n in current_ticks.items():
+                rate = (n - ticks[symbol]) / elapsed
+                self.tick_rate[symbol] = rate
+                self.peak_tick_rate[symbol] = max(self.peak_tick_rate.get(symbol, 0.0), rate)
+            for symbol, n in current_bars.items():
+                self.bar_rate[symbol] = (n - bars[symbol]) / elapsed
+            self._window = (now, current_ticks, current_bars)
+
+    def snapshot(self):
+        """
+        :return :(dict) the current values of the metrics.
+        """
+        self._roll(time.monotonic())
+        gauges = {}
+        for name, func in list(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                logging.exception(e)
+        ticks, bars, latency = _copy(self.ticks), _copy(self.bars), _copy(self.latency)
+        with self._lock:
+            return {
+                'uptime': time.time() - self.started,
+                'symbols': {symbol: {
+                    'ticks': n,
+                    'bars': bars.get(symbol, 0),
+                    'ticks_per_sec': self.tick_rate.get(symbol, 0.0),
+                    'bars_per_sec': self.bar_rate.get(symbol, 0.0),
+                    'peak_ticks_per_sec': self.peak_tick_rate.get(symbol, 0.0),
+                    'bar_latency': latency[symbol].summary() if symbol in latency else None}
+                    for symbol, n in ticks.items()},
+                'loop_lag': dict(self.loop_lag.summary(), last=self.last_loop_lag),
+                'rest_latency': {method: hist.summary()
+                                 for method, hist in self.rest_latency.items()},
+                'rest_errors': dict(self.rest_errors),
+                'gauges': gauges}
+
+    def render(self):
+        """
+        :return :(str) the metrics in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = [f'uptime_seconds {snapshot["uptime"]:.1f}']
+        for symbol, stats in snapshot['symbols'].items():
+            label = f'symbol="{symbol}"'
+            lines.append(f'ticks_total{{{label}}} {stats["ticks"]}')
+            lines.append(f'bars_total{{{label}}} {stats["bars"]}')
+            lines.append(f'ticks_per_second{{{label}}} {stats["ticks_per_sec"]:.2f}')
+            lines.append(f'bars_per_second{{{label}}} {stats["bars_per_sec"]:.4f}')
+            lines.append(f'peak_ticks_per_second{{{label}}} {stats["peak_ticks_per_sec"]:.2f}')
+        for symbol, hist in _copy(self.latency).items():
+            lines.extend(hist.lines('bar_latency_seconds', f'symbol="{symbol}"'))
+        with self._lock:
+            lines.append(f'loop_lag_seconds {self.last_loop_lag:.6f}')
+            lines.extend(self.loop_lag.lines('loop_lag_seconds_histogram'))
+            for method, hist in self.rest_latency.items():
+                lines.extend(hist.lines('rest_latency_seconds', f'method="{method}"'))
+        for method, n in snapshot['rest_errors'].items():
+            lines.append(f'rest_errors_total{{method="{method}"}} {n}')
+        for name, value in snapshot['gauges'].items():
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9100, host: str = '127.0.0.1'):
+        """
+        Serve the metrics in the Prometheus text format on a local HTTP endpoint from a
+        background thread.
+        :param port :(int) the port of the endpoint.
+        :param host :(str) the interface to listen on.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # no console output for every scrape
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name='Metrics', daemon=True).start()
+        return self._server.server_address
+
+    def write_snapshots(self, path: str, every: float = 10.0):
+        """
+        Rewrite a snapshot file of the metrics periodically from a background thread. The file
+        is replaced atomically so it can be read at any time.
+        :param path :(str) the path of the snapshot file.
+        :param every :(float) the seconds between the snapshots.
+        """
+        stop = self._snapshots = threading.Event()
+
+        def run():
+            while not stop.wait(every):
+                self.write_snapshot(path)
+        threading.Thread(target=run, name='MetricsSnapshot', daemon=True).start()
+
+    def write_snapshot(self, path: str):
+        """
+        Write a snapshot of the metrics.
+        :param path :(str) the path of the snapshot file.
+        """
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.exception(e)
+
+    def close(self):
+        """
+        Stop the endpoint and the snapshots.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._snapshots is not None:
+            self._snapshots.set()
+            self._snapshots = None
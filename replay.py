@@ -0,0 +1,196 @@
+"""
+This script replays recorded trades from local files through the same trade handlers
+that are used with the Streaming API.
+"""
+import re
+import time
+import heapq
+import asyncio
+from typing import Union
+
+import pandas as pd
+
+from bars import get_bars
+
+
+class Trade:
+    """
+    A recorded trade with the same attributes as the trade data of the Streaming API.
+    """
+    __slots__ = ('symbol', 'price', 'size', 'timestamp')
+
+    def __init__(self, symbol: str, price: float, size: int, timestamp):
+        self.symbol = symbol
+        self.price = price
+        self.size = size
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f'Trade(symbol={self.symbol}, price={self.price}, size={self.size}, timestamp={self.timestamp})'
+
+
+def _read_file(path: str, symbols: set = None, chunksize: int = 100000,
+               tz: str = 'America/New_York'):
+    """
+    Read the trades of a CSV file in chunks. The file must have "timestamp", "symbol", "price"
+    and "size" columns with the trades in time order.
+    :param path :(str) the path of the CSV file.
+    :param symbols :(set) the symbols to keep. If None all the trades are kept.
+    :param chunksize :(int) the number of rows parsed at a time.
+    :param tz :(str) the timezone of the trade timestamps.
+    :return : a generator of the trades.
+    """
+    for chunk in pd.read_csv(
+            path,
+            usecols=['timestamp', 'symbol', 'price', 'size'],
+            chunksize=chunksize):
+        if symbols is not None:
+            chunk = chunk[chunk['symbol'].isin(symbols)]
+        # the fractional seconds are left out when they are zero
+        timestamps = pd.to_datetime(chunk['timestamp'], utc=True, format='ISO8601').dt.tz_convert(tz)
+        for ts, symbol, price, size in zip(
+                timestamps, chunk['symbol'].values, chunk['price'].values, chunk['size'].values):
+            yield Trade(symbol, float(price), int(size), ts)
+
+
+def read_trades(paths: Union[str, list], symbols: list = None,
+                chunksize: int = 100000, tz: str = 'America/New_York'):
+    """
+    Read the recorded trades from one or more CSV files, merging the files in time order.
+    :param paths :(str or list) a path or a list of paths of the CSV files.
+    :param symbols :(list) the symbols to keep. If None all the trades are kept.
+    :param chunksize :(int) the number of rows parsed at a time.
+    :param tz :(str) the timezone of the trade timestamps.
+    :return : a generator of the trades.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    if symbols is not None:
+        symbols = set(symbols)
+    readers = [_read_file(path, symbols, chunksize, tz) for path in paths]
+    if len(readers) == 1:
+        return readers[0]
+    return heapq.merge(*readers, key=lambda trade: trade.timestamp)
+
+
+class ReplayConn:
+    """
+    A replacement for the StreamConn of the Streaming API that dispatches recorded trades
+    to the registered handlers. The trades are replayed either as fast as possible or
+    at a multiple of the recorded speed.
+    """
+
+    def __init__(self, paths: Union[str, list] = None, speed: float = None,
+                 chunksize: int = 100000, tz: str = 'America/New_York',
+                 trades: list = None, record_latency: bool = False):
+        """
+        :param paths :(str or list) a path or a list of paths of the CSV files with the trades.
+        :param speed :(float) the replay speed as a multiple of the recorded time, e.g. 10 to
+                      replay an hour in six minutes. If None the trades are replayed as fast as possible.
+        :param chunksize :(int) the number of rows parsed at a time.
+        :param tz :(str) the timezone of the trade timestamps.
+        :param trades :(list) trades already in memory to replay instead of the files.
+        :param record_latency :(bool) if True the time spent in the handlers is recorded for every trade.
+        """
+        if paths is None and trades is None:
+            raise ValueError('Either the paths of the trade files or the trades must be given')
+        self.paths = paths
+        self.trades = trades
+        self.record_latency = record_latency
+        self.speed = speed
+        self.chunksize = chunksize
+        self.tz = tz
+        self._handlers = {}
+        # the statistics of the last replay
+        self.stats = {}
+        # the handler latency in nanoseconds of every trade of the last replay
+        self.latencies = []
+
+    def on(self, channel_pat: str):
+        """
+        Register a handler for the channels matching a pattern, as StreamConn.on does.
+        :param channel_pat :(str) the regular expression of the channels.
+        """
+        def decorator(func):
+            self._handlers[re.compile(channel_pat)] = func
+            return func
+        return decorator
+
+    def run(self, initial_channels: list):
+        """
+        Replay the trades of the subscribed symbols and report the throughput.
+        :param initial_channels :(list) the channels to subscribe to, e.g. ['T.AAPL', 'T.TSLA'].
+        :return :(dict) the number of trades, the elapsed seconds and the trades per second.
+        """
+        symbols = [c[2:] for c in initial_channels if c.startswith('T.')]
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._replay(symbols))
+        finally:
+            loop.close()
+        print(
+            f"Replayed {self.stats['ticks']} trades in {self.stats['seconds']:.2f} seconds "
+            f"({self.stats['ticks_per_sec']:.0f} ticks/sec)")
+        return self.stats
+
+    async def _replay(self, symbols: list):
+        """
+        Dispatch the trades to the handlers of the trade channel.
+        :param symbols :(list) the symbols to replay.
+        """
+        handlers = [h for pat, h in self._handlers.items() if pat.match('T')]
+        if self.trades is not None:
+            symbols = set(symbols)
+            trades = (t for t in self.trades if t.symbol in symbols)
+        else:
+            trades = read_trades(self.paths, symbols, self.chunksize, self.tz)
+        latencies = self.latencies = []
+        ticks = 0
+        start = time.perf_counter()
+        first_ts = None
+        for trade in trades:
+            if self.speed is not None:
+                # wait until the trade is due at the replay speed
+                if first_ts is None:
+                    first_ts = trade.timestamp
+                due = (trade.timestamp - first_ts).total_seconds() / self.speed
+                delay = due - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if self.record_latency:
+                t0 = time.perf_counter_ns()
+                for handler in handlers:
+                    await handler(self, 'T', trade)
+                latencies.append(time.perf_counter_ns() - t0)
+            else:
+                for handler in handlers:
+                    await handler(self, 'T', trade)
+            ticks += 1
+        seconds = time.perf_counter() - start
+        self.stats = {
+            'ticks': ticks,
+            'seconds': seconds,
+            'ticks_per_sec': ticks / seconds if seconds > 0 else 0.0}
+
+
+def replay_bars(paths: Union[str, list],
+                bar_type: str,
+                symbols: Union[str, list],
+                threshold: Union[int, dict],
+                save_to: str,
+                speed: float = None,
+                store: str = 'csv'):
+    """
+    Generate the bars from recorded trades through the same path as the realtime bars.
+    :param paths :(str or list) a path or a list of paths of the CSV files with the trades.
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar".
+    :param symbols :(str or list) a ticker symbol or a list of ticker symbols to generate the bars.
+    :param threshold :(int or dict) threshold for bar formation or sampling.
+    :param save_to :(str) the path to store the bars.
+    :param speed :(float) the replay speed. If None the trades are replayed as fast as possible.
+    :param store :(str) the storage backend. Either "csv" or "columnar".
+    :return :(dict) the replay statistics.
+    """
+    conn = ReplayConn(paths, speed)
+    get_bars(bar_type, symbols, threshold, save_to, store=store, conn=conn)
+    return conn.stats
@@ -0,0 +1,322 @@
+"""
+This script shards the bar formation of many symbols over several worker processes.
+One ingest process receives the trades from the Streaming API and routes them by symbol
+to the workers, each of which owns the EventDrivenBars instances of its symbols.
+"""
+import os
+import time
+import zlib
+import queue
+import asyncio
+import multiprocessing as mp
+from collections import deque
+from typing import Union
+
+from bars import EventDrivenBars, get_thresholds
+from connection import Client
+from replay import Trade
+from storage import CSVStore, ColumnarStore
+from writer import BarWriter
+
+# the per-shard counters updated by the workers
+_TICKS, _BARS, _BATCHES = range(3)
+
+
+def shard_of(symbol: str, shards: int):
+    """
+    Get the shard of a symbol. A stable hash is used so a symbol always goes to the same shard.
+    :param symbol :(str) the ticker symbol.
+    :param shards :(int) the number of shards.
+    :return :(int) the shard number.
+    """
+    return zlib.crc32(symbol.encode()) % shards
+
+
+def _shard_store(store: str, save_to: str, shard: int):
+    """
+    Create the storage backend of a shard. The columnar store is already partitioned by symbol,
+    the CSV store gets one file per shard.
+    """
+    if store == 'csv':
+        return CSVStore(save_to, filename=f'{{bar_type}}/realtime_shard{shard}.csv')
+    if store == 'columnar':
+        return ColumnarStore(save_to)
+    raise ValueError(
+        f'{store} is not a valid store. Please enter either "csv" or "columnar"')
+
+
+def _shard_worker(shard: int, bar_type: str, thresholds: dict, save_to: str,
+                  store: str, trades: mp.Queue, counters):
+    """
+    The loop of a worker process. It aggregates the batches of trades of its symbols until
+    it receives None.
+    :param shard :(int) the shard number.
+    :param bar_type :(str) Type of bar to form.
+    :param thresholds :(dict) the thresholds of the symbols of the shard.
+    :param save_to :(str) the path to store the bars.
+    :param store :(str) the storage backend. Either "csv" or "columnar".
+    :param trades :(mp.Queue) the queue of the batches of trades.
+    :param counters : the shared array of the per-shard counters.
+    """
+    writer = BarWriter(_shard_store(store, save_to, shard))
+    instances = {
+        symbol: EventDrivenBars(bar_type, threshold, os.devnull, writer)
+        for symbol, threshold in thresholds.items()}
+    base = shard * 3
+    try:
+        while True:
+            batch = trades.get()
+            if batch is None:
+                break
+            bars = 0
+            for symbol, price, size, timestamp in batch:
+                if instances[symbol].aggregate_bar(Trade(symbol, price, size, timestamp)):
+                    bars += 1
+            counters[base + _TICKS] += len(batch)
+            counters[base + _BARS] += bars
+            counters[base + _BATCHES] += 1
+    finally:
+        writer.close()
+
+
+class ShardedBars:
+    """
+    Routes the trades to worker processes by a hash of their symbol. The trades are sent in
+    batches over a bounded queue per shard. The ingest never waits for a worker: the batches
+    that do not fit in the queue of a shard are held in a backlog and sent again from the
+    event loop, and the oldest are dropped (and counted) once the backlog is full.
+    """
+
+    def __init__(
+            self,
+            bar_type: str,
+            thresholds: dict,
+            save_to: str,
+            shards: int = None,
+            store: str = 'csv',
+            queue_size: int = 1000,
+            batch_size: int = 100,
+            max_delay: float = 0.05,
+            backlog: int = 100):
+        """
+        :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar".
+        :param thresholds :(dict) the thresholds with the symbols as keys.
+        :param save_to :(str) the path to store the bars.
+        :param shards :(int) the number of worker processes. If None the number of CPUs is used.
+        :param store :(str) the storage backend. Either "csv" or "columnar".
+        :param queue_size :(int) the maximum number of batches waiting in the queue of a shard.
+        :param batch_size :(int) the number of trades sent to a shard at a time.
+        :param max_delay :(float) the maximum number of seconds a trade waits for its batch to fill.
+        :param backlog :(int) the maximum number of batches of a shard held by the ingest while its
+                        queue is full. The oldest batches are dropped beyond it.
+        """
+        self.bar_type = bar_type
+        self.thresholds = thresholds
+        self.save_to = save_to
+        self.shards = shards or os.cpu_count() or 1
+        self.store = store
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.backlog = backlog
+        self.route = {symbol: shard_of(symbol, self.shards) for symbol in thresholds}
+        self._queues = [mp.Queue(queue_size) for _ in range(self.shards)]
+        self._buffers = [[] for _ in range(self.shards)]
+        # the batches waiting for room in the queues
+        self._pending = [deque() for _ in range(self.shards)]
+        # the batches scheduled to be sent after max_delay
+        self._scheduled = [False] * self.shards
+        self._counters = mp.Array('q', self.shards * 3, lock=False)
+        # the ingest side counters
+        self._sent = [0] * self.shards
+        self._blocked = [0] * self.shards
+        self._dropped = [0] * self.shards
+        self._workers = []
+
+    def start(self):
+        """
+        Start the worker processes.
+        """
+        self._workers = []
+        for shard in range(self.shards):
+            thresholds = {s: t for s, t in self.thresholds.items() if self.route[s] == shard}
+            worker = mp.Process(
+                target=_shard_worker,
+                args=(shard, self.bar_type, thresholds, self.save_to, self.store,
+                      self._queues[shard], self._counters),
+                name=f'ShardedBars-{shard}',
+                daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, data):
+        """
+        Route a trade to the shard of its symbol.
+        :param data : A data object containing the ticks of a single timestamp or tick.
+        """
+        shard = self.route[data.symbol]
+        buffer = self._buffers[shard]
+        buffer.append((data.symbol, data.price, data.size, data.timestamp))
+        if len(buffer) >= self.batch_size:
+            self._send(shard)
+        else:
+            # send a partial batch if it does not fill in time
+            self._schedule(shard)
+
+    def _schedule(self, shard: int):
+        """
+        Send the trades of a shard after max_delay seconds, if they are not already scheduled.
+        :param shard :(int) the shard number.
+        """
+        if self._scheduled[shard]:
+            return
+        try:
+            asyncio.get_running_loop().call_later(self.max_delay, self._send, shard)
+            self._scheduled[shard] = True
+        except RuntimeError:
+            # no event loop, the trades are sent with the next full batch or at flush
+            pass
+
+    def _alive(self, shard: int):
+        """
+        :param shard :(int) the shard number.
+        :return :(bool) False if the worker of the shard was started and has died.
+        """
+        return shard >= len(self._workers) or self._workers[shard].is_alive()
+
+    def _send(self, shard: int):
+        """
+        Hand the buffered trades of a shard to its worker without waiting, see _drain.
+        :param shard :(int) the shard number.
+        """
+        self._scheduled[shard] = False
+        buffer = self._buffers[shard]
+        if buffer:
+            self._buffers[shard] = []
+            self._pending[shard].append(buffer)
+        self._drain(shard)
+
+    def _drain(self, shard: int, block: bool = False):
+        """
+        Put the batches waiting for a shard in its queue, in order. If the queue is full the
+        batches stay in the backlog (the oldest beyond its size are dropped) and are sent again
+        after max_delay seconds. The batches of a dead worker are dropped.
+        :param shard :(int) the shard number.
+        :param block :(bool) wait for room in the queue while the worker is alive, e.g. at the stop.
+        """
+        pending = self._pending[shard]
+        while pending:
+            if not self._alive(shard):
+                self._dropped[shard] += sum(len(batch) for batch in pending)
+                pending.clear()
+                return
+            try:
+                if block:
+                    self._queues[shard].put(pending[0], timeout=0.1)
+                else:
+                    self._queues[shard].put_nowait(pending[0])
+            except queue.Full:
+                if block:
+                    continue
+                self._blocked[shard] += 1
+                while len(pending) > self.backlog:
+                    self._dropped[shard] += len(pending.popleft())
+                self._schedule(shard)
+                return
+            self._sent[shard] += len(pending.popleft())
+
+    def flush(self):
+        """
+        Send the partial batches of all the shards.
+        """
+        for shard in range(self.shards):
+            self._send(shard)
+
+    def stop(self):
+        """
+        Send the remaining trades, then stop the workers once they have processed them.
+        """
+        self.flush()
+        for shard, q in enumerate(self._queues):
+            # the stream has stopped, the backlog can wait for the worker
+            self._drain(shard, block=True)
+            # a dead worker would never drain its queue
+            if self._alive(shard):
+                q.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def stats(self):
+        """
+        :return :(list) the statistics of every shard: the symbols, whether its worker is alive,
+                  the trades sent, processed, dropped and waiting in the backlog, the batches
+                  still queued, the bars formed, the batches and the times the queue was full.
+        """
+        stats = []
+        for shard in range(self.shards):
+            base = shard * 3
+            try:
+                depth = self._queues[shard].qsize()
+            except NotImplementedError:
+                # not available on macOS
+                depth = None
+            stats.append({
+                'shard': shard,
+                'symbols': sum(1 for s in self.route.values() if s == shard),
+                'alive': self._alive(shard),
+                'sent': self._sent[shard],
+                'dropped': self._dropped[shard],
+                'backlog': sum(len(batch) for batch in self._pending[shard]),
+                'ticks': self._counters[base + _TICKS],
+                'bars': self._counters[base + _BARS],
+                'batches': self._counters[base + _BATCHES],
+                'queue_depth': depth,
+                'queue_full': self._blocked[shard]})
+        return stats
+
+
+def get_sharded_bars(bar_type: str,
+                     symbols: Union[str, list],
+                     threshold: Union[int, dict],
+                     save_to: str,
+                     shards: int = None,
+                     store: str = 'csv',
+                     conn=None,
+                     stats_interval: float = 60,
+                     **kwargs):
+    """
+    Get the realtime bars with the symbols sharded over several worker processes.
+    :param bar_type :(str) Type of bar to form. Either "tick_bar", "volume_bar" or "dollar_bar".
+    :param symbols :(str or list) a ticker symbol or a list of ticker symbols to generate the bars.
+    :param threshold :(int or dict) threshold for bar formation or sampling. A dictionary must be
+                      given if bars to generated for multiple symbols. The dictionary keys are
+                      ticker symbols and values are the thresholds respectively.
+    :param save_to :(str) the path to store the bars.
+    :param shards :(int) the number of worker processes. If None the number of CPUs is used.
+    :param store :(str) the storage backend. Either "csv" (one file per shard) or "columnar".
+    :param conn : the stream connection to receive the trades from. If None a connection to the
+                  Streaming API is created.
+    :param stats_interval :(float) the number of seconds between the prints of the shard statistics.
+    :param kwargs : the queue_size, batch_size, max_delay and backlog of ShardedBars.
+    :return :(ShardedBars) the stopped shards with their final statistics.
+    """
+    if conn is None:
+        conn = Client().connect()
+    thresholds = get_thresholds(symbols, threshold)
+    channels = ['trade_updates'] + ['T.' + sym.upper() for sym in thresholds]
+    sharded = ShardedBars(bar_type, thresholds, save_to, shards, store, **kwargs)
+    sharded.start()
+    last_stats = time.monotonic()
+
+    @conn.on(r'T$')
+    async def on_trade(conn, channel, data):
+        nonlocal last_stats
+        if data.symbol in sharded.route and data.price > 0 and data.size > 0:
+            sharded.submit(data)
+        if time.monotonic() - last_stats >= stats_interval:
+            last_stats = time.monotonic()
+            print(sharded.stats())
+    try:
+        conn.run(channels)
+    finally:
+        sharded.stop()
+    return sharded
@@ -0,0 +1,569 @@
+"""
+This script contains the storage backends for the bars.
+"""
+import io
+import os
+import csv
+import threading
+import numpy as np
+import pandas as pd
+
+# the columns of a bar in the order they are saved
+HEADER = [
+    'timestamp',
+    'symbol',
+    'open',
+    'high',
+    'low',
+    'close',
+    'vwap',
+    'cum_tick',
+    'cum_volume',
+    'cum_dollar_value',
+    'cum_buy_tick',
+    'cum_buy_volume',
+    'cum_buy_dollar_value']
+
+# the data type of every column in the columnar store (timestamps are nanoseconds since epoch in UTC)
+COLUMN_DTYPES = {
+    'timestamp': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'vwap': np.float64,
+    'cum_tick': np.int64,
+    'cum_volume': np.float64,
+    'cum_dollar_value': np.float64,
+    'cum_buy_tick': np.int64,
+    'cum_buy_volume': np.float64,
+    'cum_buy_dollar_value': np.float64}
+
+# the price columns, read as floats even when a few bars have whole prices
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'vwap']
+
+# the size of the blocks read backwards from the end of a CSV file
+TAIL_BLOCK_SIZE = 1 << 16
+
+
+class BarStore:
+    """
+    A base class for the storage backends. The bars are appended as rows with the values
+    in the order of HEADER and read back as a DataFrame indexed by timestamp.
+    """
+
+    def append(self, bar_type: str, rows: list):
+        """
+        Append bars to the store.
+        :param bar_type :(str) the type of the bars.
+        :param rows :(list) the bars as lists of values in the order of HEADER.
+        """
+        raise NotImplementedError
+
+    def read(self, bar_type: str, symbol: str = None,
+             columns: list = None, last: int = None, start=None, end=None):
+        """
+        Read the bars from the store.
+        :param bar_type :(str) the type of the bars.
+        :param symbol :(str) the symbol to read. If None the bars of all the symbols are read.
+        :param columns :(list) the columns to read. If None all the columns are read.
+        :param last :(int) the number of most recent bars to read. If None all the bars are read.
+        :param start : the first timestamp to read (inclusive). If None the bars are read from
+                       the first one.
+        :param end : the last timestamp to read (inclusive). If None the bars are read up to
+                     the last one.
+        :return :(pd.DataFrame) the bars indexed by timestamp.
+        """
+        raise NotImplementedError
+
+    def sync(self):
+        """
+        Force the appended bars to disk.
+        """
+
+    def close(self):
+        """
+        Release the resources held by the store.
+        """
+
+
+def _utc(timestamp):
+    """
+    :param timestamp : a timestamp, naive timestamps are taken as UTC.
+    :return :(pd.Timestamp) the timestamp in UTC.
+    """
+    ts = pd.Timestamp(timestamp)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+def _time_mask(index, start=None, end=None):
+    """
+    Select the bars between two timestamps.
+    :param index : the timestamps of the bars, naive timestamps are taken as UTC.
+    :param start : the first timestamp (inclusive), or None.
+    :param end : the last timestamp (inclusive), or None.
+    :return :(np.ndarray) a boolean mask of the selected bars.
+    """
+    # the timestamps of a CSV file can have different UTC offsets, e.g. across a DST change
+    times = pd.to_datetime(index, utc=True)
+    mask = np.ones(len(times), dtype=bool)
+    if start is not None:
+        mask &= np.asarray(times >= _utc(start))
+    if end is not None:
+        mask &= np.asarray(times <= _utc(end))
+    return mask
+
+
+class CSVIndex:
+    """
+    A sidecar index of a bar CSV file, saved next to it as <file>.idx, with the byte offset of
+    the first bar of every symbol and trading day (the date of the timestamp as written). As the
+    bars are appended in time order, it bounds the part of the file to read for a time range.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path :(str) the path of the CSV file.
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self.entries = []  # (offset, symbol, day) in the order of the file
+        self.size = 0  # the bytes of the CSV file indexed
+        self._seen = set()
+        self._pending = []  # the entries not yet saved to the sidecar
+
+    def load(self):
+        """
+        Load the sidecar and index the bars appended after it was last saved. The index is
+        rebuilt if it does not match the CSV file, e.g. the file was replaced.
+        """
+        self.entries, self.size, self._seen, self._pending = [], 0, set(), []
+        try:
+            with open(self.index_path, newline='') as f:
+                self.entries = [(int(offset), symbol, day) for symbol, day, offset in csv.reader(f)]
+        except FileNotFoundError:
+            pass
+        if self.entries:
+            offset, symbol, day = self.entries[-1]
+            # the bars are indexed again from the last entry
+            if self._fields(offset) == (symbol, day):
+                self._seen = {(s, d) for _, s, d in self.entries}
+                self.size = offset
+            else:
+                self.entries = []
+                os.remove(self.index_path)
+        self.update()
+
+    def _fields(self, offset: int):
+        """
+        :param offset :(int) the byte offset of a bar in the CSV file.
+        :return :(tuple) the symbol and the day of the bar, or None if there is no bar there.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        fields = line.split(b',', 2)
+        if not line.endswith(b'\n') or len(fields) < 3:
+            return None
+        return fields[1].decode(), fields[0][:10].decode()
+
+    def update(self):
+        """
+        Index the bars appended to the CSV file since the last update.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        if size < self.size:
+            # the file was truncated
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self.entries, self.size, self._seen, self._pending = [], 0, set(), []
+        if size > self.size:
+            with open(self.path, 'rb') as f:
+                f.seek(self.size)
+                if self.size == 0:
+                    f.readline()  # the header
+                offset = f.tell()
+                for line in f:
+                    # a last bar without a newline is still being written
+                    if not line.endswith(b'\n'):
+                        break
+                    fields = line.split(b',', 2)
+                    self.add(offset, fields[1].decode(), fields[0][:10].decode())
+                    offset += len(line)
+                self.size = offset
+            self.flush()
+
+    def add(self, offset: int, symbol: str, day: str):
+        """
+        Index a bar appended to the CSV file.
+        :param offset :(int) the byte offset of the bar in the file.
+        :param symbol :(str) the symbol of the bar.
+        :param day :(str) the trading day of the bar as 'YYYY-MM-DD'.
+        """
+        if (symbol, day) not in self._seen:
+            self._seen.add((symbol, day))
+            self.entries.append((offset, symbol, day))
+            self._pending.append((symbol, day, offset))
+
+    def flush(self):
+        """
+        Save the new entries to the sidecar.
+        """
+        if self._pending:
+            with open(self.index_path, 'a', newline='') as f:
+                csv.writer(f).writerows(self._pending)
+            self._pending = []
+
+    def span(self, symbol: str = None, first_day: str = None, last_day: str = None):
+        """
+        Get the part of the CSV file holding the bars of a symbol between two trading days.
+        :param symbol :(str) the symbol. If None the bars of all the symbols.
+        :param first_day :(str) the first trading day as 'YYYY-MM-DD', or None.
+        :param last_day :(str) the last trading day as 'YYYY-MM-DD', or None.
+        :return :(tuple) the byte offsets where to start and stop reading. The start is None
+                 if there are no such bars and the stop is None to read to the end of the file.
+        """
+        begin = None
+        for offset, sym, day in self.entries:
+            if last_day is not None and day > last_day:
+                return begin, offset
+            if begin is None and (first_day is None or day >= first_day) and \
+                    (symbol is None or sym == symbol):
+                begin = offset
+        return begin, None
+
+
+class CSVStore(BarStore):
+    """
+    Stores all the symbols of a bar type in a single CSV file, with a sidecar index of the
+    byte offsets of every symbol and trading day (see CSVIndex). The most recent bars are read
+    by seeking backwards from the end of the file and a time range through the index, so
+    neither reads the whole file. The bars are appended by the writer thread while other
+    threads read them, so the indexes are only used under the lock of the store.
+    """
+
+    def __init__(self, root: str, filename: str = '{bar_type}/realtime.csv'):
+        """
+        :param root :(str) the directory to store the bars in.
+        :param filename :(str) the path of the CSV file of a bar type relative to the root.
+        """
+        self.root = root
+        self.filename = filename
+        # open file objects by bar type
+        self._files = {}
+        # the indexes of the files by bar type
+        self._indexes = {}
+        # held while an index is created or updated and while bars are appended
+        self._lock = threading.RLock()
+
+    def path(self, bar_type: str):
+        """
+        :param bar_type :(str) the type of the bars.
+        :return :(str) the path of the CSV file for the bar type.
+        """
+        return os.path.join(self.root, self.filename.format(bar_type=bar_type))
+
+    def index(self, bar_type: str):
+        """
+        :param bar_type :(str) the type of the bars.
+        :return :(CSVIndex) the index of the CSV file of the bar type, up to date. It must be
+                 used under the lock of the store, as the writer thread updates it.
+        """
+        with self._lock:
+            index = self._indexes.get(bar_type)
+            if index is None:
+                index = self._indexes[bar_type] = CSVIndex(self.path(bar_type))
+                index.load()
+            else:
+                index.update()
+            return index
+
+    def _open(self, bar_type: str):
+        """
+        Open the CSV file of a bar type for appending, writing the header if it is a new file.
+        :param bar_type :(str) the type of the bars.
+        """
+        path = self.path(bar_type)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        f = open(path, 'a+', newline='')
+        if f.tell() == 0:
+            csv.writer(f).writerow(HEADER)
+            f.flush()
+        self._files[bar_type] = f
+        return f
+
+    def append(self, bar_type: str, rows: list):
+        line = io.StringIO()
+        writer = csv.writer(line)
+        lines = []
+        for row in rows:
+            writer.writerow(row)
+            lines.append(line.getvalue())
+            line.seek(0)
+            line.truncate()
+        # a reader updating the index in the meantime would index the new bars too
+        with self._lock:
+            f = self._files.get(bar_type) or self._open(bar_type)
+            index = self.index(bar_type)
+            offset = index.size
+            for row, text in zip(rows, lines):
+                index.add(offset, row[1], str(row[0])[:10])
+                offset += len(text.encode())
+            f.write(''.join(lines))
+            f.flush()
+            index.size = offset
+            index.flush()
+
+    @staticmethod
+    def _tail(path: str, symbol: str, last: int):
+        """
+        Read the last bars of a CSV file by reading it backwards from the end in blocks.
+        :param path :(str) the path of the CSV file.
+        :param symbol :(str) the symbol of the bars. If None the bars of all the symbols.
+        :param last :(int) the number of bars to read.
+        :return :(io.BytesIO) the header and the bars in the CSV format.
+        """
+        symbol = None if symbol is None else symbol.encode()
+        rows = []
+        with open(path, 'rb') as f:
+            header = f.readline()
+            begin = f.tell()
+            pos = f.seek(0, os.SEEK_END)
+            tail = b''
+            partial = True
+            while pos > begin and len(rows) < last:
+                size = min(TAIL_BLOCK_SIZE, pos - begin)
+                pos -= size
+                f.seek(pos)
+                lines = (f.read(size) + tail).split(b'\n')
+                if partial:
+                    # after the last newline is a bar still being written (or nothing)
+                    partial = len(lines) == 1
+                    lines.pop()
+                # the first line may start in the previous block
+                tail = lines.pop(0) if lines and pos > begin else b''
+                for line in reversed(lines):
+                    if line and (symbol is None or line.split(b',', 2)[1] == symbol):
+                        rows.append(line)
+                        if len(rows) == last:
+                            break
+        rows.reverse()
+        return io.BytesIO(header + b''.join(row + b'\n' for row in rows))
+
+    def _range(self, bar_type: str, symbol: str = None, start=None, end=None):
+        """
+        Read the part of a CSV file holding the bars between two timestamps, using its index.
+        The bars of the days around the range are read too and are left to be filtered.
+        :return :(io.BytesIO) the header and the bars in the CSV format.
+        """
+        # the days are those of the timestamps as written, which can be off by one from UTC
+        first_day = None if start is None else \
+            (_utc(start) - pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        last_day = None if end is None else \
+            (_utc(end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+        with self._lock:
+            begin, stop = self.index(bar_type).span(symbol, first_day, last_day)
+        with open(self.path(bar_type), 'rb') as f:
+            header = f.readline()
+            if begin is None:
+                return io.BytesIO(header)
+            f.seek(begin)
+            data = f.read() if stop is None else f.read(stop - begin)
+        # a last bar without a newline is still being written
+        return io.BytesIO(header + data[:data.rfind(b'\n') + 1])
+
+    def read(self, bar_type: str, symbol: str = None,
+             columns: list = None, last: int = None, start=None, end=None):
+        usecols = None
+        if columns is not None:
+            usecols = ['timestamp', 'symbol'] + \
+                [c for c in columns if c not in ('timestamp', 'symbol')]
+        ranged = start is not None or end is not None
+        try:
+            if ranged:
+                source = self._range(bar_type, symbol, start, end)
+            elif last is not None:
+                # only the end of the file is read
+                source = self._tail(self.path(bar_type), symbol, last)
+            else:
+                source = self.path(bar_type)
+            df = pd.read_csv(
+                source,
+                index_col=[0],
+                parse_dates=[0],
+                usecols=usecols,
+                dtype={c: np.float64 for c in PRICE_COLUMNS})
+        except FileNotFoundError:
+            return pd.DataFrame(columns=columns or HEADER[1:])
+        if symbol is not None:
+            df = df[df['symbol'] == symbol]
+        if ranged:
+            df = df[_time_mask(df.index, start, end)]
+        if columns is not None:
+            df = df[[c for c in columns if c != 'timestamp']]
+        if last is not None:
+            df = df.iloc[-last:]
+        return df
+
+    def sync(self):
+        for f in self._files.values():
+            os.fsync(f.fileno())
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class ColumnarStore(BarStore):
+    """
+    Stores the bars as raw NumPy columns partitioned by bar type, symbol and trading day, i.e.
+    <root>/<bar_type>/<symbol>/<YYYY-MM-DD>/<column>.bin. A column is appended by writing its
+    values to the end of its file and read back with a memory map, so a read only touches the
+    requested partitions and columns.
+    """
+
+    def __init__(self, root: str, tz: str = 'US/Eastern'):
+        """
+        :param root :(str) the directory to store the bars in.
+        :param tz :(str) the timezone of the exchange, used to assign bars to a trading day.
+        """
+        self.root = root
+        self.tz = tz
+
+    def _partition(self, timestamp):
+        """
+        Get the trading day and the UTC nanoseconds of a bar timestamp.
+        :param timestamp : the bar timestamp, naive timestamps are taken as UTC.
+        :return :(tuple) the trading day as 'YYYY-MM-DD' and the timestamp as an int.
+        """
+        ts = pd.Timestamp(timestamp)
+        if ts.tzinfo is None:
+            ts = ts.tz_localize('UTC')
+        return ts.tz_convert(self.tz).strftime('%Y-%m-%d'), ts.value
+
+    def append(self, bar_type: str, rows: list):
+        # group the rows by symbol and trading day
+        partitions = {}
+        for row in rows:
+            day, ts = self._partition(row[0])
+            partitions.setdefault((row[1], day), []).append([ts] + list(row[2:]))
+        for (symbol, day), values in partitions.items():
+            path = os.path.join(self.root, bar_type, symbol, day)
+            os.makedirs(path, exist_ok=True)
+            values = list(zip(*values))
+            for i, column in enumerate(c for c in HEADER if c != 'symbol'):
+                with open(os.path.join(path, f'{column}.bin'), 'ab') as f:
+                    np.asarray(values[i], dtype=COLUMN_DTYPES[column]).tofile(f)
+
+    @staticmethod
+    def _map(path: str, column: str):
+        """
+        Memory map a column of a partition.
+        :param path :(str) the directory of the partition.
+        :param column :(str) the column name.
+        :return :(np.ndarray) the values of the column.
+        """
+        path = os.path.join(path, f'{column}.bin')
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=COLUMN_DTYPES[column])
+        return np.memmap(path, dtype=COLUMN_DTYPES[column], mode='r')
+
+    def _read_partition(self, path: str, columns: list, last: int = None):
+        """
+        Read the columns of a partition.
+        :param path :(str) the directory of the partition.
+        :param columns :(list) the columns to read besides the timestamp.
+        :param last :(int) the number of most recent bars to read.
+        :return :(dict) the values of the columns.
+        """
+        maps = {c: self._map(path, c) for c in ['timestamp'] + columns}
+        # columns can differ in length if the process stopped mid-append
+        n = min(len(m) for m in maps.values())
+        lo = 0 if last is None else max(n - last, 0)
+        return {c: np.array(m[lo:n]) for c, m in maps.items()}
+
+    def _read_symbol(self, bar_type: str, symbol: str,
+                     columns: list, last: int = None, start=None, end=None):
+        """
+        Read the bars of a symbol starting with the most recent trading day.
+        :return :(dict) the values of the columns.
+        """
+        base = os.path.join(self.root, bar_type, symbol)
+        days = sorted(os.listdir(base)) if os.path.isdir(base) else []
+        first_day, start = self._partition(start) if start is not None else (None, None)
+        last_day, end = self._partition(end) if end is not None else (None, None)
+        parts = []
+        for day in reversed(days):
+            if last_day is not None and day > last_day:
+                continue
+            if first_day is not None and day < first_day:
+                break
+            # only the bars of the first and last days of the range are filtered
+            bounded = day == first_day or day == last_day
+            part = self._read_partition(os.path.join(base, day), columns,
+                                        None if bounded else last)
+            if bounded:
+                keep = np.ones(len(part['timestamp']), dtype=bool)
+                if start is not None:
+                    keep &= part['timestamp'] >= start
+                if end is not None:
+                    keep &= part['timestamp'] <= end
+                lo = 0 if last is None else max(int(keep.sum()) - last, 0)
+                part = {c: v[keep][lo:] for c, v in part.items()}
+            parts.append(part)
+            if last is not None:
+                last -= len(part['timestamp'])
+                if last <= 0:
+                    break
+        parts.reverse()
+        return {c: np.concatenate([p[c] for p in parts]) if parts else
+                np.empty(0, dtype=COLUMN_DTYPES[c]) for c in ['timestamp'] + columns}
+
+    def read(self, bar_type: str, symbol: str = None,
+             columns: list = None, last: int = None, start=None, end=None):
+        if columns is None:
+            columns = [c for c in HEADER if c not in ('timestamp', 'symbol')]
+        else:
+            columns = [c for c in columns if c not in ('timestamp', 'symbol')]
+        if symbol is not None:
+            data = self._read_symbol(bar_type, symbol, columns, last, start, end)
+        else:
+            # read every symbol and merge them in time order
+            base = os.path.join(self.root, bar_type)
+            symbols = sorted(os.listdir(base)) if os.path.isdir(base) else []
+            frames = []
+            for sym in symbols:
+                part = self._read_symbol(bar_type, sym, columns, last, start, end)
+                part['symbol'] = np.full(len(part['timestamp']), sym, dtype=object)
+                frames.append(pd.DataFrame(part))
+            df = pd.concat(frames, ignore_index=True) if frames else \
+                pd.DataFrame(columns=['timestamp', 'symbol'] + columns)
+            df = df.sort_values('timestamp', kind='mergesort')
+            if last is not None:
+                df = df.iloc[-last:]
+            data = {c: df[c].values for c in ['timestamp', 'symbol'] + columns}
+            columns = ['symbol'] + columns
+        index = pd.to_datetime(data.pop('timestamp').astype(np.int64), utc=True).tz_convert(self.tz)
+        return pd.DataFrame(data, index=index.rename('timestamp'), columns=columns)
+
+
+def get_store(store: str, root: str, **kwargs):
+    """
+    Create a storage backend.
+    :param store :(str) the type of the store. Either "csv" or "columnar".
+    :param root :(str) the directory to store the bars in.
+    :return :(BarStore) the storage backend.
+    """
+    if store == 'csv':
+        return CSVStore(root, **kwargs)
+    if store == 'columnar':
+        return ColumnarStore(root, **kwargs)
+    raise ValueError(
+        f'{store} is not a valid store. Please enter either "csv" or "columnar"')
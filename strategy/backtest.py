@@ -0,0 +1,349 @@
+"""
+This script backtests the trend following strategy on stored bars. The REST API is replaced
+by a simulated broker that fills the market orders at the bar prices, so the strategy runs
+the same code (on_bar, OMS, RMS) as live. A grid of parameters can be run over a pool of
+processes, with the timing of every run in the report.
+
+    python backtest.py --bars volume_bar=../sample_datasets/analysis/AAPL_volume_bars.csv \
+        --symbol AAPL --windows 15 22 --tp 1 2 --sl 1 2 --output grid.csv
+"""
+import os
+import io
+import sys
+import time
+import logging
+import argparse
+import itertools
+import contextlib
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# the modules shared with the root of the repository (e.g. storage and writer) are imported from there
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import BarStore
+from trend_following import TrendFollowing
+
+
+class SimulatedBroker:
+    """
+    A broker with the methods of the REST API used by the strategy (submit_order,
+    close_position, cancel_order...) and of the PositionCache (get_position, get_open_orders).
+    The market orders are filled at once at the current price.
+    """
+
+    def __init__(self, commission: float = 0.0, slippage: float = 0.0):
+        """
+        :param commission : (float) the commission per share.
+        :param slippage : (float) the slippage as a fraction of the price, paid on every fill.
+        """
+        self.commission = commission
+        self.slippage = slippage
+        self.prices = {}  # the current price by symbol
+        self.time = None
+        self.qty = {}  # the signed quantity of the positions by symbol
+        self.cost = {}  # the signed cost of the positions by symbol
+        self.realized = 0.0
+        self.fills = []
+        self._orders = 0
+
+    def set_price(self, symbol: str, price: float, timestamp=None):
+        """
+        Set the current price of a symbol, used for the next fills.
+        """
+        self.prices[symbol] = price
+        if timestamp is not None:
+            self.time = timestamp
+
+    def _fill(self, symbol: str, qty: float):
+        """
+        Fill a signed quantity at the current price.
+        """
+        if symbol not in self.prices:
+            raise ValueError(
+                f'There is no price of {symbol} to fill the order. Please set it with set_price first.')
+        price = self.prices[symbol] * (1 + self.slippage * np.sign(qty))
+        # the commission is paid on every share, closing or opening a position
+        self.realized -= abs(qty) * self.commission
+        position = self.qty.get(symbol, 0)
+        cost = self.cost.get(symbol, 0.0)
+        if position and np.sign(qty) != np.sign(position):
+            # the part closing the position realizes its profit
+            closed = min(abs(qty), abs(position)) * np.sign(qty)
+            avg = cost / position
+            self.realized += -closed * (price - avg)
+            cost += closed * avg
+            position += closed
+            qty -= closed
+        position += qty
+        cost += qty * price
+        if position:
+            self.qty[symbol], self.cost[symbol] = position, cost
+        else:
+            self.qty.pop(symbol, None)
+            self.cost.pop(symbol, None)
+        self._orders += 1
+        self.fills.append((self.time, symbol, price))
+        return str(self._orders)
+
+    def submit_order(self, symbol: str, qty: float, side: str, type: str = 'market',
+                     time_in_force: str = 'day', **kwargs):
+        return self._fill(symbol, float(qty) if side == 'buy' else -float(qty))
+
+    def close_position(self, symbol: str):
+        if self.qty.get(symbol):
+            self._fill(symbol, -self.qty[symbol])
+
+    def close_all_positions(self):
+        for symbol in list(self.qty):
+            self.close_position(symbol)
+
+    def cancel_order(self, order_id: str):
+        # the orders are filled at once, there is nothing to cancel
+        pass
+
+    def cancel_all_orders(self):
+        pass
+
+    def get_position(self, symbol: str):
+        """
+        :return : (list) the side and the quantity of the position or False, as PositionCache.
+        """
+        qty = self.qty.get(symbol, 0)
+        if not qty:
+            return False
+        return ['long' if qty > 0 else 'short', abs(qty)]
+
+    def get_open_orders(self, symbol: str):
+        return []
+
+    def equity(self):
+        """
+        :return : (float) the realized and unrealized profit.
+        """
+        return self.realized + sum(
+            q * self.prices[s] - self.cost[s] for s, q in self.qty.items())
+
+
+class SimulatedSession:
+    """
+    A market session scheduler on the time of the bars, with a regular session every day.
+    """
+
+    def __init__(self, tz: str = 'America/New_York', close: dt.time = dt.time(16, 0)):
+        """
+        :param tz : (str) the timezone of the exchange.
+        :param close : (dt.time) the close of the session.
+        """
+        self.tz = tz
+        self.close = close
+        self.time = None
+
+    def minutes_to_close(self, now: pd.Timestamp = None):
+        now = now or self.time
+        close = now.normalize() + pd.Timedelta(hours=self.close.hour, minutes=self.close.minute)
+        return round((close - now).total_seconds() / 60)
+
+
+class ImmediateExecutor:
+    """
+    An executor running the calls at once, as the simulated broker does not wait.
+    """
+
+    @staticmethod
+    def submit(func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            logging.error(e, exc_info=e)
+
+    def shutdown(self, wait: bool = True):
+        pass
+
+
+class _NoHistory(BarStore):
+    """
+    A store without bars, so the strategy starts in collection mode.
+    """
+
+    def read(self, bar_type: str, symbol: str = None, columns: list = None, last: int = None):
+        return pd.DataFrame(columns=columns or ['close'])
+
+
+def read_bars(path: str, tz: str = 'America/New_York'):
+    """
+    Read a CSV of bars indexed by timestamp and keep the bars of the regular session
+    (09:30-16:00). Naive timestamps are taken as UTC.
+
+    :param path : (str) the path of the CSV.
+    :param tz : (str) the timezone of the exchange.
+    :return : (pd.DataFrame) the bars in the timezone of the exchange.
+    """
+    bars = pd.read_csv(path, index_col=[0], parse_dates=True)
+    if bars.index.tz is None:
+        bars = bars.tz_localize('UTC')
+    bars = bars.tz_convert(tz)
+    time_of_day = bars.index.time
+    return bars[(time_of_day >= dt.time(9, 30)) & (time_of_day <= dt.time(16, 0))]
+
+
+def backtest(bars: pd.DataFrame, symbol: str, bar_type: str, window_size: int = 22,
+             TP: float = 2, SL: float = 1, qty: int = 1, commission: float = 0.0,
+             slippage: float = 0.0, liquidate_minutes: float = 10):
+    """
+    Run the strategy on a series of bars. The take-profit and stop-loss are checked against the
+    high and low of every bar and filled at their level (the stop-loss first if both are
+    touched). The positions are closed at liquidate_minutes before the close, as in run.
+
+    :param bars : (pd.DataFrame) the bars with a "close" column (and "high" and "low") indexed
+                  by timestamp in the timezone of the exchange.
+    :param symbol : (str) the asset symbol.
+    :param bar_type : (str) the type of the bars.
+    :param window_size : (int) the lookback window for the Bollinger Band.
+    :param TP : (float) the take-profit multiple.
+    :param SL : (float) the stop-loss multiple.
+    :param qty : (int) the quantity to buy and sell.
+    :param commission : (float) the commission per share.
+    :param slippage : (float) the slippage as a fraction of the price.
+    :param liquidate_minutes : (float) the minutes before the close to liquidate the positions.
+    :return : (dict) the results with the profit, the number of fills, the maximum drawdown
+              and the timing of the run.
+    """
+    start = time.perf_counter()
+    broker = SimulatedBroker(commission, slippage)
+    session = SimulatedSession()
+    with contextlib.redirect_stdout(io.StringIO()):
+        strategy = TrendFollowing(
+            symbol, bar_type, TP, SL, qty, window_size, _NoHistory(),
+            broker, ImmediateExecutor(), session, broker)
+    close = bars['close'].to_numpy(dtype=np.float64)
+    high = bars['high'].to_numpy(dtype=np.float64) if 'high' in bars else close
+    low = bars['low'].to_numpy(dtype=np.float64) if 'low' in bars else close
+    equity = np.empty(len(close))
+    day = None
+    for i, timestamp in enumerate(bars.index):
+        session.time = timestamp
+        broker.time = timestamp
+        if day is not None and timestamp.date() != day and broker.get_position(symbol):
+            # no bar after the liquidation time of the previous day, close at its last price
+            broker.close_position(symbol)
+        day = timestamp.date()
+        position = broker.get_position(symbol)
+        if position and strategy.sl is not None:
+            # the take-profit and stop-loss touched during the bar
+            if position[0] == 'long':
+                level = strategy.sl if low[i] <= strategy.sl else (
+                    strategy.tp if high[i] >= strategy.tp else None)
+            else:
+                level = strategy.sl if high[i] >= strategy.sl else (
+                    strategy.tp if low[i] <= strategy.tp else None)
+            if level is not None:
+                broker.set_price(symbol, level)
+                strategy.RMS(level)
+        broker.set_price(symbol, close[i])
+        if session.minutes_to_close() <= liquidate_minutes and broker.get_position(symbol):
+            strategy.liquidate_position()
+        strategy.on_bar({'timestamp': timestamp, 'close': close[i]})
+        equity[i] = broker.equity()
+    broker.close_position(symbol)
+    seconds = time.perf_counter() - start
+    equity = np.concatenate(([0.0], equity))
+    drawdown = np.maximum.accumulate(equity) - equity
+    return {
+        'symbol': symbol,
+        'bar_type': bar_type,
+        'window_size': window_size,
+        'TP': TP,
+        'SL': SL,
+        'bars': len(close),
+        'fills': len(broker.fills),
+        'pnl': broker.realized,
+        'max_drawdown': float(drawdown.max()),
+        'seconds': seconds,
+        'bars_per_sec': len(close) / seconds if seconds > 0 else 0.0}
+
+
+# the bars of the worker processes by bar type
+_DATASETS = {}
+
+
+def _init_worker(datasets: dict):
+    _DATASETS.clear()
+    _DATASETS.update(datasets)
+
+
+def _run_task(task: tuple):
+    """
+    Run a backtest of the grid in a worker process. The bars given as paths are read once
+    per process.
+    """
+    bar_type, kwargs = task
+    bars = _DATASETS[bar_type]
+    if isinstance(bars, str):
+        bars = _DATASETS[bar_type] = read_bars(bars)
+    try:
+        return backtest(bars, bar_type=bar_type, **kwargs)
+    except Exception as e:
+        logging.exception(e)
+        return dict(kwargs, bar_type=bar_type, error=repr(e))
+
+
+def run_grid(datasets: dict, symbol: str, window_sizes: list = (22,), TPs: list = (2,),
+             SLs: list = (1,), processes: int = None, **kwargs):
+    """
+    Backtest every combination of bar type, window size, take-profit and stop-loss.
+
+    :param datasets : (dict) the bars (DataFrames or paths of CSV files) by bar type.
+    :param symbol : (str) the asset symbol.
+    :param window_sizes : (list) the lookback windows for the Bollinger Band.
+    :param TPs : (list) the take-profit multiples.
+    :param SLs : (list) the stop-loss multiples.
+    :param processes : (int) the number of worker processes. If None the number of CPUs is
+                       used, with 1 the backtests run in this process.
+    :param kwargs : the qty, commission, slippage and liquidate_minutes of backtest.
+    :return : (pd.DataFrame) the results of every run, with its timing.
+    """
+    tasks = [(bar_type, dict(kwargs, symbol=symbol, window_size=w, TP=tp, SL=sl))
+             for bar_type, w, tp, sl in itertools.product(datasets, window_sizes, TPs, SLs)]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        _init_worker(datasets)
+        results = [_run_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(datasets,)) as pool:
+            chunksize = max(len(tasks) // (4 * processes), 1)
+            results = list(pool.map(_run_task, tasks, chunksize=chunksize))
+    return pd.DataFrame(results)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--bars', nargs='+', required=True,
+                        help='the bar files as <bar_type>=<path>')
+    parser.add_argument('--symbol', required=True)
+    parser.add_argument('--windows', nargs='+', type=int, default=[22])
+    parser.add_argument('--tp', nargs='+', type=float, default=[2])
+    parser.add_argument('--sl', nargs='+', type=float, default=[1])
+    parser.add_argument('--qty', type=int, default=1)
+    parser.add_argument('--commission', type=float, default=0.0)
+    parser.add_argument('--processes', type=int)
+    parser.add_argument('--output', help='the CSV file to save the results to')
+    args = parser.parse_args(argv)
+
+    datasets = dict(item.split('=', 1) for item in args.bars)
+    start = time.perf_counter()
+    results = run_grid(datasets, args.symbol, args.windows, args.tp, args.sl, args.processes,
+                       qty=args.qty, commission=args.commission)
+    print(f'{len(results)} runs in {time.perf_counter() - start:.1f} seconds')
+    if args.output:
+        results.to_csv(args.output, index=False)
+    else:
+        print(results.to_string())
+
+
+if __name__ == '__main__':
+    main()
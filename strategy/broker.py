@@ -0,0 +1,148 @@
+"""
+This script keeps the positions and open orders of the account in a local cache and sends
+the orders from a background thread, so the trade handler never waits on the REST API.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PositionCache:
+    """
+    A local copy of the positions and open orders of the account. It is updated by the events
+    of the trade_updates channel and reconciled with the REST API in the background.
+    """
+
+    def __init__(self, api, interval: float = 60):
+        """
+        :param api : the REST API client.
+        :param interval : (float) the number of seconds between two reconciliations.
+        """
+        self.api = api
+        self.interval = interval
+        self.positions = {}  # [side, qty] by symbol
+        self.orders = {}  # {order id: order} by symbol
+        self._lock = threading.Lock()
+        # the number of events received, to detect the events received during a reconciliation
+        self._events = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def get_position(self, symbol: str):
+        """
+        :param symbol : (str) the asset symbol.
+        :return : (list) the side ('long' or 'short') and the quantity of the position or
+                  False if there is no position.
+        """
+        return self.positions.get(symbol, False)
+
+    def get_open_orders(self, symbol: str):
+        """
+        :param symbol : (str) the asset symbol.
+        :return : (list) the ids of the open orders of the symbol.
+        """
+        return list(self.orders.get(symbol, {}))
+
+    def on_trade_update(self, data):
+        """
+        Update the cache with an event of the trade_updates channel.
+
+        :param data : the trade update with the event, the order and the position quantity after a fill.
+        """
+        order = data.order
+        symbol, order_id = order['symbol'], order['id']
+        with self._lock:
+            self._events += 1
+            if data.event in ('fill', 'partial_fill'):
+                qty = float(data.position_qty)
+                if qty > 0:
+                    self.positions[symbol] = ['long', abs(qty)]
+                elif qty < 0:
+                    self.positions[symbol] = ['short', abs(qty)]
+                else:
+                    self.positions.pop(symbol, None)
+            if data.event in ('new', 'accepted', 'pending_new', 'partial_fill'):
+                self.orders.setdefault(symbol, {})[order_id] = order
+            else:
+                # the order is filled, canceled, expired, rejected...
+                self.orders.get(symbol, {}).pop(order_id, None)
+
+    def reconcile(self):
+        """
+        Replace the cache with the positions and open orders from the REST API. The result is
+        dropped if an event arrived in the meantime, as it may be more recent.
+        """
+        with self._lock:
+            events = self._events
+        positions = {
+            p.symbol: [p.side, abs(float(p.qty))] for p in self.api.list_positions()}
+        orders = {}
+        for o in self.api.list_orders(status='open'):
+            orders.setdefault(o.symbol, {})[o.id] = o._raw
+        with self._lock:
+            if self._events == events:
+                self.positions = positions
+                self.orders = orders
+
+    def start(self):
+        """
+        Reconcile the cache now and then periodically in a background thread.
+        """
+        self.reconcile()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='PositionCache', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the background reconciliation.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logging.exception(e)
+
+
+class OrderExecutor:
+    """
+    Runs the REST API calls that send or cancel orders in a background thread. A single worker
+    keeps the calls in the order they were submitted, e.g. a liquidation before a new order.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        """
+        :param max_workers : (int) the number of threads making the calls.
+        """
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='OrderExecutor')
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Schedule a call without waiting for it. Errors are logged.
+
+        :param func : the function to call.
+        :return : (Future) the future of the call.
+        """
+        future = self._pool.submit(func, *args, **kwargs)
+        future.add_done_callback(self._log_error)
+        return future
+
+    @staticmethod
+    def _log_error(future):
+        error = future.exception()
+        if error is not None:
+            logging.error(error, exc_info=error)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stop the executor once the submitted calls are done.
+        """
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,243 @@
+"""
+This script contains incremental indicators for the strategy that are updated in O(1) per bar.
+"""
+import math
+
+import pandas as pd
+
+
+class RollingBollinger:
+    """
+    Bollinger Bands over a fixed window of closes kept in a ring buffer. The mean and the sum of
+    squared deviations are updated with a sliding-window form of Welford's algorithm and are
+    recomputed from the buffer once per window (or when the window is almost flat) to stop
+    rounding errors from accumulating.
+    The bands are the same as ta.BBANDS(closes, timeperiod=window, matype=0), i.e. a simple
+    moving average and the population standard deviation.
+    """
+
+    def __init__(self, window: int, nbdevup: float = 2, nbdevdn: float = 2):
+        """
+        :param window : (int) the lookback window of the bands.
+        :param nbdevup : (float) the number of standard deviations of the upper band.
+        :param nbdevdn : (float) the number of standard deviations of the lower band.
+        """
+        self.window = window
+        self.nbdevup = nbdevup
+        self.nbdevdn = nbdevdn
+        self._values = [0.0] * window
+        self._pos = 0  # the position of the next value in the ring buffer
+        self._mean = 0.0
+        self._m2 = 0.0  # the sum of squared deviations from the mean
+        self._updates = 0  # the updates since the last recomputation
+        self.count = 0  # the number of values seen
+
+    @property
+    def ready(self):
+        """
+        True once a full window of values has been seen.
+        """
+        return self.count >= self.window
+
+    def last(self):
+        """
+        :return : (float) the most recent value or None if no value was seen.
+        """
+        if self.count == 0:
+            return None
+        return self._values[self._pos - 1]
+
+    def update(self, value: float):
+        """
+        Add a new value, dropping the oldest one once the window is full.
+
+        :param value : (float) the new close.
+        """
+        n = self.window
+        if self.count < n:
+            # the window is filling up
+            self.count += 1
+            delta = value - self._mean
+            self._mean += delta / self.count
+            self._m2 += delta * (value - self._mean)
+        else:
+            self.count += 1
+            old = self._values[self._pos]
+            mean = self._mean + (value - old) / n
+            self._m2 += (value - old) * (value - mean + old - self._mean)
+            self._mean = mean
+        self._values[self._pos] = value
+        self._pos = (self._pos + 1) % n
+        self._updates += 1
+        if self.ready and (self._updates >= n or self._m2 <= 1e-9 * self._mean * self._mean):
+            # a near-zero variance is recomputed too, as its square root magnifies rounding errors
+            self._recompute()
+
+    def _recompute(self):
+        """
+        Recompute the mean and the sum of squared deviations from the buffer.
+        """
+        self._mean = math.fsum(self._values) / self.window
+        self._m2 = math.fsum((v - self._mean) ** 2 for v in self._values)
+        self._updates = 0
+
+    def std(self):
+        """
+        :return : (float) the population standard deviation of the window.
+        """
+        return math.sqrt(max(self._m2, 0.0) / min(self.count, self.window))
+
+    def bands(self):
+        """
+        :return : (tuple) the upper, middle and lower bands or None if the window is not full.
+        """
+        if not self.ready:
+            return None
+        std = self.std()
+        return (self._mean + self.nbdevup * std,
+                self._mean,
+                self._mean - self.nbdevdn * std)
+
+    def get_state(self):
+        """
+        :return : (dict) the state of the bands, to restore them with set_state.
+        """
+        state = dict(vars(self))
+        state['_values'] = list(self._values)
+        return state
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with get_state.
+
+        :param state : (dict) the state of the bands.
+        """
+        if state['window'] != self.window:
+            raise ValueError(f'The state of a window of {state["window"]} cannot be restored '
+                             f'in a window of {self.window}')
+        vars(self).update(state)
+        self._values = list(state['_values'])
+
+
+class HourlyVolatility:
+    """
+    The standard deviation of the bar returns since the start of the current clock hour (or
+    of any other frequency). Only the running moments of the current bucket are kept, so the
+    memory is constant and the value is the same as
+    prices.pct_change()[1:].groupby(pd.Grouper(freq=frequency)).std()[-1].
+    """
+
+    def __init__(self, frequency: str = '1h'):
+        """
+        :param frequency : (str) the frequency of the buckets, e.g. "1h" or "30min".
+        """
+        self.frequency = frequency
+        self._start = None  # the start and the end of the current bucket
+        self._end = None
+        self._last = None  # the previous price
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, price: float, timestamp):
+        """
+        Add the return of a new bar to the bucket of its timestamp.
+
+        :param price : (float) the close of the bar.
+        :param timestamp : the timestamp of the bar.
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if self._start is None or not self._start <= timestamp < self._end:
+            # a new bucket starts
+            self._start = timestamp.floor(self.frequency)
+            self._end = self._start + pd.Timedelta(self.frequency)
+            self._count = 0
+            self._mean = 0.0
+            self._m2 = 0.0
+        if self._last is not None:
+            ret = price / self._last - 1
+            self._count += 1
+            delta = ret - self._mean
+            self._mean += delta / self._count
+            self._m2 += delta * (ret - self._mean)
+        self._last = price
+
+    def value(self):
+        """
+        :return : (float) the sample standard deviation of the returns of the current bucket or
+                  NaN if it has less than two returns.
+        """
+        if self._count < 2:
+            return math.nan
+        return math.sqrt(max(self._m2, 0.0) / (self._count - 1))
+
+    def get_state(self):
+        """
+        :return : (dict) the state of the estimator, to restore it with set_state.
+        """
+        return dict(vars(self))
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with get_state.
+
+        :param state : (dict) the state of the estimator.
+        """
+        vars(self).update(state)
+
+
+class EWMVolatility:
+    """
+    The exponentially weighted standard deviation of the bar returns, the same as
+    returns.ewm(span=span, adjust=False).std(bias=True).
+    """
+
+    def __init__(self, span: int = 50):
+        """
+        :param span : (int) the span of the exponential weights in bars.
+        """
+        self.alpha = 2 / (span + 1)
+        self._last = None  # the previous price
+        self._count = 0
+        self._mean = 0.0
+        self._var = 0.0
+
+    def update(self, price: float, timestamp=None):
+        """
+        Add the return of a new bar.
+
+        :param price : (float) the close of the bar.
+        :param timestamp : the timestamp of the bar, not used.
+        """
+        if self._last is not None:
+            ret = price / self._last - 1
+            if self._count == 0:
+                self._mean = ret
+            else:
+                delta = ret - self._mean
+                self._mean += self.alpha * delta
+                self._var = (1 - self.alpha) * (self._var + self.alpha * delta * delta)
+            self._count += 1
+        self._last = price
+
+    def value(self):
+        """
+        :return : (float) the standard deviation or NaN if there are less than two returns.
+        """
+        if self._count < 2:
+            return math.nan
+        return math.sqrt(self._var)
+
+    def get_state(self):
+        """
+        :return : (dict) the state of the estimator, to restore it with set_state.
+        """
+        return dict(vars(self))
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with get_state.
+
+        :param state : (dict) the state of the estimator.
+        """
+        vars(self).update(state)
@@ -0,0 +1,192 @@
+"""
+This script labels the trades of the strategy with the triple-barrier method for the
+meta-labeling model. The vertical barriers are the side flips of the strategy and the
+touches of the profit-taking and stop-loss barriers are searched with NumPy over all the
+events at once, optionally split in chunks over a pool of processes.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+def get_vertical_barriers(index: pd.DatetimeIndex, sides: pd.Series):
+    """
+    Get the vertical barrier of every bar: the time of the next side flip, i.e. when the
+    position is closed to take a counter position. The bars after the last flip get the last
+    bar as vertical barrier. This is the same as the loop of the meta-labeling notebook.
+
+    :param index : (pd.DatetimeIndex) the timestamps of the bars.
+    :param sides : (pd.Series) the sides (1 or -1) of the signals indexed by timestamp.
+    :return : (pd.Series) the vertical barrier of every bar.
+    """
+    values = sides.to_numpy()
+    # the positions of the signals taking the opposite side of the previous one
+    flips = index.searchsorted(sides.index[1:][values[1:] + values[:-1] == 0])
+    t1 = np.full(len(index), len(index) - 1)
+    # the first flip strictly after every bar
+    nxt = np.searchsorted(flips, np.arange(len(index)), side='right')
+    has_next = nxt < len(flips)
+    t1[has_next] = flips[nxt[has_next]]
+    if len(flips):
+        # the last flip keeps itself as barrier
+        t1[flips[-1]] = flips[-1]
+    return pd.Series(index[t1], index=index)
+
+
+def _first_touches(close: np.ndarray, start: np.ndarray, end: np.ndarray, pt: np.ndarray,
+                   sl: np.ndarray, side: np.ndarray, max_width: int = 256):
+    """
+    Find the first bar touching the profit-taking or stop-loss barrier of every event.
+    The events are scanned together in windows that double in width, so the work is about the
+    number of bars until the touches and the loop only runs a few times.
+
+    :param close : (np.ndarray) the close prices.
+    :param start : (np.ndarray) the position of the bar of every event.
+    :param end : (np.ndarray) the position of the vertical barrier of every event.
+    :param pt : (np.ndarray) the profit-taking return of every event (inf if there is none).
+    :param sl : (np.ndarray) the stop-loss return of every event as a positive number (inf if there is none).
+    :param side : (np.ndarray) the side of every event.
+    :param max_width : (int) the maximum width of the windows.
+    :return : (tuple) the position of the first touch (-1 if there is none) and 1 for a
+              profit-taking or -1 for a stop-loss touch.
+    """
+    n = len(start)
+    touch = np.full(n, -1, dtype=np.int64)
+    barrier = np.zeros(n, dtype=np.int64)
+    entry = close[start]
+    offset = np.zeros(n, dtype=np.int64)
+    pending = np.arange(n)
+    width = 16
+    last = len(close) - 1
+    while len(pending):
+        pos = (start[pending] + offset[pending])[:, None] + np.arange(width)
+        valid = pos <= end[pending, None]
+        ret = (close[np.minimum(pos, last)] / entry[pending, None] - 1) * side[pending, None]
+        hit_pt = (ret > pt[pending, None]) & valid
+        hit = hit_pt | ((ret < -sl[pending, None]) & valid)
+        found = hit.any(axis=1)
+        first = hit.argmax(axis=1)
+        rows = np.flatnonzero(found)
+        touch[pending[rows]] = pos[rows, first[rows]]
+        barrier[pending[rows]] = np.where(hit_pt[rows, first[rows]], 1, -1)
+        # the events without a touch that have bars left before their vertical barrier
+        offset[pending] += width
+        pending = pending[~found & (start[pending] + offset[pending] <= end[pending])]
+        width = min(width * 2, max_width)
+    return touch, barrier
+
+
+def _touch_chunk(args: tuple):
+    return _first_touches(*args)
+
+
+def get_events(close: pd.Series, t_events: pd.DatetimeIndex, pt_sl: list, target: pd.Series,
+               min_ret: float = 0.0, vertical_barrier_times: pd.Series = None,
+               side_prediction: pd.Series = None, processes: int = 1):
+    """
+    Get the triple-barrier events: the time of the first touch of the profit-taking, the
+    stop-loss or the vertical barrier of every event. The arguments are the ones of
+    mlfinlab.labeling.get_events.
+
+    :param close : (pd.Series) the close prices of the bars.
+    :param t_events : (pd.DatetimeIndex) the times of the events, which must be bar timestamps.
+    :param pt_sl : (list) the multiples of the target of the profit-taking and stop-loss
+                   barriers. A zero removes the barrier. Without side_prediction only the first
+                   one is used for both.
+    :param target : (pd.Series) the target returns (e.g. the volatility) indexed by timestamp.
+    :param min_ret : (float) the events with a target lower than this are dropped.
+    :param vertical_barrier_times : (pd.Series) the vertical barrier of the events. If None the
+                                    last bar is used.
+    :param side_prediction : (pd.Series) the side of the events. If None every event is long.
+    :param processes : (int) the number of processes searching the touches. If None the number
+                       of CPUs is used.
+    :return : (pd.DataFrame) the events with the touch time (t1), the target (trgt), the barrier
+              touched (1 profit-taking, -1 stop-loss, 0 vertical) and the side if
+              side_prediction is given.
+    """
+    target = target.reindex(t_events)
+    target = target[target > min_ret]
+    if side_prediction is None:
+        side = np.ones(len(target))
+        pt_sl = [pt_sl[0], pt_sl[0]]
+    else:
+        side = side_prediction.reindex(target.index).to_numpy(dtype=np.float64)
+    prices = close.to_numpy(dtype=np.float64)
+    start = close.index.searchsorted(target.index)
+    if vertical_barrier_times is None:
+        end = np.full(len(start), len(prices) - 1)
+    else:
+        t1 = vertical_barrier_times.reindex(target.index).fillna(close.index[-1])
+        end = close.index.searchsorted(pd.DatetimeIndex(t1))
+        end = np.minimum(end, len(prices) - 1)
+    trgt = target.to_numpy(dtype=np.float64)
+    pt = pt_sl[0] * trgt if pt_sl[0] > 0 else np.full(len(trgt), np.inf)
+    sl = pt_sl[1] * trgt if pt_sl[1] > 0 else np.full(len(trgt), np.inf)
+
+    processes = processes or os.cpu_count() or 1
+    if processes == 1 or len(start) < 2 * processes:
+        touch, barrier = _first_touches(prices, start, end, pt, sl, side)
+    else:
+        # split the events in chunks over the processes
+        chunks = np.array_split(np.arange(len(start)), 4 * processes)
+        args = [(prices, start[c], end[c], pt[c], sl[c], side[c]) for c in chunks]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_touch_chunk, args))
+        touch = np.concatenate([r[0] for r in results])
+        barrier = np.concatenate([r[1] for r in results])
+    # the vertical barrier if no other barrier was touched before
+    exit_at = np.where(touch >= 0, touch, end)
+    events = pd.DataFrame({
+        't1': close.index[exit_at],
+        'trgt': trgt,
+        'barrier': np.where(touch >= 0, barrier, 0)}, index=target.index)
+    if side_prediction is not None:
+        # the side is only given for meta-labeling, as in mlfinlab
+        events['side'] = side
+    return events
+
+
+def get_bins(events: pd.DataFrame, close: pd.Series):
+    """
+    Label the events with the return from the event to the exit (t1) and its sign. With the
+    side, the return is the one of the position and the label is 1 if it is positive and 0
+    otherwise, for meta-labeling. Without it the label is the sign of the return (-1, 0 or 1).
+
+    :param events : (pd.DataFrame) the events from get_events.
+    :param close : (pd.Series) the close prices of the bars.
+    :return : (pd.DataFrame) the return (ret), the target (trgt), the label (bin) and the side
+              if the events have one.
+    """
+    prices = close.to_numpy(dtype=np.float64)
+    entry = prices[close.index.searchsorted(events.index)]
+    exit_ = prices[close.index.searchsorted(pd.DatetimeIndex(events['t1']))]
+    ret = exit_ / entry - 1
+    out = pd.DataFrame({'ret': ret, 'trgt': events['trgt'].to_numpy()}, index=events.index)
+    if 'side' in events:
+        out['ret'] = ret * events['side'].to_numpy()
+        out['bin'] = np.where(out['ret'] > 0, 1, 0)
+        out['side'] = events['side'].to_numpy()
+    else:
+        out['bin'] = np.sign(ret)
+    return out
+
+
+def get_labels(close: pd.Series, sides: pd.Series, pt_sl: list, target: pd.Series,
+               min_ret: float = 0.0, processes: int = 1):
+    """
+    Label the signals of the strategy: the vertical barriers are the side flips and the
+    horizontal barriers are multiples of the target.
+
+    :param close : (pd.Series) the close prices of the bars.
+    :param sides : (pd.Series) the sides (1 or -1) of the signals indexed by timestamp.
+    :param pt_sl : (list) the multiples of the target of the profit-taking and stop-loss barriers.
+    :param target : (pd.Series) the target returns (e.g. the hourly volatility).
+    :param min_ret : (float) the events with a target lower than this are dropped.
+    :param processes : (int) the number of processes searching the touches.
+    :return : (pd.DataFrame) the labels from get_bins.
+    """
+    t1 = get_vertical_barriers(close.index, sides)
+    events = get_events(close, sides.index, pt_sl, target, min_ret, t1, sides, processes)
+    return get_bins(events, close)
@@ -0,0 +1,158 @@
+"""
+This script contains a scheduler for the market sessions. The trading calendar is loaded
+once per day, the session times are answered from the local clock and the callbacks that
+depend on the session (e.g. liquidation before the close) run on the event loop.
+"""
+import logging
+import datetime as dt
+
+import pandas as pd
+
+
+class SessionScheduler:
+    """
+    Answers "is the market open" and "minutes to close" without calling the API and fires
+    callbacks at a given time before the close or at the open of every session.
+    """
+
+    def __init__(self, api, tz: str = 'America/New_York', lookahead_days: int = 10):
+        """
+        :param api : the REST API client used to load the trading calendar.
+        :param tz : (str) the timezone of the exchange.
+        :param lookahead_days : (int) the number of days of calendar loaded at a time.
+        """
+        self.api = api
+        self.tz = tz
+        self.lookahead_days = lookahead_days
+        self.sessions = []  # the (open, close) timestamps of the loaded sessions
+        self._loaded_on = None  # the day the calendar was loaded
+        self._before_close = []  # (minutes, callback)
+        self._at_open = []
+        self._loop = None
+
+    def now(self):
+        """
+        :return : (pd.Timestamp) the current time in the timezone of the exchange.
+        """
+        return pd.Timestamp.now(tz=self.tz)
+
+    def refresh(self, now: pd.Timestamp = None):
+        """
+        Load the trading calendar if it was not loaded today.
+
+        :param now : (pd.Timestamp) the current time.
+        """
+        now = now or self.now()
+        if self._loaded_on == now.date():
+            return
+        start = now.date()
+        end = start + dt.timedelta(days=self.lookahead_days)
+        sessions = []
+        for day in self.api.get_calendar(start=start.isoformat(), end=end.isoformat()):
+            date = pd.Timestamp(day.date).date()
+            sessions.append((
+                pd.Timestamp(f'{date} {day.open}').tz_localize(self.tz),
+                pd.Timestamp(f'{date} {day.close}').tz_localize(self.tz)))
+        self.sessions = sessions
+        self._loaded_on = now.date()
+
+    def session(self, now: pd.Timestamp = None):
+        """
+        :param now : (pd.Timestamp) the current time.
+        :return : (tuple) the open and close of the current session or the next one if the
+                  market is closed.
+        """
+        now = now or self.now()
+        self.refresh(now)
+        for market_open, market_close in self.sessions:
+            if now < market_close:
+                return market_open, market_close
+        raise LookupError(
+            f'No session in the next {self.lookahead_days} days of the calendar')
+
+    def is_open(self, now: pd.Timestamp = None):
+        """
+        :param now : (pd.Timestamp) the current time.
+        :return : (bool) True if the market is open.
+        """
+        now = now or self.now()
+        market_open, market_close = self.session(now)
+        return market_open <= now < market_close
+
+    def minutes_to_close(self, now: pd.Timestamp = None):
+        """
+        :param now : (pd.Timestamp) the current time.
+        :return : (int) the minutes left until the close of the current (or next) session.
+        """
+        now = now or self.now()
+        return round((self.session(now)[1] - now).total_seconds() / 60)
+
+    def seconds_to_open(self, now: pd.Timestamp = None):
+        """
+        :param now : (pd.Timestamp) the current time.
+        :return : (float) the seconds until the next open, 0 if the market is open.
+        """
+        now = now or self.now()
+        return max((self.session(now)[0] - now).total_seconds(), 0.0)
+
+    def before_close(self, minutes: float, callback):
+        """
+        Call a function every session at a number of minutes before the close.
+
+        :param minutes : (float) the minutes before the close.
+        :param callback : a function without arguments.
+        """
+        self._before_close.append((minutes, callback))
+
+    def at_open(self, callback):
+        """
+        Call a function at the open of every session.
+
+        :param callback : a function without arguments.
+        """
+        self._at_open.append(callback)
+
+    def start(self, loop):
+        """
+        Schedule the callbacks of the current (or next) session on an event loop. They are
+        scheduled again for the following session once it closes.
+
+        :param loop : the asyncio event loop running the strategy.
+        """
+        self._loop = loop
+        self._arm()
+
+    def _arm(self):
+        """
+        Schedule the callbacks of the current (or next) session.
+        """
+        now = self.now()
+        try:
+            market_open, market_close = self.session(now)
+        except Exception as e:
+            # retry later if the calendar could not be loaded
+            logging.exception(e)
+            self._loop.call_later(60, self._arm)
+            return
+        for minutes, callback in self._before_close:
+            self._call_at(market_close - pd.Timedelta(minutes=minutes), callback, now)
+        if market_open > now:
+            for callback in self._at_open:
+                self._call_at(market_open, callback, now)
+        # schedule the next session after this one closes
+        self._call_at(market_close + pd.Timedelta(seconds=1), self._arm, now)
+
+    def _call_at(self, when: pd.Timestamp, callback, now: pd.Timestamp):
+        """
+        Schedule a callback at a time if it is in the future.
+        """
+        delay = (when - now).total_seconds()
+        if delay > 0:
+            self._loop.call_later(delay, self._run_callback, callback)
+
+    @staticmethod
+    def _run_callback(callback):
+        try:
+            callback()
+        except Exception as e:
+            logging.exception(e)
@@ -0,0 +1,8 @@
+"""
+The modules of the strategy are imported as top-level modules, as the strategy scripts do.
+The directory is appended so the modules of the root of the repository take precedence.
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
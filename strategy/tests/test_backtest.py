@@ -0,0 +1,109 @@
+"""
+Tests of the simulated broker of the backtest: the realized profit of the fills, the
+commission and the slippage.
+"""
+import os
+import sys
+import subprocess
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def backtest(tmp_path, monkeypatch):
+    """
+    The backtest module, imported from a directory without the configuration of the API (and
+    where the strategy creates its log file).
+    """
+    monkeypatch.chdir(tmp_path)
+    import backtest
+    return backtest
+
+
+def test_import_without_api_configuration(tmp_path):
+    # a fresh interpreter, the strategy must not connect to the API when it is imported
+    strategy = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, '-c', f'import sys; sys.path.insert(0, {strategy!r}); import backtest'],
+        cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+def test_round_trip_profit(backtest):
+    broker = backtest.SimulatedBroker()
+    broker.set_price('AAPL', 100.0)
+    broker.submit_order('AAPL', 10, 'buy')
+    assert broker.get_position('AAPL') == ['long', 10]
+    broker.set_price('AAPL', 110.0)
+    assert broker.equity() == pytest.approx(100.0)
+    broker.close_position('AAPL')
+    assert broker.get_position('AAPL') is False
+    assert broker.realized == pytest.approx(100.0)
+    assert broker.equity() == pytest.approx(100.0)
+
+
+def test_short_profit(backtest):
+    broker = backtest.SimulatedBroker()
+    broker.set_price('AAPL', 100.0)
+    broker.submit_order('AAPL', 5, 'sell')
+    assert broker.get_position('AAPL') == ['short', 5]
+    broker.set_price('AAPL', 90.0)
+    broker.submit_order('AAPL', 5, 'buy')
+    assert broker.realized == pytest.approx(50.0)
+
+
+def test_partial_close_and_reversal(backtest):
+    broker = backtest.SimulatedBroker()
+    broker.set_price('AAPL', 100.0)
+    broker.submit_order('AAPL', 10, 'buy')
+    broker.set_price('AAPL', 120.0)
+    broker.submit_order('AAPL', 10, 'buy')
+    # the average price of the position is 110
+    broker.submit_order('AAPL', 5, 'sell')
+    assert broker.realized == pytest.approx(50.0)
+    # the sell closes the remaining 15 shares and opens a short of 5 at 120
+    broker.submit_order('AAPL', 20, 'sell')
+    assert broker.realized == pytest.approx(200.0)
+    assert broker.get_position('AAPL') == ['short', 5]
+    broker.set_price('AAPL', 100.0)
+    assert broker.equity() == pytest.approx(300.0)
+
+
+def test_commission(backtest):
+    broker = backtest.SimulatedBroker(commission=0.01)
+    broker.set_price('AAPL', 100.0)
+    broker.submit_order('AAPL', 10, 'buy')
+    broker.set_price('AAPL', 110.0)
+    broker.close_position('AAPL')
+    # 20 shares traded
+    assert broker.realized == pytest.approx(100.0 - 0.2)
+
+
+def test_slippage(backtest):
+    broker = backtest.SimulatedBroker(slippage=0.001)
+    broker.set_price('AAPL', 100.0)
+    broker.submit_order('AAPL', 10, 'buy')
+    broker.set_price('AAPL', 110.0)
+    broker.close_position('AAPL')
+    # bought above and sold below the price
+    assert [fill[2] for fill in broker.fills] == pytest.approx([100.1, 109.89])
+    assert broker.realized == pytest.approx(10 * (109.89 - 100.1))
+
+
+def test_fill_without_price(backtest):
+    broker = backtest.SimulatedBroker()
+    with pytest.raises(ValueError):
+        broker.submit_order('AAPL', 1, 'buy')
+
+
+def test_backtest_accounts_every_fill(backtest):
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2020-06-01 09:30', periods=2000, freq='min', tz='America/New_York')
+    index = index[(index.time >= pd.Timestamp('09:30').time()) & (index.time <= pd.Timestamp('16:00').time())]
+    close = 100 + np.cumsum(rng.normal(0, 0.1, len(index)))
+    bars = pd.DataFrame({'close': close, 'high': close + 0.05, 'low': close - 0.05}, index=index)
+    result = backtest.backtest(bars, 'AAPL', 'volume_bar', window_size=15, commission=0.01)
+    assert result['fills'] > 0
+    assert np.isfinite(result['pnl'])
@@ -0,0 +1,92 @@
+"""
+Tests that the incremental indicators give the same values as their pandas (and ta-lib)
+definitions.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import EWMVolatility, HourlyVolatility, RollingBollinger
+
+
+def make_closes(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    return 10000 + np.cumsum(rng.normal(0, 1, n))
+
+
+def rolling_bands(closes, window, nbdev=2):
+    """
+    The bands over every full window, computed from every bar.
+    """
+    bands = RollingBollinger(window, nbdev, nbdev)
+    result = []
+    for close in closes:
+        bands.update(close)
+        result.append(bands.bands() or (np.nan, np.nan, np.nan))
+    return np.array(result)
+
+
+@pytest.mark.parametrize('window', [2, 15, 22])
+def test_rolling_bollinger_matches_pandas(window):
+    closes = make_closes()
+    rolling = pd.Series(closes).rolling(window)
+    mean, std = rolling.mean().to_numpy(), rolling.std(ddof=0).to_numpy()
+    expected = np.column_stack([mean + 2 * std, mean, mean - 2 * std])
+    np.testing.assert_allclose(rolling_bands(closes, window), expected, rtol=1e-10)
+
+
+def test_rolling_bollinger_matches_talib():
+    talib = pytest.importorskip('talib')
+    closes = make_closes()
+    expected = np.column_stack(talib.BBANDS(closes, timeperiod=22, nbdevup=2, nbdevdn=2, matype=0))
+    np.testing.assert_allclose(rolling_bands(closes, 22), expected, rtol=1e-10)
+
+
+def test_rolling_bollinger_flat_window_has_no_width():
+    bands = RollingBollinger(5)
+    for close in [101.5, 99.25, 100.0] + [100.0] * 5:
+        bands.update(close)
+    upper, middle, lower = bands.bands()
+    assert upper == middle == lower == 100.0
+
+
+def test_rolling_bollinger_not_ready_before_a_full_window():
+    bands = RollingBollinger(3)
+    bands.update(1.0)
+    bands.update(2.0)
+    assert not bands.ready and bands.bands() is None
+    bands.update(3.0)
+    assert bands.ready and bands.last() == 3.0
+
+
+def make_prices(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    # irregular bar times, as the alternative bars are
+    times = pd.Timestamp('2020-08-11 09:30', tz='America/New_York') + pd.to_timedelta(
+        np.cumsum(rng.integers(1, 60, n)), unit='s')
+    return pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.001, n))), index=times)
+
+
+@pytest.mark.parametrize('frequency', ['1h', '30min'])
+def test_hourly_volatility_matches_pandas(frequency):
+    prices = make_prices()
+    volatility = HourlyVolatility(frequency)
+    for i, (timestamp, price) in enumerate(prices.items()):
+        volatility.update(price, timestamp)
+        if i >= 1:
+            returns = prices.iloc[:i + 1].pct_change().iloc[1:]
+            expected = returns.groupby(pd.Grouper(freq=frequency)).std().iloc[-1]
+            np.testing.assert_allclose(volatility.value(), expected, rtol=1e-9, equal_nan=True)
+
+
+def test_ewm_volatility_matches_pandas():
+    prices = make_prices()
+    volatility = EWMVolatility(span=50)
+    values = []
+    for timestamp, price in prices.items():
+        volatility.update(price, timestamp)
+        values.append(volatility.value())
+    expected = prices.pct_change().iloc[1:].ewm(span=50, adjust=False).std(bias=True)
+    # the estimator needs two returns
+    assert np.isnan(values[:2]).all()
+    np.testing.assert_allclose(values[2:], expected.to_numpy()[1:], rtol=1e-9)
@@ -0,0 +1,68 @@
+"""
+Tests of the triple-barrier labeling against a loop over the events.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from labeling import get_bins, get_events, get_labels, get_vertical_barriers
+
+
+@pytest.fixture
+def close():
+    rng = np.random.default_rng(0)
+    index = pd.date_range('2020-08-11 09:30', periods=2000, freq='min')
+    return pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.001, len(index)))), index=index)
+
+
+@pytest.fixture
+def sides(close):
+    rng = np.random.default_rng(1)
+    index = close.index[::7]
+    return pd.Series(rng.choice([-1.0, 1.0], len(index)), index=index)
+
+
+def first_touches(close, events, pt, sl):
+    """
+    The exit of every event found by scanning the bars one at a time.
+    """
+    t1 = []
+    for t0, event in events.iterrows():
+        path = close[t0:event['vertical']]
+        ret = (path / close[t0] - 1) * event['side']
+        touched = path.index[(ret > pt * event['trgt']) | (ret < -sl * event['trgt'])]
+        t1.append(touched[0] if len(touched) else path.index[-1])
+    return pd.DatetimeIndex(t1)
+
+
+def test_get_events_matches_a_loop(close, sides):
+    target = pd.Series(0.002, index=close.index)
+    vertical = get_vertical_barriers(close.index, sides)
+    events = get_events(close, sides.index, [1, 2], target, 0.0, vertical, sides)
+    expected = pd.DataFrame({'trgt': 0.002, 'side': sides, 'vertical': vertical.reindex(sides.index)})
+    assert (pd.DatetimeIndex(events['t1']) == first_touches(close, expected, 1, 2)).all()
+
+
+def test_get_events_in_parallel_matches_serial(close, sides):
+    target = close.pct_change().rolling(50).std().bfill()
+    vertical = get_vertical_barriers(close.index, sides)
+    serial = get_events(close, sides.index, [1, 1], target, 0.0, vertical, sides, processes=1)
+    parallel = get_events(close, sides.index, [1, 1], target, 0.0, vertical, sides, processes=2)
+    pd.testing.assert_frame_equal(serial, parallel)
+
+
+def test_get_bins_without_side_labels_the_sign_of_the_return(close, sides):
+    target = pd.Series(0.002, index=close.index)
+    events = get_events(close, sides.index, [1, 1], target)
+    assert 'side' not in events
+    bins = get_bins(events, close)
+    assert set(bins['bin']) == {-1.0, 1.0}
+    assert (bins['bin'] == np.sign(bins['ret'])).all()
+
+
+def test_get_labels_are_meta_labels(close, sides):
+    target = pd.Series(0.002, index=close.index)
+    labels = get_labels(close, sides, [1, 1], target)
+    assert set(labels['bin']) == {0, 1}
+    assert (labels['side'] == sides.reindex(labels.index)).all()
+    assert (labels['bin'] == (labels['ret'] > 0)).all()
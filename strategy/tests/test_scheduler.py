@@ -0,0 +1,138 @@
+"""
+Tests of the session scheduler on a fake clock: the session times answered from the calendar
+and the callbacks fired at the open and before the close.
+"""
+import heapq
+import itertools
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from scheduler import SessionScheduler
+
+TZ = 'America/New_York'
+# the day after Thanksgiving closes early
+EARLY_CLOSE = {'2020-11-27': '13:00'}
+
+
+class CalendarAPI:
+    """
+    A REST API client answering the calendar of the weekdays.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_calendar(self, start, end):
+        self.calls += 1
+        return [SimpleNamespace(date=day.date().isoformat(), open='09:30',
+                                close=EARLY_CLOSE.get(day.date().isoformat(), '16:00'))
+                for day in pd.bdate_range(start, end)]
+
+
+class FakeClock:
+    """
+    An event loop running its callbacks on a clock that only moves when advanced.
+    """
+
+    def __init__(self, now):
+        self.now = pd.Timestamp(now, tz=TZ)
+        self._events = []
+        self._seq = itertools.count()
+
+    def call_later(self, delay, callback, *args):
+        when = self.now + pd.Timedelta(seconds=delay)
+        heapq.heappush(self._events, (when, next(self._seq), callback, args))
+
+    def advance_to(self, when):
+        when = pd.Timestamp(when, tz=TZ)
+        while self._events and self._events[0][0] <= when:
+            self.now, _, callback, args = heapq.heappop(self._events)
+            callback(*args)
+        self.now = when
+
+
+class ClockScheduler(SessionScheduler):
+
+    def __init__(self, clock, **kwargs):
+        super().__init__(CalendarAPI(), **kwargs)
+        self.clock = clock
+
+    def now(self):
+        return self.clock.now
+
+
+def at(time):
+    return pd.Timestamp(time, tz=TZ)
+
+
+def test_session_times():
+    scheduler = ClockScheduler(FakeClock('2020-08-11 15:30'))
+    assert scheduler.is_open()
+    assert scheduler.minutes_to_close() == 30
+    assert scheduler.seconds_to_open() == 0
+    # before the open the current session is the one of the day
+    assert not scheduler.is_open(at('2020-08-11 08:00'))
+    assert scheduler.minutes_to_close(at('2020-08-11 08:00')) == 480
+    assert scheduler.seconds_to_open(at('2020-08-11 09:00')) == 1800
+    # after the close on a Friday the next session is on Monday
+    assert not scheduler.is_open(at('2020-08-14 16:00'))
+    assert scheduler.session(at('2020-08-14 16:00')) == (at('2020-08-17 09:30'), at('2020-08-17 16:00'))
+    assert scheduler.minutes_to_close(at('2020-08-14 16:00')) == 3 * 24 * 60
+    # the early close
+    assert scheduler.minutes_to_close(at('2020-11-27 12:00')) == 60
+
+
+def test_the_calendar_is_loaded_once_a_day():
+    scheduler = ClockScheduler(FakeClock('2020-08-11 09:00'))
+    for minute in range(0, 600, 7):
+        scheduler.minutes_to_close(at('2020-08-11 09:00') + pd.Timedelta(minutes=minute))
+    assert scheduler.api.calls == 1
+    scheduler.is_open(at('2020-08-12 10:00'))
+    assert scheduler.api.calls == 2
+
+
+def test_no_session_in_the_calendar():
+    scheduler = ClockScheduler(FakeClock('2020-08-11 09:00'), lookahead_days=1)
+    with pytest.raises(LookupError):
+        scheduler.session(at('2020-08-14 17:00'))
+
+
+def test_callbacks_fire_at_the_open_and_before_the_close():
+    clock = FakeClock('2020-08-13 08:00')
+    scheduler = ClockScheduler(clock)
+    fired = []
+    scheduler.at_open(lambda: fired.append(('open', scheduler.now())))
+    scheduler.before_close(15, lambda: fired.append(('liquidate', scheduler.now())))
+    scheduler.start(clock)
+    clock.advance_to('2020-08-18 00:00')
+    assert fired == [
+        ('open', at('2020-08-13 09:30')), ('liquidate', at('2020-08-13 15:45')),
+        ('open', at('2020-08-14 09:30')), ('liquidate', at('2020-08-14 15:45')),
+        ('open', at('2020-08-17 09:30')), ('liquidate', at('2020-08-17 15:45'))]
+
+
+def test_callbacks_of_a_session_started_late():
+    # started after the open, only the callbacks still ahead fire
+    clock = FakeClock('2020-11-27 12:50')
+    scheduler = ClockScheduler(clock)
+    fired = []
+    scheduler.at_open(lambda: fired.append(('open', scheduler.now())))
+    scheduler.before_close(15, lambda: fired.append(('liquidate', scheduler.now())))
+    scheduler.start(clock)
+    clock.advance_to('2020-11-30 12:00')
+    assert fired == [('open', at('2020-11-30 09:30'))]
+    clock.advance_to('2020-11-30 17:00')
+    assert fired[-1] == ('liquidate', at('2020-11-30 15:45'))
+
+
+def test_a_failing_callback_does_not_stop_the_others():
+    clock = FakeClock('2020-08-11 08:00')
+    scheduler = ClockScheduler(clock)
+    fired = []
+    scheduler.before_close(30, lambda: 1 / 0)
+    scheduler.before_close(15, lambda: fired.append(scheduler.now()))
+    scheduler.start(clock)
+    clock.advance_to('2020-08-12 17:00')
+    assert fired == [at('2020-08-11 15:45'), at('2020-08-12 15:45')]
@@ -0,0 +1,131 @@
+"""
+Tests of the risk and order management of TrendFollowing on a position cache that lags the
+orders, as the trade updates arrive after the orders are sent.
+"""
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+
+class RecordingAPI:
+    """
+    A REST API client recording the calls sending or canceling orders.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def submit_order(self, symbol, qty, side, type='market', time_in_force='day'):
+        self.calls.append(('submit_order', side))
+
+    def close_position(self, symbol):
+        self.calls.append(('close_position', symbol))
+
+    def cancel_order(self, order_id):
+        self.calls.append(('cancel_order', order_id))
+
+
+class ImmediateExecutor:
+
+    @staticmethod
+    def submit(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+
+class FixedVolatility:
+
+    @staticmethod
+    def update(price, timestamp):
+        pass
+
+    @staticmethod
+    def value():
+        return 0.01
+
+    @staticmethod
+    def get_state():
+        return {}
+
+    @staticmethod
+    def set_state(state):
+        pass
+
+
+class OpenSession:
+
+    @staticmethod
+    def minutes_to_close():
+        return 300
+
+
+class NoHistory:
+
+    @staticmethod
+    def read(bar_type, symbol=None, columns=None, last=None):
+        return pd.DataFrame(columns=columns)
+
+
+def fill(positions, side, position_qty, order_id):
+    """
+    The trade update of a fill with the quantity of the position after it.
+    """
+    positions.on_trade_update(SimpleNamespace(
+        event='fill', position_qty=position_qty,
+        order={'symbol': 'AAPL', 'id': order_id, 'side': side}))
+
+
+@pytest.fixture
+def strategy(tmp_path, monkeypatch):
+    # the strategy creates its log file in the working directory when it is imported
+    monkeypatch.chdir(tmp_path)
+    from broker import PositionCache
+    from trend_following import TrendFollowing
+    api = RecordingAPI()
+    strategy = TrendFollowing(
+        'AAPL', 'volume_bar', TP=2, SL=1, qty=1, window_size=5, store=NoHistory(),
+        positions=PositionCache(api), executor=ImmediateExecutor(), scheduler=OpenSession(),
+        broker=api, volatility=FixedVolatility())
+    strategy.bands.update(100.0)
+    return strategy
+
+
+def test_reversal_is_not_liquidated_by_the_stale_position(strategy):
+    strategy.OMS(SELL=True)
+    fill(strategy.positions, 'sell', -1, '1')
+    assert strategy.positions.get_position('AAPL') == ['short', 1]
+    # the reversal closes the short and buys, the cache still has the short
+    strategy.OMS(BUY=True)
+    assert strategy.side == 'long' and strategy.sl == pytest.approx(99.0)
+    calls = list(strategy.api.calls)
+    # above the SL of the long, it would hit the SL of a short at the price
+    strategy.RMS(100.0)
+    assert strategy.api.calls == calls
+    assert strategy.sl is not None
+    # the fills confirm the long, its SL is checked
+    fill(strategy.positions, 'buy', 0, '2')
+    fill(strategy.positions, 'buy', 1, '3')
+    strategy.RMS(100.0)
+    assert strategy.api.calls == calls
+    strategy.RMS(98.9)
+    assert strategy.api.calls[-1] == ('close_position', 'AAPL')
+    assert strategy.sl is None and strategy.side is None
+
+
+def test_take_profit_and_stop_loss_of_a_short(strategy):
+    strategy.OMS(SELL=True)
+    fill(strategy.positions, 'sell', -1, '1')
+    assert (strategy.tp, strategy.sl) == (pytest.approx(98.0), pytest.approx(101.0))
+    calls = list(strategy.api.calls)
+    strategy.RMS(99.0)
+    assert strategy.api.calls == calls
+    strategy.RMS(97.9)
+    assert strategy.api.calls[-1] == ('close_position', 'AAPL')
+
+
+def test_state_keeps_the_side_of_the_levels(strategy):
+    strategy.OMS(BUY=True)
+    state = strategy.get_state()
+    strategy.liquidate_position()
+    strategy.set_state(state)
+    assert (strategy.side, strategy.sl, strategy.tp) == ('long', state['sl'], state['tp'])
@@ -0,0 +1,142 @@
+"""
+This script computes the bar thresholds of the symbols from their daily volumes. The daily
+volumes are fetched in batches and the results are cached on disk by symbol, lookback and day,
+so a restart on the same day does not need the API.
+"""
+import os
+import json
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+
+class APIVolumeSource:
+    """
+    Fetches the daily volumes from the REST API, many symbols per request.
+    """
+
+    def __init__(self, api, batch_size: int = 200, max_workers: int = 4):
+        """
+        :param api : the REST API client.
+        :param batch_size : (int) the number of symbols per request.
+        :param max_workers : (int) the number of requests made at the same time.
+        """
+        self.api = api
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+    def _fetch(self, symbols: list, lookback: int):
+        df = self.api.get_barset(symbols, '1D', limit=lookback).df
+        return {s: df[s]['volume'].dropna() for s in symbols if s in df}
+
+    def daily_volumes(self, symbols: list, lookback: int):
+        """
+        :param symbols : (list) the asset symbols.
+        :param lookback : (int) the number of days.
+        :return : (dict) the daily volumes (pd.Series) of every symbol.
+        """
+        batches = [symbols[i:i + self.batch_size]
+                   for i in range(0, len(symbols), self.batch_size)]
+        volumes = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for result in pool.map(lambda b: self._fetch(b, lookback), batches):
+                volumes.update(result)
+        return volumes
+
+
+class FileVolumeSource:
+    """
+    Reads the daily volumes from a local CSV file with "date", "symbol" and "volume" columns.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path : (str) the path of the CSV file.
+        """
+        self.path = path
+
+    def daily_volumes(self, symbols: list, lookback: int):
+        df = pd.read_csv(self.path, parse_dates=['date'])
+        df = df[df['symbol'].isin(symbols)].sort_values('date')
+        return {s: g.set_index('date')['volume'][-lookback:] for s, g in df.groupby('symbol')}
+
+
+class ThresholdCache:
+    """
+    A JSON file of the average daily volumes keyed by symbol, lookback and day.
+    """
+
+    def __init__(self, path: str = 'data/thresholds.json'):
+        """
+        :param path : (str) the path of the cache file.
+        """
+        self.path = path
+        try:
+            with open(path) as f:
+                self._values = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._values = {}
+
+    @staticmethod
+    def key(symbol: str, lookback: int, day: dt.date):
+        return f'{symbol}|{lookback}|{day.isoformat()}'
+
+    def get(self, symbol: str, lookback: int, day: dt.date):
+        """
+        :return : (float) the cached average daily volume or None.
+        """
+        return self._values.get(self.key(symbol, lookback, day))
+
+    def update(self, values: dict, lookback: int, day: dt.date):
+        """
+        Add the average daily volumes of some symbols and save the cache, dropping the
+        entries of the previous days.
+
+        :param values : (dict) the average daily volumes by symbol.
+        """
+        suffix = f'|{day.isoformat()}'
+        self._values = {k: v for k, v in self._values.items() if k.endswith(suffix)}
+        for symbol, value in values.items():
+            self._values[self.key(symbol, lookback, day)] = value
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # write to a temporary file first so a crash never leaves a partial cache
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._values, f)
+        os.replace(tmp, self.path)
+
+
+def get_thresholds(symbols: list, bars_per_day: int, lookback: int, source,
+                   cache: ThresholdCache = None, day: dt.date = None):
+    """
+    Compute the dynamic thresholds of many symbols. The threshold is the exponentially
+    weighted average of the daily volumes for a given decay span divided by the number of
+    bars per day. Only the symbols missing from the cache are fetched.
+
+    :param symbols : (list) the asset symbols.
+    :param bars_per_day : (int) number bars to yield per day.
+    :param lookback : (int) lookback window/ span.
+    :param source : the source of the daily volumes (APIVolumeSource or FileVolumeSource).
+    :param cache : (ThresholdCache) the cache of the average daily volumes. If None nothing is cached.
+    :param day : (dt.date) the day of the thresholds. If None it is today.
+    :return : (dict) the thresholds by symbol.
+    """
+    day = day or pd.Timestamp.now(tz='America/New_York').date()
+    averages = {}
+    missing = []
+    for symbol in symbols:
+        value = cache.get(symbol, lookback, day) if cache is not None else None
+        if value is None:
+            missing.append(symbol)
+        else:
+            averages[symbol] = value
+    if missing:
+        fetched = {
+            symbol: float(volume.ewm(span=lookback).mean().iloc[-1])
+            for symbol, volume in source.daily_volumes(missing, lookback).items()
+            if len(volume)}
+        averages.update(fetched)
+        if cache is not None:
+            cache.update(fetched, lookback, day)
+    return {symbol: int(averages[symbol] / bars_per_day) for symbol in symbols}
@@ -10,13 +10,24 @@ when counter positions needed to be taken.
 we increase the position size.
 """
 # Imports
+import os
+import sys
+import asyncio
 import logging
-import talib as ta
-import numpy as np
-import pandas as pd
 from time import sleep
-from bars import EventDrivenBars
+# the modules shared with the root of the repository (e.g. bars, storage and writer) are imported from there
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bars import AdaptiveThreshold, EventDrivenBars
+from broker import PositionCache, OrderExecutor
+from checkpoint import Checkpointer
 from connection import Client
+from indicators import EWMVolatility, HourlyVolatility, RollingBollinger
+from ingest import Ingest
+from metrics import Metrics
+from scheduler import SessionScheduler
+from storage import BarStore, CSVStore, get_store
+from thresholds import APIVolumeSource, ThresholdCache, get_thresholds
+from writer import BarWriter
 
 # logging init
 logging.basicConfig(
@@ -24,10 +35,19 @@ logging.basicConfig(
     level=logging.WARNING,
     format='%(asctime)s:%(levelname)s:%(message)s')
 
-# setup the connection with the API
-client = Client()
-conn = client.connect()
-api = client.api()
+# the REST API client, created at the first use so the strategy can be imported (e.g. by the
+# backtest) without the configuration of the API
+_api = None
+
+
+def get_api():
+    """
+    The REST API client shared by the strategies.
+    """
+    global _api
+    if _api is None:
+        _api = Client().api()
+    return _api
 
 
 class TrendFollowing:
@@ -42,7 +62,13 @@ class TrendFollowing:
             TP: int = 2,
             SL: int = 1,
             qty: int = 1,
-            window_size: int = 22):
+            window_size: int = 22,
+            store: BarStore = None,
+            positions: PositionCache = None,
+            executor: OrderExecutor = None,
+            scheduler: SessionScheduler = None,
+            broker=None,
+            volatility=None):
         """
         :param symbol : (str) the asset symbol for the strategy.
         :param bar_type : (str) the type of the alternative bars.
@@ -50,6 +76,19 @@ class TrendFollowing:
         :param SL : (int) the stop-loss multiple.
         :param qty : (int) the number quantities to buy and sell.
         :param window_size : (int) the lookback window for the Bollinger Band.
+        :param store : (BarStore) the store of the historical bars. If None the bars are read
+                       from data/<bar_type>.csv.
+        :param positions : (PositionCache) the cache of the positions and open orders, updated
+                           from the trade_updates channel. If None a cache of its own is created.
+        :param executor : (OrderExecutor) the executor that sends the orders. If None an
+                          executor of its own is created.
+        :param scheduler : (SessionScheduler) the market session scheduler. If None a scheduler
+                           of its own is created.
+        :param broker : the REST API client that sends the orders, e.g. a simulated broker for
+                        a backtest. If None the Alpaca REST API is used.
+        :param volatility : the volatility estimator sizing the TP and SL, either a
+                            HourlyVolatility or an EWMVolatility. If None the volatility of the
+                            current hour is used.
         """
         # Initialize model parameters like TP, SL, thresholds etc.
         self.TP = TP  # times the current volatility.
@@ -61,10 +100,18 @@ class TrendFollowing:
         self.collection_mode = True
         self.active_trade = False  # to know if any active trade is present
         self.qty = qty  # quantity to trade (buy or sell)
-        self.open_order = None  # to know if any open orders exists
+        self.api = broker if broker is not None else get_api()
+        self.positions = positions if positions is not None else PositionCache(self.api)
+        self.executor = executor if executor is not None else OrderExecutor()
+        self.scheduler = scheduler if scheduler is not None else SessionScheduler(self.api)
         self.sl = None  # stop-loss of current position
         self.tp = None  # take-profit of current position
-        self.prices = pd.Series()
+        self.side = None  # the side of the position of the TP and SL, 'long' or 'short'
+        # the volatility of the returns, updated at every bar
+        self.volatility = volatility if volatility is not None else HourlyVolatility('1h')
+        # the Bollinger Bands over the last window closes
+        self.bands = RollingBollinger(window_size, nbdevup=2, nbdevdn=2)
+        self.store = store if store is not None else get_bar_store('csv')
         # check if historical data exists
         if self.read_data():
             self.collection_mode = False
@@ -75,61 +122,96 @@ class TrendFollowing:
         """
         A function to read the historical bar data.
         """
-        try:
-            df = pd.read_csv(
-                f'data/{self.bar_type}.csv',
-                index_col=[0],
-                parse_dates=[0],
-                usecols=[
-                    'timestamp',
-                    'symbol',
-                    'close'])
-            # the length of minimum data will be the window size +1 of BB
-            if not df.empty:
-                prices = df[df['symbol'] == self.symbol]['close']
-                if len(prices) > self.window:
-                    self.prices = prices[-self.window + 1:]
-                    del df
-                    return True
-
-        except FileNotFoundError as e:
-            pass
+        # only the most recent closes of the symbol are read
+        prices = self.store.read(
+            self.bar_type,
+            self.symbol,
+            columns=['close'],
+            last=self.window + 1)['close']
+        # the length of minimum data will be the window size +1 of BB
+        if len(prices) > self.window:
+            prices = prices[-self.window + 1:]
+            for timestamp, price in prices.items():
+                self.bands.update(price)
+                self.volatility.update(price, timestamp)
+            return True
 
         return False
 
-    def get_volatility(self, frequency: str = '1H'):
+    def get_state(self):
+        """
+        The state of the strategy: the bands, the volatility, the collection mode and the
+        TP and SL of the current position, to resume it after a restart with set_state.
+
+        :return : (dict) the state of the strategy.
+        """
+        return {
+            'collection_mode': self.collection_mode,
+            'sl': self.sl,
+            'tp': self.tp,
+            'side': self.side,
+            'bands': self.bands.get_state(),
+            'volatility': self.volatility.get_state(),
+            'volatility_type': type(self.volatility).__name__}
+
+    def set_state(self, state: dict):
+        """
+        Restore a state saved with get_state.
+
+        :param state : (dict) the state of the strategy.
         """
-        A function to get hourly volatility if enough data exists.
-        Else will output minimum window_size volatility. The volatility
-        will be used to set the TP an SL of a position.
+        self.bands.set_state(state['bands'])
+        if type(self.volatility).__name__ == state['volatility_type']:
+            self.volatility.set_state(state['volatility'])
+        self.collection_mode = state['collection_mode']
+        self.sl = state['sl']
+        self.tp = state['tp']
+        self.side = state['side']
+
+    def get_volatility(self):
         """
-        ret = self.prices.pct_change()[1:]
-        # get hourly volatility
-        vol = ret.groupby(pd.Grouper(freq=frequency)).std()[-1]
-        return vol
+        A function to get the current volatility (hourly by default) from
+        the incremental estimator. The volatility will be used to set the
+        TP an SL of a position.
+        """
+        return self.volatility.value()
 
     def liquidate_position(self):
+        """
+        Cancel the open orders and close the position without waiting for the API.
+        """
         # check for brackets orders are present
         self.cancel_orders()
+        # close the position
+        self.executor.submit(self._close_position)
+        # reset
+        self.active_trade = False
+        self.sl = None
+        self.tp = None
+        self.side = None
+
+    def _close_position(self):
+        """
+        Close the position. It runs on the executor.
+        """
         try:
-            # close the position
-            res = api.close_position(self.symbol)
-            # check if filled
-            status = api.get_order(res.id).status
-            # reset
-            self.active_trade = False
-            self.sl = None
-            self.tp = None
+            self.api.close_position(self.symbol)
         except Exception as e:
             logging.exception(e)
 
     def cancel_orders(self):
         """
-        A function to handle cancelation of a open order.
+        A function to handle cancelation of the open orders.
+        """
+        for order_id in self.positions.get_open_orders(self.symbol):
+            self.executor.submit(self._cancel_order, order_id)
+
+    def _cancel_order(self, order_id: str):
+        """
+        Cancel an order. It runs on the executor.
         """
         try:
-            api.cancel_order(self.open_order.id)
-            self.open_order = None
+            self.api.cancel_order(order_id)
         except Exception as e:
             if e.status_code == 404:
                 # order not found
@@ -145,27 +227,28 @@ class TrendFollowing:
         Get any open position for the symbol
         if exists.
         """
-        try:
-            pos = api.get_position(self.symbol)
-            self.active_trade = [pos.side, pos.qty]
-        except Exception as e:
-            if e.status_code == 404:
-                # position doesn't exist in the asset
-                self.active_trade = False
+        self.active_trade = self.positions.get_position(self.symbol)
 
     def RMS(self, price: float):
         """
         If a position exists than check if take-profit or
         stop-loss is reached. It is a simple risk-management
-        function.
+        function. It only reads the cached position, so the TP and SL
+        are only checked once the cache has the side of the position
+        they were set for: after a reversal the cache still has the
+        previous position until the fills arrive.
 
         :param price :(float) last trade price.
         """
 
         self.check_open_position()
-        if self.active_trade:
-            # check SL  and TP
-            if price <= self.sl or price >= self.tp:
+        if self.active_trade and self.sl is not None and self.active_trade[0] == self.side:
+            # check SL  and TP, they are on the other side of the price for a short position
+            if self.side == 'long':
+                hit = price <= self.sl or price >= self.tp
+            else:
+                hit = price >= self.sl or price <= self.tp
+            if hit:
                 # close the position
                 self.liquidate_position()
 
@@ -184,6 +267,7 @@ class TrendFollowing:
         self.check_open_position()
         # calculate the current volatility
         vol = self.get_volatility()
+        price = self.bands.last()
 
         if BUY:
             # check if counter position exists
@@ -191,8 +275,9 @@ class TrendFollowing:
                 # exit the previous short SELL position
                 self.liquidate_position()
             # calculate TP and SL for BUY order
-            self.tp = self.prices[-1] + (self.prices[-1] * self.TP * vol)
-            self.sl = self.prices[-1] - (self.prices[-1] * self.SL * vol)
+            self.tp = price + (price * self.TP * vol)
+            self.sl = price - (price * self.SL * vol)
+            self.side = 'long'
             side = 'buy'
 
         if SELL:
@@ -201,23 +286,22 @@ class TrendFollowing:
                 # exit the previous long BUY position
                 self.liquidate_position()
             # calculate TP and SL for SELL order
-            self.tp = self.prices[-1] - (self.prices[-1] * self.TP * vol)
-            self.sl = self.prices[-1] + (self.prices[-1] * self.SL * vol)
+            self.tp = price - (price * self.TP * vol)
+            self.sl = price + (price * self.SL * vol)
+            self.side = 'short'
             side = 'sell'
 
         # check for time till market closing.
-        clock = api.get_clock()
-        closing = clock.next_close - clock.timestamp
-        market_closing = round(closing.seconds / 60)
+        market_closing = self.scheduler.minutes_to_close()
 
         if market_closing > 30 and (BUY or SELL):
             # no more new trades after 30 mins till market close.
 
-            if self.open_order is not None:
-                # cancel any open orders before sending a new order
-                self.cancel_orders()
+            # cancel any open orders before sending a new order
+            self.cancel_orders()
             # submit a simple order.
-            self.open_order = api.submit_order(
+            self.executor.submit(
+                self.api.submit_order,
                 symbol=self.symbol,
                 qty=self.qty,
                 side=side,
@@ -231,33 +315,32 @@ class TrendFollowing:
 
         :param bar : (dict) a Alternative bar generated from EventDrivenBars class.
         """
-        if self.collection_mode:
-            self.prices = self.prices.append(pd.Series(
-                [bar['close']], index=[pd.to_datetime(bar['timestamp'])]))
-            if len(self.prices) > self.window:
-                self.collection_mode = False
-
-        if not self.collection_mode:
-            # append the current bar to the prices series
-            self.prices = self.prices.append(pd.Series(
-                [bar['close']], index=[pd.to_datetime(bar['timestamp'])]))
+        close = bar['close']
+        prev_close = self.bands.last()
+        # update the bands and the volatility with the current bar
+        self.bands.update(close)
+        self.volatility.update(close, bar['timestamp'])
+        if self.collection_mode and self.bands.count > self.window:
+            self.collection_mode = False
+
+        if not self.collection_mode and self.bands.ready:
             # get the BB
-            UB, MB, LB = ta.BBANDS(
-                self.prices, timeperiod=self.window, nbdevup=2, nbdevdn=2, matype=0)
+            UB, MB, LB = self.bands.bands()
             # check for entry conditions
-            if self.prices[-2] <= UB[-1] and self.prices[-1] > UB[-1]:
+            if prev_close <= UB and close > UB:
                 # previous price was at or below the Upper BB and current price
                 # is above it.
                 self.OMS(BUY=True)
                 # GOING LONG
-            elif self.prices[-2] >= LB[-1] and self.prices[-1] < LB[-1]:
+            elif prev_close >= LB and close < LB:
                 # previous price was at or above the Upper BB and current price
                 # is below it.
                 self.OMS(SELL=True)
                 # GOING SHORT
 
 
-def get_current_thresholds(symbol: str, bars_per_day: int, lookback: int):
+def get_current_thresholds(symbol: str, bars_per_day: int, lookback: int, source=None,
+                           cache: ThresholdCache = None):
     """
     Compute the dynamic threshold for a given asset symbol.
     The threshold is computed using exponentially weight average
@@ -267,13 +350,53 @@ def get_current_thresholds(symbol: str, bars_per_day: int, lookback: int):
     :param symbol : (str) asset symbol.
     :param lookback : (int) lookback window/ span.
     :param bars_per_day : (int) number bars to yield per day.
+    :param source : the source of the daily volumes. If None the REST API is used.
+    :param cache : (ThresholdCache) the cache of the daily averages. If None nothing is cached.
     """
-    df = api.get_barset(symbol, '1D', limit=lookback).df
-    thres = df[symbol]['volume'].ewm(span=lookback).mean()[-1]
-    return int(thres / bars_per_day)
+    source = source or APIVolumeSource(get_api())
+    return get_thresholds([symbol], bars_per_day, lookback, source, cache)[symbol]
+
 
+def get_bar_store(store: str = 'csv', save_to: str = 'data'):
+    """
+    Create the storage backend for the bars of the strategy.
 
-def get_instances(symbols: dict, bars_per_day: int = 50):
+    :param store : (str) the type of the store. Either "csv" for one file per bar type
+                   (<save_to>/<bar_type>.csv) or "columnar".
+    :param save_to : (str) the directory to save the bars.
+    """
+    if store == 'csv':
+        return CSVStore(save_to, filename='{bar_type}.csv')
+    return get_store(store, save_to)
+
+
+def get_volatility_estimator(volatility: str = 'hourly'):
+    """
+    Get an incremental volatility estimator for the TP and SL.
+
+    :param volatility : (str) either "hourly" for the volatility of the current hour or "ewm"
+                        for an exponentially weighted volatility.
+    :return : the volatility estimator.
+    """
+    if volatility == 'hourly':
+        return HourlyVolatility('1h')
+    if volatility == 'ewm':
+        return EWMVolatility(span=50)
+    raise ValueError(f'{volatility} is not a valid volatility. Please enter either "hourly" or "ewm"')
+
+
+def get_instances(
+        symbols: dict,
+        bars_per_day: int = 50,
+        writer: BarWriter = None,
+        positions: PositionCache = None,
+        executor: OrderExecutor = None,
+        scheduler: SessionScheduler = None,
+        source=None,
+        cache: ThresholdCache = None,
+        adaptive: bool = False,
+        volatility: str = 'hourly',
+        broker=None):
     """
     Generate instances for multiple symbols and configurations for the trend trend following
     strategy.
@@ -281,37 +404,70 @@ def get_instances(symbols: dict, bars_per_day: int = 50):
     :param symbols : (dict) a dictionary with keys as the asset symbols and values as a list of
                     following - [bar_type, quantity, window_size, TP, SL] all in the given order.
     :param bars_per_day : (int) number bars to yield per day.
+    :param writer : (BarWriter) the writer shared by the symbols to save the bars.
+    :param positions : (PositionCache) the cache of the positions shared by the symbols.
+    :param executor : (OrderExecutor) the executor shared by the symbols to send the orders.
+    :param scheduler : (SessionScheduler) the market session scheduler shared by the symbols.
+    :param source : the source of the daily volumes for the thresholds. If None the REST API is
+                    used, e.g. a FileVolumeSource can be given to start without the API.
+    :param cache : (ThresholdCache) the cache of the daily averages. If None the cache in the
+                   data directory is used.
+    :param adaptive : (bool) adapt the thresholds during the session to keep about bars_per_day
+                      bars a day.
+    :param volatility : (str) the volatility sizing the TP and SL. Either "hourly" for the
+                        volatility of the current hour or "ewm" for an exponentially weighted one.
+    :param broker : the REST API client of the strategies. If None the Alpaca REST API is used.
     """
     instances = {}
+    if broker is None:
+        broker = get_api()
+    if writer is None:
+        writer = BarWriter(get_bar_store())
+    if positions is None:
+        positions = PositionCache(broker)
+    if executor is None:
+        executor = OrderExecutor()
+    if scheduler is None:
+        scheduler = SessionScheduler(broker)
     # directory to save the bars
     save_to = 'data'
+    # thresholds are generated as last 5 days exponential weighted avg. / 50.
+    # they are fetched for all the symbols at once and cached for the day
+    thresholds = get_thresholds(
+        list(symbols), bars_per_day, 5, source or APIVolumeSource(broker),
+        cache or ThresholdCache(f'{save_to}/thresholds.json'))
     for symbol in symbols.keys():
         # create a seperate instance for each symbols
-        # thresholds are generated as last 5 days exponential weighted avg. / 50.
-        # why 50 ?? to  yield approx. 50 bars a day.
+        # why 50 bars per day ?? to  yield approx. 50 bars a day.
         bar_type = symbols[symbol][0]
         qty = symbols[symbol][1]
         TP = symbols[symbol][3]
         SL = symbols[symbol][4]
         window = symbols[symbol][2]
+        threshold = thresholds[symbol]
+        adaptive_threshold = AdaptiveThreshold(threshold, bars_per_day) if adaptive else None
         # create objects of both the classes
         instances[symbol] = [
             EventDrivenBars(
-                bar_type, get_current_thresholds(
-                    symbol, bars_per_day, lookback=5), save_to), TrendFollowing(
-                symbol, bar_type, TP, SL, qty, window)]
+                bar_type, threshold, f'{save_to}/{bar_type}.csv', writer, adaptive_threshold), TrendFollowing(
+                symbol, bar_type, TP, SL, qty, window, writer.store, positions, executor, scheduler,
+                volatility=get_volatility_estimator(volatility), broker=broker)]
 
     return instances
 
 
-def close_all():
+def close_all(broker=None):
     """
     A funtion to close all existing orders and
     positions for a account.
+
+    :param broker : the REST API client. If None the Alpaca REST API is used.
     """
+    if broker is None:
+        broker = get_api()
 
     try:
-        api.cancel_all_orders()
+        broker.cancel_all_orders()
     except Exception as e:
         if e.status_code == 404:
             # no orders found
@@ -319,7 +475,7 @@ def close_all():
             pass
 
     try:
-        api.close_all_positions()
+        broker.close_all_positions()
     except Exception as e:
         if e.status_code == 500:
             # failed to liquidate
@@ -328,58 +484,161 @@ def close_all():
             pass
 
 
-def run(assets: dict, bars_per_day: int = 50):
+def restore_instances(instances: dict, states: dict):
+    """
+    Restore the bars and the strategies of a checkpoint in the instances of the same symbols.
+
+    :param instances : (dict) the instances returned by get_instances.
+    :param states : (dict) the states by symbol, e.g. from Checkpointer.load. If None nothing
+                    is restored.
+    :return : (list) the symbols restored.
+    """
+    restored = []
+    for symbol, state in (states or {}).items():
+        if symbol in instances:
+            try:
+                instances[symbol][0].set_state(state['bars'])
+                instances[symbol][1].set_state(state['strategy'])
+                restored.append(symbol)
+            except (ValueError, KeyError) as e:
+                # e.g. the bar type or the window of the symbol changed, it starts over
+                logging.warning(f'The state of {symbol} was not restored: {e!r}')
+    return restored
+
+
+def handle_trade(instances: dict, data, metrics: Metrics = None):
+    """
+    Aggregate a trade into the bars of its symbol and run the strategy on it. This is the
+    body of the trade handler, so recorded trades can be replayed through the same path.
+
+    :param instances : (dict) the instances returned by get_instances.
+    :param data : A data object containing the ticks of a single timestamp or tick.
+    :param metrics : (Metrics) the metrics to record the trade and its bar in, if any.
+    """
+    if data.symbol in instances and data.price > 0 and data.size > 0:
+        bar = instances[data.symbol][0].aggregate_bar(data)
+        if metrics is not None:
+            metrics.record(data.symbol, data.timestamp, bar)
+        instances[data.symbol][1].RMS(data.price)  # check TP & SL
+        if bar:
+            instances[data.symbol][1].on_bar(bar)
+
+
+def run(assets: dict, bars_per_day: int = 50, store: str = 'csv', metrics: Metrics = None,
+        queue_size: int = None, overflow: str = 'block', checkpoint: str = None,
+        checkpoint_interval: float = 5.0):
     """
     The main function that run the strategy.
 
     :param assets : (dict) a dictionary with keys as the asset symbols and values as a list of
                     following - [bar_type, quantity, window_size, TP, SL] all in the given order.
     :param bars_per_day : (int) number bars to yield per day.
+    :param store : (str) the storage backend for the bars. Either "csv" or "columnar".
+    :param metrics : (Metrics) if given the ticks, the bars, their latency, the event loop lag,
+                     the writer queue depth and the latency of the REST calls are recorded in it,
+                     e.g. served with metrics.serve().
+    :param queue_size : (int) if given the trade handler only queues the trades in a bounded
+                        queue per symbol of this size, and the bars and the strategy run from the
+                        queues between the socket reads. If None they run in the handler.
+    :param overflow : (str) the policy when a queue is full. Either "block", "drop_oldest" or
+                      "coalesce" (merge the trades with the same timestamp).
+    :param checkpoint : (str) if given the path of a checkpoint file of the bars being formed and
+                        of the strategies. It is written every checkpoint_interval seconds and when
+                        the stream stops, and the instances are resumed from it at the start.
+    :param checkpoint_interval : (float) the seconds between the checkpoints.
     """
-    # a variable that signifies if the strategy is running or not
-    STRATEGY_ON = True
-    clock = api.get_clock()
-    if clock.is_open:
-        pass
-    else:
-        time_to_open = clock.next_open - clock.timestamp
+    # the REST calls are timed if the metrics are recorded
+    broker = metrics.instrument(get_api()) if metrics is not None else get_api()
+    # the market sessions are answered from a calendar loaded once a day
+    scheduler = SessionScheduler(broker)
+    if not scheduler.is_open():
+        time_to_open = scheduler.seconds_to_open()
         print(
-            f"Market is closed now going to sleep for {time_to_open.total_seconds()//60} minutes")
-        sleep(time_to_open.total_seconds())
+            f"Market is closed now going to sleep for {time_to_open//60} minutes")
+        sleep(time_to_open)
+
+    # setup the connection with the API
+    conn = Client().connect()
 
     # close any open positions or orders
-    close_all()
+    close_all(broker)
 
     channels = ['trade_updates'] + ['T.' + sym.upper()
                                     for sym in assets.keys()]
 
+    # the bars of all the symbols are saved by a shared writer
+    writer = BarWriter(get_bar_store(store))
+    if metrics is not None:
+        metrics.gauge('writer_queue_depth', writer.qsize)
+        metrics.gauge('writer_failed_rows_total', lambda: writer.failed)
+    # the positions are cached from the trade updates and the orders sent in the background
+    positions = PositionCache(broker)
+    positions.start()
+    executor = OrderExecutor()
     # generate instances
-    instances = get_instances(assets, bars_per_day)
+    instances = get_instances(
+        assets, bars_per_day, writer, positions, executor, scheduler, broker=broker)
+    checkpointer = None
+    if checkpoint is not None:
+        checkpointer = Checkpointer(checkpoint, checkpoint_interval)
+        restore_instances(instances, checkpointer.load())
+
+    def collect():
+        return {symbol: {'bars': bars.get_state(), 'strategy': strategy.get_state()}
+                for symbol, (bars, strategy) in instances.items()}
+
+    def liquidate():
+        # liquidate all positions at 10 mins to market close.
+        executor.submit(close_all, broker)
+
+    def rebuild():
+        # reseting the thresholds and created new instances at the next open
+        # without blocking the trade handler while they are computed
+        future = loop.run_in_executor(
+            None, lambda: get_instances(
+                assets, bars_per_day, writer, positions, executor, scheduler, broker=broker))
+        future.add_done_callback(swap_instances)
+
+    def swap_instances(future):
+        nonlocal instances
+        if future.exception() is not None:
+            logging.exception(future.exception())
+        else:
+            instances = future.result()
+
+    scheduler.before_close(10, liquidate)
+    scheduler.at_open(rebuild)
+    loop = getattr(conn, 'loop', None) or asyncio.get_event_loop()
+    scheduler.start(loop)
+    if checkpointer is not None:
+        checkpointer.start(collect, loop)
+    if metrics is not None:
+        metrics.watch_loop(loop)
+
+    @conn.on(r'trade_updates$')
+    async def on_trade_update(conn, channel, data):
+        positions.on_trade_update(data)
+
+    ingest = None
+    if queue_size is not None:
+        # the instances are looked up at every trade as they are rebuilt at the open
+        ingest = Ingest(lambda data: handle_trade(instances, data, metrics), queue_size, overflow)
+        if metrics is not None:
+            for name, func in ingest.gauges().items():
+                metrics.gauge(name, func)
 
     @conn.on(r'T$')
     async def on_trade(conn, channel, data):
-        if data.symbol in instances and data.price > 0 and data.size > 0:
-            bar = instances[data.symbol][0].aggregate_bar(data)
-            instances[data.symbol][1].RMS(data.price)  # check TP & SL
-            if bar:
-                instances[data.symbol][1].on_bar(bar)
-
-    conn.run(channels)
-
-    while True:
-        clock = api.get_clock()
-        closing = clock.next_close - clock.timestamp
-        market_closing = round(closing.seconds / 60)
-
-        if market_closing < 10 and STRATEGY_ON:
-            # liquidate all positions at 10 mins to market close.
-            close_all()
-            STRATEGY_ON = False
-
-        if not clock.is_open:
-            # keep collecting bars till the end of the market hours
-            next_market_open = clock.next_open - clock.timestamp
-            sleep(next_market_open.total_seconds())
-            # reseting the thresholds and created new instances
-            instances = get_instances(assets)
-            STRATEGY_ON = True
+        if ingest is not None:
+            await ingest.submit(data)
+        else:
+            handle_trade(instances, data, metrics)
+
+    try:
+        conn.run(channels)
+    finally:
+        if ingest is not None:
+            # run the trades still queued
+            ingest.close()
+        if checkpointer is not None:
+            checkpointer.close(collect())
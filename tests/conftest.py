@@ -0,0 +1,7 @@
+"""
+The modules of the root of the repository are imported as top-level modules, as the scripts do.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
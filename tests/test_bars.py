@@ -0,0 +1,229 @@
+"""
+Tests that the offline and batched bar builders produce the same bars as the realtime
+aggregation of one trade at a time.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bars import AdaptiveThreshold, BarOutput, BarState, EventDrivenBars, MultiBars, build_bars
+from replay import Trade
+from storage import HEADER
+
+NUMERIC = HEADER[2:]
+
+
+class ListWriter:
+    """
+    A writer keeping the bars in memory.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, bar_type, row):
+        self.rows.append(row)
+
+
+def make_trades(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    price = np.round(100 + np.cumsum(rng.normal(0, 0.02, n)), 2)
+    size = rng.integers(1, 500, n).astype(float)
+    timestamp = pd.date_range('2020-08-11 09:30', periods=n, freq='100ms', tz='America/New_York')
+    return price, size, timestamp
+
+
+def stream_bars(bar_type, threshold, price, size, timestamp):
+    """
+    The bars of the trades pushed one at a time through EventDrivenBars.aggregate_bar.
+    """
+    writer = ListWriter()
+    bars = EventDrivenBars(bar_type, threshold, None, writer)
+    for p, q, t in zip(price, size, timestamp):
+        bars.aggregate_bar(Trade('AAPL', p, q, t))
+    return pd.DataFrame(writer.rows, columns=HEADER)
+
+
+def assert_same_bars(expected, result):
+    assert len(result) == len(expected) > 0
+    assert [str(t) for t in result['timestamp']] == list(expected['timestamp'])
+    np.testing.assert_allclose(result[NUMERIC].to_numpy(dtype=float),
+                               expected[NUMERIC].to_numpy(dtype=float), rtol=1e-9)
+
+
+@pytest.mark.parametrize('bar_type, threshold', [
+    ('tick_bar', 100),
+    ('volume_bar', 20000),
+    ('dollar_bar', 2000000),
+    ('tick_imbalance_bar', 50),
+    ('volume_run_bar', 50)])
+def test_build_bars_matches_aggregate_bar(bar_type, threshold):
+    price, size, timestamp = make_trades()
+    expected = stream_bars(bar_type, threshold, price, size, timestamp)
+    result = build_bars(bar_type, threshold, price, size, timestamp, 'AAPL')
+    assert_same_bars(expected, result)
+
+
+def test_build_bars_leaves_out_the_incomplete_bar():
+    price, size, timestamp = make_trades(250)
+    bars = build_bars('tick_bar', 100, price, size, timestamp, 'AAPL')
+    assert list(bars['cum_tick']) == [100, 100]
+
+
+def test_bar_state_matches_the_trades_of_the_bar():
+    price, size, _ = make_trades(300)
+    buy = np.diff(price, prepend=price[0]) > 0
+    state = BarState()
+    for p, q, b in zip(price, size, buy):
+        state.update(p, q, b)
+    assert (state.open, state.high, state.low, state.close) == (
+        price[0], price.max(), price.min(), price[-1])
+    assert state.cum_count() == pytest.approx({
+        'cum_tick': len(price),
+        'cum_volume': size.sum(),
+        'cum_dollar_value': (price * size).sum(),
+        'cum_buy_tick': buy.sum(),
+        'cum_buy_volume': size[buy].sum(),
+        'cum_buy_dollar_value': (price * size)[buy].sum()})
+
+
+def test_event_driven_bars_start_every_bar_from_a_reset_state():
+    price, size, timestamp = make_trades()
+    writer = ListWriter()
+    bars = EventDrivenBars('volume_bar', 20000, None, writer)
+    for p, q, t in zip(price, size, timestamp):
+        bars.aggregate_bar(Trade('AAPL', p, q, t))
+    rows = pd.DataFrame(writer.rows, columns=HEADER)
+    # every trade is in exactly one bar, the last ones in the bar being formed
+    assert rows['cum_tick'].sum() + bars.cum_count['cum_tick'] == len(price)
+    assert rows['cum_volume'].sum() + bars.cum_count['cum_volume'] == pytest.approx(size.sum())
+    assert (rows['cum_volume'] >= 20000).all()
+    assert (rows['cum_volume'] - 20000 < 500).all()
+
+
+def test_tick_imbalance_bars_do_not_collapse_on_a_random_walk():
+    rng = np.random.default_rng(1)
+    price = 100 + np.round(np.cumsum(rng.choice([-0.01, 0.01], 20000)), 2)
+    size = np.ones(len(price))
+    bars = build_bars('tick_imbalance_bar', 50, price, size)
+    # the threshold is at least the imbalance of min_ticks (5) ticks on one side
+    assert bars['cum_tick'].min() >= 5
+
+
+@pytest.mark.parametrize('bar_type', ['tick_run_bar', 'volume_run_bar', 'dollar_run_bar'])
+def test_run_bars_do_not_collapse(bar_type):
+    price, size, _ = make_trades(50000, seed=1)
+    ticks = build_bars(bar_type, 50, price, size)['cum_tick']
+    # the bars keep about the expected number of ticks, at the start and at the end
+    quarter = len(ticks) // 4
+    assert 35 <= ticks[:quarter].mean() <= 65
+    assert 35 <= ticks[-quarter:].mean() <= 65
+
+
+@pytest.mark.parametrize('bar_type, threshold', [
+    ('tick_bar', 100),
+    ('volume_bar', 20000),
+    ('dollar_bar', 2000000),
+    ('tick_imbalance_bar', 50)])
+def test_aggregate_batch_matches_aggregate_bar(bar_type, threshold):
+    price, size, timestamp = make_trades()
+    expected = stream_bars(bar_type, threshold, price, size, timestamp)
+    writer = ListWriter()
+    bars = EventDrivenBars(bar_type, threshold, None, writer)
+    # batches of random lengths, so bars span several batches and batches close several bars
+    cuts = np.cumsum(np.random.default_rng(2).integers(1, 400, len(price)))
+    cuts = np.concatenate(([0], cuts[cuts < len(price)], [len(price)]))
+    for lo, hi in zip(cuts[:-1], cuts[1:]):
+        bars.aggregate_batch(price[lo:hi], size[lo:hi], timestamp[lo:hi], 'AAPL')
+    assert_same_bars(expected, pd.DataFrame(writer.rows, columns=HEADER))
+
+
+def test_aggregate_batch_split_cuts_a_block_trade_into_full_bars():
+    writer = ListWriter()
+    bars = EventDrivenBars('volume_bar', 1000, None, writer)
+    timestamp = pd.date_range('2020-08-11 09:30', periods=3, freq='s', tz='America/New_York')
+    bars.aggregate_batch([100.0, 100.5, 101.0], [400, 5000, 100], timestamp, 'AAPL', split=True)
+    rows = pd.DataFrame(writer.rows, columns=HEADER)
+    assert list(rows['cum_volume']) == [1000] * 5
+    assert bars.cum_count['cum_volume'] == 500
+
+
+class NamedListWriter:
+    """
+    A writer keeping the bars of every output in memory.
+    """
+
+    def __init__(self):
+        self.rows = {}
+
+    def write(self, name, row):
+        self.rows.setdefault(name, []).append(row)
+
+
+def test_multi_bars_match_separate_bars():
+    price, size, timestamp = make_trades()
+    outputs = {
+        'tick_bar': ('tick_bar', 100),
+        'volume_bar': ('volume_bar', 20000),
+        'volume_bar_small': ('volume_bar', 7000),
+        'dollar_bar': ('dollar_bar', 2000000),
+        'tick_imbalance_bar': ('tick_imbalance_bar', 50),
+        'volume_run_bar': ('volume_run_bar', 50)}
+    writer = NamedListWriter()
+    multi = MultiBars('AAPL', [BarOutput(name, bar_type, threshold, writer)
+                               for name, (bar_type, threshold) in outputs.items()])
+    closed = []
+    for p, q, t in zip(price, size, timestamp):
+        closed.extend(name for name, _ in multi.aggregate_bar(Trade('AAPL', p, q, t)))
+    assert len(closed) == sum(len(rows) for rows in writer.rows.values())
+    for name, (bar_type, threshold) in outputs.items():
+        expected = stream_bars(bar_type, threshold, price, size, timestamp)
+        # the cumulative metrics are differences of running totals, equal up to rounding
+        assert_same_bars(expected, pd.DataFrame(writer.rows[name], columns=HEADER))
+
+
+def adapt(adaptive, flow, bars, start='2020-08-11 09:30'):
+    """
+    Close bars of the threshold at a steady flow of the metric per second.
+    :return :(list) the thresholds after every bar.
+    """
+    now = pd.Timestamp(start, tz='UTC')
+    thresholds = []
+    for _ in range(bars):
+        metric = adaptive.threshold
+        now += pd.Timedelta(seconds=metric / flow)
+        thresholds.append(adaptive.update(metric, now))
+    return thresholds
+
+
+@pytest.mark.parametrize('initial', [10000, 140400])
+def test_adaptive_threshold_converges_to_the_target_rate(initial):
+    # 100 shares a second over 23400 / 50 = 468 seconds a bar
+    thresholds = adapt(AdaptiveThreshold(initial, 50), 100, 300)
+    assert thresholds[-1] == pytest.approx(46800, rel=1e-3)
+
+
+def test_adaptive_threshold_adjusts_slowly_to_a_slow_flow():
+    # the bars last 8 times the target, their duration is capped at 4 times
+    fast = adapt(AdaptiveThreshold(46800 / 8, 50), 100, 50)
+    slow = adapt(AdaptiveThreshold(46800 * 8, 50), 100, 50)
+    assert abs(fast[-1] / 46800 - 1) < 0.25
+    assert slow[-1] / 46800 > 1.4
+
+
+def test_adaptive_threshold_caps_the_duration_of_a_bar():
+    adaptive = AdaptiveThreshold(46800, 50)
+    adaptive.update(46800, pd.Timestamp('2020-08-11 15:59', tz='America/New_York'))
+    # a bar over the night counts as 4 bar durations
+    adaptive.update(46800, pd.Timestamp('2020-08-12 09:35', tz='America/New_York'))
+    assert adaptive.ewm_duration == pytest.approx(468 + adaptive.alpha * 3 * 468)
+    assert adaptive.threshold == pytest.approx(46800 * 468 / adaptive.ewm_duration)
+
+
+def test_adaptive_threshold_state():
+    adaptive = AdaptiveThreshold(10000, 50)
+    adapt(adaptive, 100, 30)
+    restored = AdaptiveThreshold(20000, 10)
+    restored.set_state(adaptive.get_state())
+    assert restored.get_state() == adaptive.get_state()
+    assert adapt(restored, 70, 20, '2020-08-12 09:30') == adapt(adaptive, 70, 20, '2020-08-12 09:30')
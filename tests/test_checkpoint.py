@@ -0,0 +1,89 @@
+"""
+Tests that bars resumed from a checkpoint are the same as the bars of an uninterrupted run.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bars import AdaptiveThreshold, EventDrivenBars, get_bars
+from checkpoint import Checkpointer
+from replay import ReplayConn, Trade
+from storage import HEADER
+
+
+class ListWriter:
+    """
+    A writer keeping the bars in memory.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def write(self, bar_type, row):
+        self.rows.append(row)
+
+
+def make_trades(n=6000, seed=0):
+    rng = np.random.default_rng(seed)
+    price = np.round(100 + np.cumsum(rng.normal(0, 0.02, n)), 2)
+    size = rng.integers(1, 500, n).astype(float)
+    timestamp = pd.date_range('2020-08-11 09:30', periods=n, freq='3s', tz='America/New_York')
+    return [Trade('AAPL', p, q, t) for p, q, t in zip(price.tolist(), size.tolist(), timestamp)]
+
+
+def make_bars(bar_type, threshold, adaptive):
+    writer = ListWriter()
+    adaptive = AdaptiveThreshold(threshold, 100) if adaptive else None
+    return EventDrivenBars(bar_type, threshold, None, writer, adaptive), writer
+
+
+@pytest.mark.parametrize('bar_type, threshold, adaptive', [
+    ('volume_bar', 20000, False),
+    ('volume_bar', 20000, True),
+    ('dollar_imbalance_bar', 50, False),
+    ('tick_run_bar', 50, False)])
+def test_restored_bars_match_an_uninterrupted_run(tmp_path, bar_type, threshold, adaptive):
+    trades = make_trades()
+    expected, expected_writer = make_bars(bar_type, threshold, adaptive)
+    for trade in trades:
+        expected.aggregate_bar(trade)
+    # stop in the middle of a bar, well after the first one
+    cut = 4321
+    first, first_writer = make_bars(bar_type, threshold, adaptive)
+    for trade in trades[:cut]:
+        first.aggregate_bar(trade)
+    assert first.state.cum_tick > 0
+    checkpointer = Checkpointer(str(tmp_path / 'checkpoint.pkl'))
+    checkpointer.close({'AAPL': first.get_state()})
+    resumed, resumed_writer = make_bars(bar_type, threshold, adaptive)
+    resumed.set_state(Checkpointer(checkpointer.path).load()['AAPL'])
+    for trade in trades[cut:]:
+        resumed.aggregate_bar(trade)
+    assert len(expected_writer.rows) > len(first_writer.rows) > 1
+    assert first_writer.rows + resumed_writer.rows == expected_writer.rows
+    assert resumed.get_state() == expected.get_state()
+    if adaptive:
+        # the adapted threshold was restored, not the configured one
+        assert resumed.threshold != threshold
+
+
+def test_state_of_another_bar_type_is_rejected():
+    bars, _ = make_bars('volume_bar', 20000, False)
+    other, _ = make_bars('tick_bar', 100, False)
+    with pytest.raises(ValueError):
+        other.set_state(bars.get_state())
+
+
+def test_get_bars_resumes_from_its_checkpoint(tmp_path):
+    trades = make_trades()
+    checkpoint = str(tmp_path / 'checkpoint.pkl')
+    for lo, hi in [(0, 4321), (4321, len(trades))]:
+        get_bars('volume_imbalance_bar', 'AAPL', 50, str(tmp_path / 'resumed'),
+                 conn=ReplayConn(trades=trades[lo:hi]), checkpoint=checkpoint, bars_per_day=100)
+    get_bars('volume_imbalance_bar', 'AAPL', 50, str(tmp_path / 'uninterrupted'),
+             conn=ReplayConn(trades=trades), bars_per_day=100)
+    resumed = pd.read_csv(tmp_path / 'resumed' / 'volume_imbalance_bar' / 'realtime.csv')
+    expected = pd.read_csv(tmp_path / 'uninterrupted' / 'volume_imbalance_bar' / 'realtime.csv')
+    assert list(resumed.columns) == HEADER
+    assert len(expected) > 1
+    pd.testing.assert_frame_equal(resumed, expected)
@@ -0,0 +1,107 @@
+"""
+Tests of the binary cache of the bar datasets: the loads served from the cache and its rebuild
+when the CSV changes.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import datasets
+from datasets import load_bars
+
+
+@pytest.fixture
+def csv(tmp_path):
+    rng = np.random.default_rng(0)
+    # two days of 5 minute bars, with the bars before and after the session
+    index = pd.date_range('2018-01-02 12:00', '2018-01-03 23:55', freq='5min', tz='UTC')
+    close = np.round(170 + np.cumsum(rng.normal(0, 0.1, len(index))), 3)
+    df = pd.DataFrame({'open': close, 'high': close + 0.1, 'low': close - 0.1, 'close': close,
+                       'volume': rng.integers(1000, 100000, len(index))}, index=index)
+    path = tmp_path / 'AAPL_5minute_bars.csv'
+    df.to_csv(path)
+    return path
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """
+    Count the CSV reads of load_bars.
+    """
+    calls = []
+    read_csv = pd.read_csv
+
+    def counting_read_csv(*args, **kwargs):
+        calls.append(args[0])
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(datasets.pd, 'read_csv', counting_read_csv)
+    return calls
+
+
+def test_the_second_load_is_served_from_the_cache(csv, reads):
+    first = load_bars(str(csv))
+    second = load_bars(str(csv))
+    assert len(reads) == 1
+    assert os.path.exists(csv.parent / '.cache' / csv.name / 'meta.json')
+    pd.testing.assert_frame_equal(first, second)
+    # the same bars as the CSV parsed without the cache
+    pd.testing.assert_frame_equal(second, load_bars(str(csv), cache=False),
+                                  check_freq=False, check_index_type=False)
+    assert str(second.index.tz) == 'US/Eastern'
+    time = second.index.time
+    assert time.min() == pd.Timestamp('09:30').time() and time.max() == pd.Timestamp('16:00').time()
+
+
+def test_the_columns_are_read_from_the_cache(csv, reads):
+    load_bars(str(csv))
+    close = load_bars(str(csv), columns=['close'])
+    assert len(reads) == 1
+    pd.testing.assert_frame_equal(close, load_bars(str(csv), cache=False)[['close']],
+                                  check_freq=False, check_index_type=False)
+
+
+def test_the_cache_is_rebuilt_when_the_size_changes(csv, reads):
+    first = load_bars(str(csv), trim=False)
+    with open(csv, 'a') as f:
+        f.write('2018-01-04 00:00:00+00:00,1.0,1.0,1.0,1.0,1\n')
+    second = load_bars(str(csv), trim=False)
+    assert len(reads) == 2
+    assert len(second) == len(first) + 1
+    assert second['close'].iloc[-1] == 1.0
+
+
+def test_the_cache_is_rebuilt_when_the_mtime_changes(csv, reads):
+    first = load_bars(str(csv))
+    # the same size, another volume
+    text = csv.read_text()
+    row = f'{first.index[0].tz_convert("UTC")},'
+    start = text.index(row)
+    end = text.index('\n', start)
+    fields = text[start:end].split(',')
+    fields[-1] = str(int(fields[-1]) + 1).rjust(len(fields[-1]), '0')
+    stat = os.stat(csv)
+    csv.write_text(text[:start] + ','.join(fields) + text[end:])
+    os.utime(csv, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert os.stat(csv).st_size == stat.st_size
+    second = load_bars(str(csv))
+    assert len(reads) == 2
+    assert second['volume'].iloc[0] == first['volume'].iloc[0] + 1
+
+
+def test_the_cache_is_rebuilt_for_other_options(csv, reads):
+    trimmed = load_bars(str(csv))
+    untrimmed = load_bars(str(csv), trim=False)
+    assert len(reads) == 2
+    assert len(untrimmed) > len(trimmed)
+
+
+def test_an_interrupted_cache_is_rebuilt(csv, reads):
+    first = load_bars(str(csv))
+    # the metadata is written last, a cache without it was interrupted
+    os.remove(csv.parent / '.cache' / csv.name / 'meta.json')
+    second = load_bars(str(csv))
+    assert len(reads) == 2
+    pd.testing.assert_frame_equal(first, second)
@@ -0,0 +1,103 @@
+"""
+Tests of the overflow policies of the ingestion queues: the trades kept, merged or waited for,
+and their counters.
+"""
+import asyncio
+
+import pytest
+
+from ingest import CoalescedTrade, Ingest, IngestQueue
+from replay import Trade
+
+
+def run(queue, trades):
+    """
+    Put the trades in the queue without yielding to the event loop in between (unless the
+    queue blocks), then let it drain.
+    """
+    async def main():
+        for trade in trades:
+            await queue.put(trade)
+        while len(queue):
+            await asyncio.sleep(0)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def test_drop_oldest_keeps_the_latest_trades():
+    processed = []
+    queue = IngestQueue(processed.append, maxsize=3, policy='drop_oldest')
+    trades = [Trade('AAPL', 100.0 + i, 1, i) for i in range(10)]
+    run(queue, trades)
+    assert processed == trades[-3:]
+    stats = queue.stats()
+    assert (stats['received'], stats['processed'], stats['dropped']) == (10, 3, 7)
+    assert (stats['coalesced'], stats['blocked'], stats['max_depth']) == (0, 0, 3)
+
+
+def test_coalesce_merges_the_trades_of_a_timestamp():
+    processed = []
+    queue = IngestQueue(processed.append, maxsize=2, policy='coalesce')
+    trades = [Trade('AAPL', 100.0, 10, 1),
+              Trade('AAPL', 101.0, 10, 2),
+              Trade('AAPL', 102.0, 30, 2),
+              Trade('AAPL', 103.0, 60, 2),
+              # another timestamp cannot be merged, it waits for room
+              Trade('AAPL', 104.0, 5, 3)]
+    run(queue, trades)
+    assert [(t.price, t.size, t.timestamp) for t in processed] == [
+        (100.0, 10, 1), (pytest.approx((1010 + 3060 + 6180) / 100), 100, 2), (104.0, 5, 3)]
+    assert isinstance(processed[1], CoalescedTrade) and processed[1].trades == 3
+    stats = queue.stats()
+    assert (stats['received'], stats['processed'], stats['coalesced']) == (5, 3, 2)
+    assert (stats['dropped'], stats['blocked']) == (0, 1)
+
+
+def test_coalesce_does_not_merge_another_symbol():
+    processed = []
+    queue = IngestQueue(processed.append, maxsize=1, policy='coalesce')
+    trades = [Trade('AAPL', 100.0, 10, 1), Trade('TSLA', 200.0, 10, 1)]
+    run(queue, trades)
+    assert processed == trades
+    assert (queue.coalesced, queue.blocked) == (0, 1)
+
+
+def test_block_keeps_every_trade_in_order():
+    processed = []
+    queue = IngestQueue(processed.append, maxsize=2, policy='block', batch_size=1)
+    trades = [Trade('AAPL', 100.0 + i, 1, i) for i in range(10)]
+    run(queue, trades)
+    assert processed == trades
+    assert (queue.dropped, queue.coalesced, queue.max_depth) == (0, 0, 2)
+    assert queue.blocked > 0
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        IngestQueue(print, policy='drop_newest')
+
+
+def test_ingest_sums_the_counters_of_its_queues():
+    processed = []
+    ingest = Ingest(processed.append, maxsize=2, policy='drop_oldest')
+    trades = [Trade(symbol, 100.0, 1, i) for i in range(5) for symbol in ('AAPL', 'TSLA')]
+
+    async def main():
+        for trade in trades:
+            await ingest.submit(trade)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main())
+    loop.close()
+    # the trades left when the stream stops
+    ingest.close()
+    assert ingest.depth() == 0
+    # every symbol has a queue of its own, which keeps its last two trades
+    expected = [t for t in trades if t.timestamp >= 3]
+    assert sorted(processed, key=lambda t: t.symbol) == sorted(expected, key=lambda t: t.symbol)
+    stats = ingest.stats()
+    assert (stats['queues'], stats['received'], stats['processed'], stats['dropped']) == (2, 10, 4, 6)
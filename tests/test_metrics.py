@@ -0,0 +1,82 @@
+"""
+Tests of the runtime metrics: the counters recorded by the trade handler, the lag of the event
+loop and the snapshots taken from other threads.
+"""
+import time
+import asyncio
+import threading
+import warnings
+
+import pandas as pd
+
+from bars import get_bars
+from metrics import Metrics
+from replay import ReplayConn, Trade
+
+
+def test_record_without_an_event_loop():
+    metrics = Metrics()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        metrics.record('AAPL', pd.Timestamp.now(tz='UTC'))
+        metrics.record('AAPL', pd.Timestamp.now(tz='UTC'), {'close': 1.0})
+    assert not metrics.watching
+    snapshot = metrics.snapshot()['symbols']['AAPL']
+    assert (snapshot['ticks'], snapshot['bars'], snapshot['bar_latency']['count']) == (2, 1, 1)
+
+
+def test_watch_loop_measures_the_lag():
+    metrics = Metrics(interval=0.01)
+
+    async def busy():
+        metrics.watch_loop()
+        assert metrics.watching
+        await asyncio.sleep(0.02)
+        # the loop is blocked, the next check runs late
+        time.sleep(0.2)
+        await asyncio.sleep(0.05)
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(busy())
+    loop.close()
+    assert not metrics.watching
+    lag = metrics.snapshot()['loop_lag']
+    assert lag['count'] > 1
+    assert lag['max'] >= 0.15
+
+
+def test_snapshots_while_recording_new_symbols():
+    metrics = Metrics(interval=0)
+    stop = threading.Event()
+    errors = []
+
+    def snapshots():
+        while not stop.is_set():
+            try:
+                metrics.snapshot()
+                metrics.render()
+            except Exception as e:
+                errors.append(e)
+                return
+
+    thread = threading.Thread(target=snapshots)
+    thread.start()
+    now = pd.Timestamp.now(tz='UTC')
+    for i in range(20000):
+        metrics.record(f'S{i}', now, {'close': 1.0})
+    stop.set()
+    thread.join()
+    assert errors == []
+    assert len(metrics.snapshot()['symbols']) == 20000
+
+
+def test_get_bars_watches_the_loop_of_the_trades(tmp_path):
+    timestamp = pd.date_range('2020-08-11 09:30', periods=2000, freq='100ms', tz='America/New_York')
+    trades = [Trade('AAPL', 100.0 + i % 7, 10, t) for i, t in enumerate(timestamp)]
+    metrics = Metrics(interval=0.001)
+    get_bars('tick_bar', 'AAPL', 100, str(tmp_path), conn=ReplayConn(trades=trades, speed=1000),
+             metrics=metrics)
+    snapshot = metrics.snapshot()
+    assert snapshot['symbols']['AAPL']['ticks'] == 2000
+    assert snapshot['symbols']['AAPL']['bars'] == 20
+    assert snapshot['loop_lag']['count'] > 0
@@ -0,0 +1,69 @@
+"""
+Tests that the replay of recorded trades through the realtime path gives the same bars as the
+offline builder.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from bars import build_bars
+from replay import read_trades, replay_bars
+from storage import HEADER
+
+SYMBOLS = ['AAPL', 'TSLA']
+
+
+@pytest.fixture
+def trades():
+    rng = np.random.default_rng(0)
+    n = 4000
+    return pd.DataFrame({
+        'timestamp': pd.date_range('2020-08-11 13:30', periods=n, freq='250ms', tz='UTC'),
+        'symbol': rng.choice(SYMBOLS, n),
+        'price': np.round(100 + np.cumsum(rng.normal(0, 0.02, n)), 2),
+        'size': rng.integers(1, 500, n)})
+
+
+def expected_bars(trades, bar_type, threshold, symbol):
+    own = trades[trades['symbol'] == symbol]
+    timestamp = pd.DatetimeIndex(own['timestamp']).tz_convert('America/New_York')
+    return build_bars(bar_type, threshold, own['price'].to_numpy(), own['size'].to_numpy(dtype=float),
+                      timestamp, symbol)
+
+
+def assert_replayed(save_to, trades, bar_type, threshold):
+    result = pd.read_csv(save_to / bar_type / 'realtime.csv')
+    assert list(result.columns) == HEADER
+    for symbol in SYMBOLS:
+        expected = expected_bars(trades, bar_type, threshold, symbol)
+        bars = result[result['symbol'] == symbol]
+        assert len(bars) == len(expected) > 0
+        assert list(bars['timestamp']) == [str(t) for t in expected['timestamp']]
+        np.testing.assert_allclose(bars[HEADER[2:]].to_numpy(dtype=float),
+                                   expected[HEADER[2:]].to_numpy(dtype=float), rtol=1e-9)
+
+
+@pytest.mark.parametrize('bar_type, threshold', [
+    ('tick_bar', 100),
+    ('volume_bar', 20000),
+    ('dollar_imbalance_bar', 50)])
+def test_replay_bars_match_build_bars(tmp_path, trades, bar_type, threshold):
+    path = tmp_path / 'trades.csv'
+    trades.to_csv(path, index=False)
+    stats = replay_bars(str(path), bar_type, SYMBOLS, dict.fromkeys(SYMBOLS, threshold),
+                        str(tmp_path / 'bars'))
+    assert stats['ticks'] == len(trades)
+    assert_replayed(tmp_path / 'bars', trades, bar_type, threshold)
+
+
+def test_replay_merges_the_files_in_time_order(tmp_path, trades):
+    paths = []
+    for symbol in SYMBOLS:
+        path = tmp_path / f'{symbol}.csv'
+        trades[trades['symbol'] == symbol].to_csv(path, index=False)
+        paths.append(str(path))
+    merged = list(read_trades(paths, chunksize=500))
+    assert [t.timestamp for t in merged] == sorted(t.timestamp for t in merged)
+    assert len(merged) == len(trades)
+    replay_bars(paths, 'volume_bar', SYMBOLS, dict.fromkeys(SYMBOLS, 20000), str(tmp_path / 'bars'))
+    assert_replayed(tmp_path / 'bars', trades, 'volume_bar', 20000)
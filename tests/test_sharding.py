@@ -0,0 +1,102 @@
+"""
+Tests of the sharding of the symbols over worker processes: the routing, the bars of the
+workers and their shutdown.
+"""
+import glob
+import time
+
+import numpy as np
+import pandas as pd
+
+from bars import build_bars
+from replay import Trade
+from sharding import ShardedBars, shard_of
+from storage import HEADER
+
+SYMBOLS = ['AAPL', 'TSLA', 'AMZN', 'MSFT', 'GOOG']
+
+
+def make_trades(n=3000, seed=0, symbols=SYMBOLS):
+    """
+    The trades of the symbols, interleaved in time.
+    """
+    rng = np.random.default_rng(seed)
+    timestamp = pd.date_range('2020-08-11 09:30', periods=n, freq='100ms', tz='America/New_York')
+    symbol = rng.choice(symbols, n)
+    price = np.round(100 + np.cumsum(rng.normal(0, 0.02, n)), 2)
+    size = rng.integers(1, 500, n).astype(float)
+    return [Trade(*trade) for trade in zip(symbol, price.tolist(), size.tolist(), timestamp)]
+
+
+def test_shard_of_is_stable_and_in_range():
+    for shards in (1, 2, 3, 8):
+        route = [shard_of(symbol, shards) for symbol in SYMBOLS]
+        assert all(0 <= shard < shards for shard in route)
+        assert route == [shard_of(symbol, shards) for symbol in SYMBOLS]
+    assert set(shard_of(symbol, 1) for symbol in SYMBOLS) == {0}
+    sharded = ShardedBars('tick_bar', dict.fromkeys(SYMBOLS, 10), '.', shards=3)
+    assert sharded.route == {symbol: shard_of(symbol, 3) for symbol in SYMBOLS}
+
+
+def test_sharded_bars_match_a_single_process(tmp_path):
+    trades = make_trades()
+    sharded = ShardedBars('volume_bar', dict.fromkeys(SYMBOLS, 5000), str(tmp_path), shards=3,
+                          batch_size=64)
+    sharded.start()
+    for trade in trades:
+        sharded.submit(trade)
+    sharded.stop()
+    files = glob.glob(str(tmp_path / 'volume_bar' / 'realtime_shard*.csv'))
+    result = pd.concat([pd.read_csv(path) for path in files])
+    assert list(result.columns) == HEADER
+    for symbol in SYMBOLS:
+        own = [t for t in trades if t.symbol == symbol]
+        expected = build_bars('volume_bar', 5000, [t.price for t in own], [t.size for t in own],
+                              pd.DatetimeIndex([t.timestamp for t in own]), symbol)
+        bars = result[result['symbol'] == symbol]
+        assert list(bars['timestamp']) == [str(t) for t in expected['timestamp']]
+        np.testing.assert_allclose(bars[HEADER[2:]].to_numpy(dtype=float),
+                                   expected[HEADER[2:]].to_numpy(dtype=float), rtol=1e-9)
+    stats = sharded.stats()
+    assert sum(s['ticks'] for s in stats) == sum(s['sent'] for s in stats) == len(trades)
+    assert sum(s['bars'] for s in stats) == len(result)
+
+
+def test_workers_stop_after_the_queued_trades(tmp_path):
+    sharded = ShardedBars('tick_bar', dict.fromkeys(SYMBOLS, 10), str(tmp_path), shards=2)
+    sharded.start()
+    for trade in make_trades(500):
+        sharded.submit(trade)
+    sharded.stop()
+    assert all(not worker.is_alive() and worker.exitcode == 0 for worker in sharded._workers)
+    stats = sharded.stats()
+    assert [s['alive'] for s in stats] == [False, False]
+    assert sum(s['ticks'] for s in stats) == 500
+    assert sum(s['dropped'] + s['backlog'] for s in stats) == 0
+
+
+def test_the_trades_of_a_dead_worker_are_dropped(tmp_path):
+    sharded = ShardedBars('tick_bar', {'AAPL': 10}, str(tmp_path), shards=1, batch_size=10)
+    sharded.start()
+    sharded._workers[0].terminate()
+    sharded._workers[0].join()
+    start = time.monotonic()
+    for trade in make_trades(100, symbols=['AAPL']):
+        sharded.submit(trade)
+    sharded.stop()
+    assert time.monotonic() - start < 5
+    assert sharded.stats()[0]['dropped'] == 100
+
+
+def test_a_full_queue_does_not_block_the_ingest(tmp_path):
+    # the workers are not started, so the queue of the shard is never drained
+    sharded = ShardedBars('tick_bar', {'AAPL': 10}, str(tmp_path), shards=1, queue_size=1,
+                          batch_size=10, backlog=3)
+    start = time.monotonic()
+    for trade in make_trades(100, symbols=['AAPL']):
+        sharded.submit(trade)
+    assert time.monotonic() - start < 1
+    # one batch in the queue, the last 3 in the backlog and the others dropped
+    stats = sharded.stats()[0]
+    assert (stats['sent'], stats['backlog'], stats['dropped']) == (10, 30, 60)
+    assert stats['queue_full'] == 9
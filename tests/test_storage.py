@@ -0,0 +1,167 @@
+"""
+Tests of the tail and time-range reads of the bar stores against full reads.
+"""
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import storage
+from storage import CSVIndex, CSVStore, ColumnarStore, HEADER
+
+SYMBOLS = ['AAPL', 'SPY', 'TSLA']
+
+
+def make_rows(n=3000, start='2020-08-10 09:30'):
+    """
+    Bars of three symbols, one every seven minutes over several days.
+    """
+    rng = np.random.default_rng(0)
+    times = pd.date_range(start, periods=n, freq='7min', tz='America/New_York')
+    return [[str(t), SYMBOLS[i % 3]] + [float(np.round(100 + rng.normal(), 2))] * 5 +
+            [10, 1000.0, 100000.0, 5, 500.0, 50000.0] for i, t in enumerate(times)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CSVStore(str(tmp_path))
+    rows = make_rows()
+    # appended in several batches, as the writer does
+    for lo in range(0, len(rows), 700):
+        store.append('volume_bar', rows[lo:lo + 700])
+    yield store
+    store.close()
+
+
+def full_read(store, symbol=None):
+    bars = pd.read_csv(store.path('volume_bar'), index_col=[0], parse_dates=[0],
+                       dtype={c: np.float64 for c in storage.PRICE_COLUMNS})
+    return bars if symbol is None else bars[bars['symbol'] == symbol]
+
+
+@pytest.mark.parametrize('symbol', [None, 'AAPL', 'TSLA'])
+@pytest.mark.parametrize('last', [1, 23, 5000])
+def test_tail_read_matches_full_read(store, symbol, last):
+    expected = full_read(store, symbol).iloc[-last:]
+    pd.testing.assert_frame_equal(store.read('volume_bar', symbol, last=last), expected)
+    pd.testing.assert_frame_equal(store.read('volume_bar', symbol, columns=['close'], last=last),
+                                  expected[['close']])
+
+
+def test_tail_read_across_small_blocks(store, monkeypatch):
+    monkeypatch.setattr(storage, 'TAIL_BLOCK_SIZE', 7)
+    expected = full_read(store, 'SPY').iloc[-40:]
+    pd.testing.assert_frame_equal(store.read('volume_bar', 'SPY', last=40), expected)
+
+
+def test_tail_read_skips_a_row_being_written(store):
+    expected = full_read(store, 'AAPL').iloc[-3:]
+    with open(store.path('volume_bar'), 'a') as f:
+        f.write('2020-09-01 10:00:00-04:00,AAPL,1.0,2.0')
+    pd.testing.assert_frame_equal(store.read('volume_bar', 'AAPL', last=3), expected)
+
+
+@pytest.mark.parametrize('symbol', [None, 'SPY'])
+@pytest.mark.parametrize('start, end', [
+    ('2020-08-11 10:00-04:00', '2020-08-11 15:00-04:00'),
+    ('2020-08-12 20:00-04:00', '2020-08-13 02:00-04:00'),
+    ('2020-08-13 00:00-04:00', None),
+    (None, '2020-08-10 12:00-04:00'),
+    ('2020-08-11 14:00:00+00:00', '2020-08-11 16:00:00+00:00')])
+def test_range_read_matches_full_read(store, symbol, start, end):
+    expected = full_read(store, symbol)
+    times = expected.index
+    mask = np.ones(len(times), dtype=bool)
+    if start is not None:
+        mask &= times >= pd.Timestamp(start)
+    if end is not None:
+        mask &= times <= pd.Timestamp(end)
+    result = store.read('volume_bar', symbol, start=start, end=end)
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(result, expected[mask])
+
+
+def test_index_has_the_first_bar_of_every_symbol_and_day(store):
+    index = store.index('volume_bar')
+    days = {(row[1], row[0][:10]) for row in make_rows()}
+    assert {(symbol, day) for _, symbol, day in index.entries} == days
+    with open(store.path('volume_bar'), 'rb') as f:
+        for offset, symbol, day in index.entries:
+            f.seek(offset)
+            timestamp, sym = f.readline().decode().split(',')[:2]
+            assert (sym, timestamp[:10]) == (symbol, day)
+
+
+def test_index_is_rebuilt_from_the_csv(store):
+    entries = store.index('volume_bar').entries
+    # a missing sidecar is rebuilt
+    fresh = CSVIndex(store.path('volume_bar'))
+    fresh.load()
+    assert fresh.entries == entries
+    # a sidecar that does not match the file is rebuilt too
+    with open(fresh.index_path, 'a') as f:
+        f.write('AAPL,2030-01-01,12\n')
+    stale = CSVIndex(store.path('volume_bar'))
+    stale.load()
+    assert stale.entries == entries
+
+
+@pytest.fixture
+def switch_often():
+    # switch threads often, so the reads interleave with the appends
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_index_is_consistent_with_concurrent_reads(tmp_path, switch_often):
+    store = CSVStore(str(tmp_path))
+    rows = make_rows()
+    errors = []
+    done = threading.Event()
+
+    def read():
+        # the strategies read the bars while the writer thread appends them
+        while not done.is_set():
+            try:
+                store.read('volume_bar', 'SPY', start='2020-08-11 09:30', end='2020-08-12 16:00')
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for lo in range(0, len(rows), 10):
+        store.append('volume_bar', rows[lo:lo + 10])
+    done.set()
+    for thread in readers:
+        thread.join()
+    store.close()
+    assert errors == []
+    fresh = CSVIndex(store.path('volume_bar'))
+    fresh.load()
+    entries = store.index('volume_bar').entries
+    assert entries == fresh.entries
+    # the sidecar has every entry once
+    with open(fresh.index_path) as f:
+        assert len(f.readlines()) == len(entries)
+
+
+def test_columnar_range_read_matches_full_read(tmp_path):
+    store = ColumnarStore(str(tmp_path))
+    store.append('volume_bar', make_rows())
+    start, end = '2020-08-11 10:00-04:00', '2020-08-12 11:00-04:00'
+    for symbol in [None, 'AAPL']:
+        expected = store.read('volume_bar', symbol)
+        expected = expected[(expected.index >= pd.Timestamp(start)) &
+                            (expected.index <= pd.Timestamp(end))]
+        pd.testing.assert_frame_equal(
+            store.read('volume_bar', symbol, start=start, end=end), expected)
+        pd.testing.assert_frame_equal(
+            store.read('volume_bar', symbol, last=5, start=start, end=end), expected.iloc[-5:])
@@ -0,0 +1,115 @@
+"""
+Tests of the background writer: the batching of the rows, the drain at shutdown and the rows the
+store fails to append.
+"""
+import time
+
+import pytest
+
+from storage import BarStore
+from writer import BarWriter
+
+
+class MemoryStore(BarStore):
+    """
+    A store keeping the appended batches in memory.
+    """
+
+    def __init__(self, fail: str = None):
+        """
+        :param fail :(str) a bar type the store fails to append.
+        """
+        self.fail = fail
+        self.batches = []
+        self.syncs = 0
+        self.closed = False
+
+    def append(self, bar_type, rows):
+        if bar_type == self.fail:
+            raise OSError(f'cannot append the {bar_type} rows')
+        self.batches.append((bar_type, list(rows)))
+
+    def sync(self):
+        self.syncs += 1
+
+    def close(self):
+        self.closed = True
+
+    def rows(self, bar_type):
+        return [row for kind, batch in self.batches if kind == bar_type for row in batch]
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_close_drains_the_queued_rows():
+    store = MemoryStore()
+    writer = BarWriter(store, flush_interval=60, batch_size=10 ** 6, fsync='close')
+    rows = [[i, 'AAPL'] for i in range(1234)]
+    for row in rows:
+        writer.write('tick_bar' if row[0] % 3 else 'volume_bar', row)
+    writer.close()
+    assert store.rows('tick_bar') == [row for row in rows if row[0] % 3]
+    assert store.rows('volume_bar') == [row for row in rows if not row[0] % 3]
+    assert writer.qsize() == 0
+    assert store.closed and store.syncs == 1
+    assert writer.failed == 0
+
+
+def test_a_full_batch_is_written_before_the_interval_ends():
+    store = MemoryStore()
+    writer = BarWriter(store, flush_interval=60, batch_size=10)
+    for i in range(25):
+        writer.write('tick_bar', [i])
+    assert wait_for(lambda: len(store.batches) == 2)
+    # the last rows wait for the interval or the shutdown
+    time.sleep(0.05)
+    assert [len(batch) for _, batch in store.batches] == [10, 10]
+    writer.close()
+    assert [len(batch) for _, batch in store.batches] == [10, 10, 5]
+    assert store.rows('tick_bar') == [[i] for i in range(25)]
+
+
+def test_the_rows_are_written_when_the_interval_ends():
+    store = MemoryStore()
+    writer = BarWriter(store, flush_interval=0.05, batch_size=10 ** 6)
+    for i in range(3):
+        writer.write('tick_bar', [i])
+    assert wait_for(lambda: len(store.rows('tick_bar')) == 3)
+    assert not store.closed
+    writer.close()
+    assert store.rows('tick_bar') == [[0], [1], [2]]
+
+
+def test_flush_writes_the_rows_queued_before_it():
+    store = MemoryStore()
+    writer = BarWriter(store, flush_interval=60, batch_size=10 ** 6, fsync='flush')
+    for i in range(3):
+        writer.write('tick_bar', [i])
+    assert writer.flush(timeout=5)
+    assert store.batches == [('tick_bar', [[0], [1], [2]])]
+    assert store.syncs == 1
+    writer.close()
+    assert store.closed and store.syncs == 1
+
+
+def test_failed_rows_are_counted_and_the_writer_goes_on():
+    store = MemoryStore(fail='volume_bar')
+    writer = BarWriter(store, flush_interval=60, batch_size=4)
+    for i in range(10):
+        writer.write('volume_bar' if i % 2 else 'tick_bar', [i])
+    writer.close()
+    assert writer.failed == 5
+    assert store.rows('tick_bar') == [[i] for i in range(0, 10, 2)]
+    assert store.closed
+
+
+def test_invalid_fsync_policy():
+    with pytest.raises(ValueError):
+        BarWriter(MemoryStore(), fsync='always')
@@ -0,0 +1,146 @@
+"""
+This script contains a writer that persists the bars in batches from a background thread.
+"""
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from storage import BarStore
+
+# a marker put in the queue to stop the writer
+_STOP = object()
+
+
+class BarWriter:
+    """
+    A writer shared by many EventDrivenBars instances. The rows are queued on the tick path
+    and appended to the store in batches by a background thread.
+    """
+
+    def __init__(
+            self,
+            store: BarStore,
+            flush_interval: float = 1.0,
+            batch_size: int = 500,
+            fsync: str = 'never'):
+        """
+        :param store :(BarStore) the storage backend to append the bars to.
+        :param flush_interval :(float) the maximum number of seconds a row waits in the queue.
+        :param batch_size :(int) the number of queued rows that triggers a write before the interval ends.
+        :param fsync :(str) when to sync the store to disk. Either "never", "flush" (after every batch)
+                      or "close" (once at shutdown).
+        """
+        if fsync not in ('never', 'flush', 'close'):
+            raise ValueError(
+                f'{fsync} is not a valid fsync policy. Please enter either "never", "flush" or "close"')
+        self.store = store
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.fsync = fsync
+        # the number of rows the store failed to append
+        self.failed = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name='BarWriter', daemon=True)
+        self._thread.start()
+        # drain the queue if the interpreter exits without closing the writer
+        atexit.register(self.close)
+
+    def write(self, bar_type: str, row: list):
+        """
+        Queue a bar to be appended to the store.
+        :param bar_type :(str) the type of the bar.
+        :param row :(list) the values of the bar in the order of HEADER.
+        """
+        self._queue.put((bar_type, row))
+
+    def qsize(self):
+        """
+        :return :(int) the approximate number of rows waiting to be written.
+        """
+        return self._queue.qsize()
+
+    def flush(self, timeout: float = None):
+        """
+        Block until every row queued before the call is written.
+        :param timeout :(float) the maximum number of seconds to wait.
+        :return :(bool) True if the rows were written before the timeout.
+        """
+        if not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        """
+        Write the remaining rows, close the store and stop the background thread.
+        """
+        atexit.unregister(self.close)
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _run(self):
+        """
+        The loop of the background thread. The rows are grouped by bar type and written when
+        the batch is full or the flush interval is over.
+        """
+        pending, count = {}, 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(pending)
+                self._close_store()
+                return
+            if isinstance(item, threading.Event):
+                # a flush was requested
+                self._write(pending)
+                pending, count = {}, 0
+                item.set()
+                continue
+            if item is not None:
+                pending.setdefault(item[0], []).append(item[1])
+                count += 1
+
+            if count >= self.batch_size or time.monotonic() >= deadline:
+                self._write(pending)
+                pending, count = {}, 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, pending: dict):
+        """
+        Append the batched rows to the store. A batch the store fails to append is logged and
+        counted in failed, so the thread keeps writing the next ones.
+        :param pending :(dict) the rows to write with the bar types as keys.
+        """
+        for bar_type, rows in pending.items():
+            try:
+                self.store.append(bar_type, rows)
+            except Exception as e:
+                self.failed += len(rows)
+                logging.exception(e)
+        if pending and self.fsync == 'flush':
+            try:
+                self.store.sync()
+            except OSError as e:
+                logging.exception(e)
+
+    def _close_store(self):
+        """
+        Close the store, syncing it to disk if required.
+        """
+        try:
+            if self.fsync == 'close':
+                self.store.sync()
+            self.store.close()
+        except Exception as e:
+            logging.exception(e)